@@ -0,0 +1,131 @@
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff", ".bmp")
+
+# Expands directories (recursively) and glob patterns into a sorted, de-duplicated list of image paths.
+def collect_images(inputs):
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.update(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            paths.update(p for p in glob.glob(item, recursive=True)
+                         if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(os.path.abspath(p) for p in paths)
+
+# Reads an existing manifest and returns the paths that already finished successfully.
+def load_completed(manifest_path):
+    completed = set()
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path, "r", encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by an interruption, that image simply gets processed again
+                continue
+            if entry.get('status') == 'ok':
+                completed.add(entry['path'])
+    return completed
+
+# Keeps every worker process on a single OpenCV thread so the pool does not oversubscribe the cores,
+# and loads the worker's Tesseract engine once before the first image arrives.
+def init_worker():
+    import cv2
+    import ocr_backend
+    cv2.setNumThreads(1)
+    ocr_backend.warm_up()
+
+# Runs OCR on a single receipt inside a worker process and returns its manifest entry.
+def ocr_one(path, rotate=True):
+    from receipt_parser import process_receipt
+
+    start = time.perf_counter()
+    try:
+        text = process_receipt(path, rotate=rotate)
+        if text is None:
+            return {'path': path, 'status': 'error', 'error': 'Could not read image',
+                    'seconds': time.perf_counter() - start}
+        return {'path': path, 'status': 'ok', 'text': text, 'seconds': time.perf_counter() - start}
+    except Exception as e:
+        return {'path': path, 'status': 'error', 'error': str(e), 'seconds': time.perf_counter() - start}
+
+# Fans the images out across a process pool and appends each result to the manifest as soon as it completes.
+# Images already marked as ok in the manifest are skipped, so an interrupted run can simply be restarted.
+def run_batch(paths, manifest_path, workers=None, rotate=True, report_every=50):
+    workers = workers or os.cpu_count() or 1
+    completed = load_completed(manifest_path)
+    pending = [p for p in paths if p not in completed]
+    print(f"{len(paths)} images found, {len(paths) - len(pending)} already done, {len(pending)} to process "
+          f"with {workers} workers")
+
+    ok = 0
+    failed = 0
+    start = time.perf_counter()
+    todo = iter(pending)
+    in_flight = set()
+
+    with open(manifest_path, "a", encoding='utf-8') as manifest, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+
+        # Keep a bounded number of images in flight instead of queueing the whole backlog up front
+        def refill():
+            while len(in_flight) < workers * 2:
+                path = next(todo, None)
+                if path is None:
+                    return
+                in_flight.add(executor.submit(ocr_one, path, rotate))
+
+        refill()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.discard(future)
+                entry = future.result()
+                manifest.write(json.dumps(entry) + "\n")
+                manifest.flush()
+
+                if entry['status'] == 'ok':
+                    ok += 1
+                else:
+                    failed += 1
+                    print(f"Error processing {entry['path']}: {entry['error']}")
+
+                finished = ok + failed
+                if finished % report_every == 0:
+                    elapsed = time.perf_counter() - start
+                    print(f"[{finished}/{len(pending)}] {finished / elapsed:.2f} images/sec")
+            refill()
+
+    elapsed = time.perf_counter() - start
+    rate = (ok + failed) / elapsed if elapsed > 0 else 0.0
+    print(f"Done: {ok} ok, {failed} failed in {elapsed:.1f}s ({rate:.2f} images/sec)")
+    return {'ok': ok, 'failed': failed, 'skipped': len(paths) - len(pending), 'seconds': elapsed,
+            'images_per_sec': rate}
+
+def main():
+    ap = argparse.ArgumentParser(description="Run OCR over many receipt images in parallel.")
+    ap.add_argument("inputs", nargs="+", help="directories and/or glob patterns of receipt images")
+    ap.add_argument("-m", "--manifest", default="ocr_manifest.jsonl",
+                    help="JSON lines file results are appended to (also used to resume)")
+    ap.add_argument("-w", "--workers", type=int, default=None,
+                    help="number of worker processes (default: number of cores)")
+    ap.add_argument("--no-rotate", action="store_true", help="do not rotate landscape images upright")
+    args = ap.parse_args()
+
+    paths = collect_images(args.inputs)
+    if not paths:
+        print("No images found.")
+        return
+
+    run_batch(paths, args.manifest, args.workers, rotate=not args.no_rotate)
+
+if __name__ == '__main__':
+    main()
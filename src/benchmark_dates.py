@@ -0,0 +1,104 @@
+import argparse
+import random
+import time
+from datetime import date
+from dateutil import parser
+from date_extraction import extract_date, find_dates, parse_date_string, to_mmddyyyy
+
+# Hand-written summary texts as Textract returns them, with the date a person would read off the receipt.
+CORPUS = [
+    ("WALMART 1234 MAIN ST ROGERS AR 72756 (479) 555-0123 TOTAL 23.45 10/23/2024 14:32", "10/23/2024"),
+    ("TARGET STORE T-1842 TOTAL $56.10 VISA 4321 2024-03-09", "03/09/2024"),
+    ("STARBUCKS #10293 Oct 5, 2024 GRANDE LATTE 5.45", "10/05/2024"),
+    ("SHELL 5724 GAS 12.001 GAL 3.459/GAL 41.51", None),
+    ("KROGER 11/02/23 BALANCE DUE 88.12", "11/02/2023"),
+    ("HOME DEPOT #455 REF 0455 00012 34567 TOTAL 129.99", None),
+    ("TRADER JOE'S 23 Feb 2024 TOTAL 42.10", "02/23/2024"),
+    ("CVS PHARMACY STORE 8291 EXTRACARE 1234567890 TOTAL 9.99 DATE 07-04-2024", "07/04/2024"),
+    ("PANERA BREAD 12 ITEMS SUBTOTAL 18.20 TAX 1.27 TOTAL 19.47", None),
+    ("COSTCO WHOLESALE #1041 31.12.2023 TOTAL 215.40", "12/31/2023"),
+    ("MCDONALD'S 15 2 4 TOTAL 8.99", None),
+    ("AMAZON ORDER 112-4455667-1234567 December 1st 2024 TOTAL 64.00", "12/01/2024"),
+    ("CHEVRON 0206 PUMP 3 TIME 08:15 TOTAL 45.00 1/9/2025", "01/09/2025"),
+    ("BEST BUY 555 1212 PHONE 804-555-1212 TOTAL 399.99", None),
+    ("WHOLE FOODS MARKET 2024/06/30 ORGANIC BANANAS 1.99", "06/30/2024"),
+    ("AUTH CODE 102324 TOTAL 12.50", None),
+    ("DOLLAR TREE 3 @ 1.25 TOTAL 3.75 THANK YOU 5-Jan-25", "01/05/2025"),
+    ("OLIVE GARDEN TABLE 14 GUESTS 4 TOTAL 86.40 TIP 15.00", None),
+]
+
+# The previous approach: dateutil on every whitespace token, first success wins.
+def legacy_extract(text):
+    for token in text.split():
+        try:
+            return parser.parse(token).strftime("%m/%d/%Y")
+        except (parser.ParserError, ValueError, OverflowError):
+            continue
+    return None
+
+def new_extract(text):
+    return to_mmddyyyy(extract_date(text))
+
+# Longer synthetic receipts: many tokens of noise (items, prices, codes) around one or no date.
+def synthetic_corpus(count, seed=0):
+    rng = random.Random(seed)
+    formats = [
+        lambda d: d.strftime("%m/%d/%Y"), lambda d: d.strftime("%Y-%m-%d"), lambda d: d.strftime("%b %d, %Y"),
+        lambda d: d.strftime("%d %b %Y"), lambda d: d.strftime("%m-%d-%y"),
+    ]
+    corpus = []
+    for _ in range(count):
+        words = []
+        for _ in range(rng.randint(40, 120)):
+            kind = rng.random()
+            if kind < 0.4:
+                words.append(rng.choice(["MILK", "BREAD", "EGGS", "SUBTOTAL", "TAX", "VISA", "ITEM", "QTY", "STORE"]))
+            elif kind < 0.8:
+                words.append(f"{rng.randint(0, 200)}.{rng.randint(0, 99):02d}")
+            else:
+                words.append(str(rng.randint(1, 99999)))
+        expected = None
+        if rng.random() < 0.8:
+            value = date(rng.randint(2019, 2025), rng.randint(1, 12), rng.randint(1, 28))
+            words.insert(rng.randrange(len(words)), rng.choice(formats)(value))
+            expected = value.strftime("%m/%d/%Y")
+        corpus.append((" ".join(words), expected))
+    return corpus
+
+# Runs an extractor over the corpus and counts correct dates, wrong dates and missed dates.
+def evaluate(extract, corpus):
+    start = time.perf_counter()
+    results = [extract(text) for text, _ in corpus]
+    elapsed = time.perf_counter() - start
+    correct = sum(1 for r, (_, expected) in zip(results, corpus) if r == expected)
+    wrong = sum(1 for r, (_, expected) in zip(results, corpus) if r is not None and r != expected)
+    missed = sum(1 for r, (_, expected) in zip(results, corpus) if r is None and expected is not None)
+    return {'correct': correct, 'wrong': wrong, 'missed': missed, 'ms_per_text': elapsed / len(corpus) * 1000}
+
+def clear_memo():
+    find_dates.cache_clear()
+    parse_date_string.cache_clear()
+
+# Compares the token-by-token dateutil approach with date_extraction on the hand-written corpus and on
+# a synthetic one, cold (empty memo) and warm (every text seen before).
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--synthetic", type=int, default=500, help="number of synthetic receipts")
+    ap.add_argument("--verbose", action="store_true", help="print every hand-written case")
+    args = ap.parse_args()
+
+    for name, corpus in (("hand-written", CORPUS), ("synthetic", synthetic_corpus(args.synthetic))):
+        print(f"{name} corpus ({len(corpus)} texts)")
+        clear_memo()
+        for label, extract in (("dateutil per token", legacy_extract), ("date_extraction cold", new_extract),
+                               ("date_extraction warm", new_extract)):
+            result = evaluate(extract, corpus)
+            print(f"  {label:22s} {result['correct']:4d} correct {result['wrong']:4d} wrong {result['missed']:4d} missed"
+                  f"  {result['ms_per_text']:.3f} ms/text")
+
+    if args.verbose:
+        for text, expected in CORPUS:
+            print(f"{expected!s:10s} legacy={legacy_extract(text)!s:10s} new={new_extract(text)!s:10s} {text}")
+
+if __name__ == '__main__':
+    main()
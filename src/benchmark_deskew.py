@@ -0,0 +1,92 @@
+import argparse
+import time
+import cv2
+import numpy as np
+from scipy.ndimage import rotate
+from deskew import find_skew_angle
+
+# Draws a plain receipt-like page (black text lines on white) and skews it by the given angle.
+# lines gives the text to draw, one entry per line (None fills the page with item lines); lines that
+# do not fit on the page are left out.
+def make_skewed_receipt(width, height, angle, lines=None):
+    img = np.full((height, width), 255, np.uint8)
+    scale = width / 600.0
+    line_height = int(30 * scale)
+    for i, y in enumerate(range(line_height * 2, height - line_height, line_height)):
+        if lines is None:
+            text = f"ITEM {i:03d}   QTY 1   PRICE {i * 1.37:8.2f}"
+        elif i < len(lines):
+            text = lines[i]
+        else:
+            break
+        cv2.putText(img, text, (int(40 * scale), y), cv2.FONT_HERSHEY_SIMPLEX, 0.6 * scale, 0, max(1, int(scale)))
+    M = cv2.getRotationMatrix2D((width // 2, height // 2), angle, 1.0)
+    return cv2.warpAffine(img, M, (width, height), flags=cv2.INTER_CUBIC, borderValue=255)
+
+# The original search: rotate the full image once per candidate angle and score the row histogram.
+def exhaustive_skew_angle(thresh, delta, limit):
+    def determine_score(arr, angle):
+        data = rotate(arr, angle, reshape=False, order=0)
+        histogram = np.sum(data, axis=1)
+        score = np.sum((histogram[1:] - histogram[:-1]) ** 2)
+        return histogram, score
+
+    scores = []
+    angles = np.arange(-limit, limit + delta, delta)
+    for angle in angles:
+        _, score = determine_score(thresh, angle)
+        scores.append(score)
+
+    return angles[scores.index(max(scores))]
+
+# Times both searches on synthetic receipts and checks that they agree within the tolerance.
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--width", type=int, default=3024, help="width of the synthetic receipt")
+    ap.add_argument("--height", type=int, default=4032, help="height of the synthetic receipt")
+    ap.add_argument("--angles", type=float, nargs="+", default=[-7.5, -2.0, 0.0, 3.5, 11.0],
+                    help="skew angles to apply to the synthetic receipt")
+    ap.add_argument("--delta", type=float, default=0.5)
+    ap.add_argument("--limit", type=float, default=15)
+    ap.add_argument("--tolerance", type=float, default=0.5,
+                    help="maximum allowed difference between the two detected angles")
+    ap.add_argument("--skip-exhaustive", action="store_true",
+                    help="only time the coarse-to-fine search")
+    args = ap.parse_args()
+
+    total_old = 0.0
+    total_new = 0.0
+    failures = 0
+
+    for skew in args.angles:
+        img = make_skewed_receipt(args.width, args.height, skew)
+        thresh = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+
+        start = time.perf_counter()
+        new_angle = find_skew_angle(thresh, args.delta, args.limit)
+        new_time = time.perf_counter() - start
+        total_new += new_time
+
+        if args.skip_exhaustive:
+            print(f"skew {skew:6.2f}: coarse-to-fine {new_angle:6.2f} in {new_time:7.3f}s")
+            continue
+
+        start = time.perf_counter()
+        old_angle = exhaustive_skew_angle(thresh, args.delta, args.limit)
+        old_time = time.perf_counter() - start
+        total_old += old_time
+
+        ok = abs(old_angle - new_angle) <= args.tolerance
+        failures += 0 if ok else 1
+        print(f"skew {skew:6.2f}: exhaustive {old_angle:6.2f} in {old_time:7.3f}s | "
+              f"coarse-to-fine {new_angle:6.2f} in {new_time:7.3f}s | {'OK' if ok else 'MISMATCH'}")
+
+    if not args.skip_exhaustive:
+        print(f"Total: exhaustive {total_old:.3f}s, coarse-to-fine {total_new:.3f}s, "
+              f"speedup {total_old / max(total_new, 1e-9):.1f}x")
+
+    if failures:
+        raise SystemExit(f"{failures} angle(s) differed by more than {args.tolerance} degrees")
+
+if __name__ == '__main__':
+    main()
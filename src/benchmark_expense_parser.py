@@ -0,0 +1,118 @@
+import argparse
+import random
+import time
+from date_extraction import extract_date, parse_date_string, to_mmddyyyy
+from expense_parser import parse_expense_response
+
+SUMMARY_TYPES = ['SUBTOTAL', 'TAX', 'OTHER', 'RECEIVER_ADDRESS', 'PAYMENT_TERMS', 'VENDOR_PHONE', 'INVOICE_RECEIPT_ID']
+
+def _field(field_type, text, rng, page, label=None):
+    field = {
+        'Type': {'Text': field_type, 'Confidence': rng.uniform(90, 100)},
+        'ValueDetection': {'Text': text, 'Confidence': rng.uniform(60, 100),
+                           'Geometry': {'BoundingBox': {'Width': 0.2, 'Height': 0.02, 'Left': 0.1, 'Top': 0.5}}},
+        'PageNumber': page,
+    }
+    if label:
+        field['LabelDetection'] = {'Text': label, 'Confidence': rng.uniform(60, 100)}
+    return field
+
+# Builds an AnalyzeExpense-shaped response: one expense document per receipt, each spanning several
+# pages with summary fields, and one line item group per page.
+def synthetic_response(documents=1, pages=1, items_per_page=30, fields_per_page=12, seed=0):
+    rng = random.Random(seed)
+    expense_documents = []
+    for d in range(documents):
+        summary, groups = [], []
+        for page in range(1, pages + 1):
+            for _ in range(fields_per_page):
+                summary.append(_field(rng.choice(SUMMARY_TYPES), f"{rng.randint(1, 9999)}.{rng.randint(0, 99):02d}",
+                                      rng, page, label="SUBTOTAL"))
+            lines = []
+            for i in range(items_per_page):
+                price = f"{rng.randint(1, 99)}.{rng.randint(0, 99):02d}"
+                lines.append({'LineItemExpenseFields': [
+                    _field('ITEM', f"ITEM {page}-{i} GROCERY", rng, page),
+                    _field('PRICE', price, rng, page),
+                    _field('QUANTITY', str(rng.randint(1, 4)), rng, page),
+                    _field('EXPENSE_ROW', f"ITEM {page}-{i} GROCERY {price}", rng, page),
+                ]})
+            groups.append({'LineItemGroupIndex': page, 'LineItems': lines})
+        summary.append(_field('VENDOR_NAME', "WHOLE FOODS MARKET", rng, 1))
+        summary.append(_field('VENDOR_ADDRESS', "WHOLE FOODS MARKET\n100 MAIN ST AUSTIN TX", rng, 1))
+        summary.append(_field('INVOICE_RECEIPT_DATE', "03/14/2024 18:02", rng, 1))
+        summary.append(_field('TOTAL', f"${rng.randint(10, 999)}.{rng.randint(0, 99):02d}", rng, pages, label="TOTAL"))
+        expense_documents.append({'ExpenseIndex': d + 1, 'SummaryFields': summary, 'LineItemGroups': groups})
+    return {'DocumentMetadata': {'Pages': pages * documents}, 'ExpenseDocuments': expense_documents}
+
+# The previous extract_expense_details: a loop over the summary fields matching types, and a second
+# walk to rebuild the text for the date fallback. It stored the total as TotalAmount and left
+# TotalSpent (what extract_entities.clean_total reads) at None, and ignored line items.
+def legacy_extract(response):
+    details = {'TotalSpent': None, 'VendorName': None, 'VendorAddress': None, 'TransactionDate': None}
+    for document in response.get('ExpenseDocuments', []):
+        for summary_field in document.get('SummaryFields', []):
+            field_type = summary_field.get('Type', {}).get('Text', '')
+            field_value = summary_field.get('ValueDetection', {}).get('Text', '')
+            if field_type == 'TOTAL':
+                details['TotalAmount'] = field_value
+            elif field_type == 'VENDOR_NAME':
+                details['VendorName'] = field_value
+            elif field_type == 'VENDOR_ADDRESS':
+                details['VendorAddress'] = field_value
+            elif field_type in ['TRANSACTION_DATE', 'DATE', 'INVOICE_RECEIPT_DATE']:
+                if field_value:
+                    parsed_date = to_mmddyyyy(parse_date_string(field_value))
+                    if parsed_date:
+                        details['TransactionDate'] = parsed_date
+    if not details['TransactionDate']:
+        all_text = " ".join([
+            field.get('ValueDetection', {}).get('Text', '')
+            for document in response.get('ExpenseDocuments', [])
+            for field in document.get('SummaryFields', [])
+        ])
+        details['TransactionDate'] = to_mmddyyyy(extract_date(all_text))
+    if details['VendorName'] and details['VendorAddress']:
+        details['VendorAddress'] = details['VendorAddress'].replace(details['VendorName'], '').strip()
+    return details
+
+def new_extract(response):
+    return parse_expense_response(response).to_details()
+
+def time_extract(extract, response, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        details = extract(response)
+    return (time.perf_counter() - start) / repeat * 1000, details
+
+# Times the previous extractor against expense_parser on responses of growing size: first on full
+# responses (the parser also reads the line items the legacy code skipped), then on responses with
+# summary fields only, where both do the same work.
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50, 200])
+    ap.add_argument("--items", type=int, default=30, help="line items per page")
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    print(f"{'pages':>5s} {'fields':>7s} {'items':>6s}  {'legacy ms':>9s} {'parser ms':>9s}  "
+          f"{'legacy TotalSpent':>17s} {'parser TotalSpent':>17s}")
+    for pages in args.pages:
+        response = synthetic_response(pages=pages, items_per_page=args.items)
+        fields = sum(len(d['SummaryFields']) for d in response['ExpenseDocuments'])
+        legacy_ms, legacy = time_extract(legacy_extract, response, args.repeat)
+        new_ms, new = time_extract(new_extract, response, args.repeat)
+        print(f"{pages:5d} {fields:7d} {len(new['LineItems']):6d}  {legacy_ms:9.2f} {new_ms:9.2f}  "
+              f"{legacy['TotalSpent']!s:>17s} {new['TotalSpent']!s:>17s}")
+
+    print("\nsummary fields only")
+    print(f"{'pages':>5s} {'fields':>7s}  {'legacy ms':>9s} {'parser ms':>9s}")
+    for pages in args.pages:
+        response = synthetic_response(pages=pages, items_per_page=0)
+        fields = sum(len(d['SummaryFields']) for d in response['ExpenseDocuments'])
+        legacy_ms, _ = time_extract(legacy_extract, response, args.repeat)
+        new_ms, _ = time_extract(new_extract, response, args.repeat)
+        print(f"{pages:5d} {fields:7d}  {legacy_ms:9.2f} {new_ms:9.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from datetime import datetime, timezone
+import cv2
+import numpy as np
+from benchmark_deskew import make_skewed_receipt
+from benchmark_expense_parser import synthetic_response
+from expense_parser import parse_expense_response
+from pipeline import PIPELINES, run_pipeline, text_accuracy
+
+# Baseline results to compare against. Timings only compare on the machine that recorded them.
+BASELINE_PATH = os.environ.get("RECEIPT_BENCHMARK_BASELINE", os.path.join(os.getcwd(), 'benchmark_baseline.json'))
+
+# Synthetic receipts, from a clean scan to a large phone photo. noise is the standard deviation of
+# the added Gaussian noise (0-255 scale), shadow the darkening at the far corner (0-1).
+SCENARIOS = {
+    'clean': {'width': 1200, 'height': 1600, 'skew': 0.0, 'noise': 0, 'shadow': 0.0},
+    'skewed': {'width': 1200, 'height': 1600, 'skew': 4.0, 'noise': 0, 'shadow': 0.0},
+    'noisy': {'width': 1200, 'height': 1600, 'skew': 0.0, 'noise': 30, 'shadow': 0.0},
+    'shadowed': {'width': 1200, 'height': 1600, 'skew': 0.0, 'noise': 0, 'shadow': 0.6},
+    'photo': {'width': 3024, 'height': 4032, 'skew': 2.5, 'noise': 12, 'shadow': 0.4},
+}
+
+# AnalyzeExpense responses for the extract_expense_details timings (pages, line items per page).
+EXPENSE_SIZES = [(1, 30), (10, 30), (50, 30)]
+
+# Regression thresholds: timings may grow by THRESHOLD (relative) and MIN_MS (absolute) before they
+# count, so sub-millisecond jitter never fails a run; OCR accuracy may drop by ACCURACY_DROP.
+THRESHOLD = 0.25
+MIN_MS = 5.0
+ACCURACY_DROP = 0.02
+
+VENDORS = ["CORNER GROCERY", "MAIN ST HARDWARE", "BLUE BOTTLE CAFE", "CITY PHARMACY", "GREEN LEAF MARKET"]
+ITEMS = ["MILK", "BREAD", "EGGS", "COFFEE", "APPLES", "BATTERIES", "TAPE", "SOAP", "PASTA", "RICE", "BANANAS"]
+
+# Text of a synthetic receipt: vendor, address and date, item lines with prices, then the totals.
+def receipt_lines(item_count, seed=0):
+    rng = random.Random(seed)
+    lines = [rng.choice(VENDORS), f"{rng.randint(10, 999)} MAIN ST SPRINGFIELD",
+             f"DATE {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2024"]
+    subtotal = 0.0
+    for _ in range(item_count):
+        price = rng.randint(99, 2999) / 100
+        subtotal += price
+        lines.append(f"{rng.choice(ITEMS)} {price:.2f}")
+    tax = round(subtotal * 0.07, 2)
+    lines += [f"SUBTOTAL {subtotal:.2f}", f"TAX {tax:.2f}", f"TOTAL {subtotal + tax:.2f}", "THANK YOU"]
+    return lines
+
+# Renders a receipt photo (BGR) with the given size, skew, noise and shadow, and returns it with the
+# text that was drawn on it. Deterministic for a given seed.
+def synthetic_receipt(width, height, skew=0.0, noise=0, shadow=0.0, seed=0):
+    line_height = int(30 * width / 600.0)
+    capacity = len(range(line_height * 2, height - line_height, line_height))
+    lines = receipt_lines(max(1, capacity - 7), seed)[:capacity]
+    img = make_skewed_receipt(width, height, skew, lines).astype(np.float32)
+
+    if shadow:
+        # Light falls off towards the bottom right corner
+        ramp = (np.linspace(0, 1, height, dtype=np.float32)[:, None] +
+                np.linspace(0, 1, width, dtype=np.float32)[None, :]) / 2
+        img *= 1.0 - shadow * ramp
+    if noise:
+        img += np.random.default_rng(seed).normal(0, noise, img.shape).astype(np.float32)
+
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR), "\n".join(lines)
+
+# True when Tesseract can run here (in-process engine or the tesseract binary).
+def ocr_available():
+    try:
+        import pytesseract
+        from ocr_backend import has_persistent_engine
+        if has_persistent_engine():
+            return True
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+def median_ms(values):
+    return round(statistics.median(values) * 1000, 3)
+
+# Times decode + every stage of each pipeline on one synthetic receipt, and optionally OCR and its
+# character accuracy against the drawn text. Returns flat "<scenario>/<pipeline>/<metric>" results.
+def run_scenario(name, spec, pipelines, repeat=3, ocr=False, seed=0):
+    img, truth = synthetic_receipt(**spec, seed=seed)
+    encoded = np.frombuffer(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes(), np.uint8)
+    results = {}
+
+    decode_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        decode_times.append(time.perf_counter() - start)
+    results[f"{name}/decode_ms"] = median_ms(decode_times)
+
+    for pipeline in pipelines:
+        totals, stages = [], {}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            decoded = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+            output, timings = run_pipeline(decoded, pipeline)
+            totals.append(time.perf_counter() - start)
+            for t in timings:
+                stages.setdefault(t['stage'], []).append(t['seconds'])
+
+        prefix = f"{name}/{pipeline}"
+        results[f"{prefix}/pipeline_ms"] = median_ms(totals)
+        for stage, values in stages.items():
+            results[f"{prefix}/stage.{stage}_ms"] = median_ms(values)
+
+        if ocr:
+            from ocr_backend import image_to_string
+            start = time.perf_counter()
+            text = image_to_string(output, psm=6)
+            ocr_seconds = time.perf_counter() - start
+            results[f"{prefix}/ocr_ms"] = round(ocr_seconds * 1000, 3)
+            results[f"{prefix}/end_to_end_ms"] = round(results[f"{prefix}/pipeline_ms"] + ocr_seconds * 1000, 3)
+            results[f"{prefix}/ocr_accuracy"] = round(text_accuracy(text, truth), 4)
+
+    return results
+
+# Times extract_expense_details (expense_parser) on synthetic AnalyzeExpense responses.
+def run_expense_benchmarks(repeat=3):
+    results = {}
+    for pages, items in EXPENSE_SIZES:
+        response = synthetic_response(pages=pages, items_per_page=items)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse_expense_response(response).to_details()
+            times.append(time.perf_counter() - start)
+        results[f"expense/{pages}_pages_ms"] = median_ms(times)
+    return results
+
+# Compares results with a baseline. Returns one row per metric (key, baseline, current, status) and
+# the keys that regressed. Metrics missing from either side are reported but never fail the run.
+def compare(results, baseline, threshold=THRESHOLD, min_ms=MIN_MS, accuracy_drop=ACCURACY_DROP):
+    rows, regressions = [], []
+    for key in sorted(set(results) | set(baseline)):
+        current, base = results.get(key), baseline.get(key)
+        if base is None or current is None:
+            rows.append((key, base, current, "new" if base is None else "missing"))
+            continue
+        if key.endswith("_ms"):
+            regressed = current > base * (1 + threshold) and current - base > min_ms
+        elif key.endswith("_accuracy"):
+            regressed = current < base - accuracy_drop
+        else:
+            regressed = False
+        if regressed:
+            regressions.append(key)
+        rows.append((key, base, current, "REGRESSION" if regressed else "ok"))
+    return rows, regressions
+
+def format_rows(rows):
+    lines = [f"{'metric':<58}{'baseline':>12}{'current':>12}{'change':>9}  status"]
+    for key, base, current, status in rows:
+        change = f"{(current - base) / base * 100:+.0f}%" if base and current is not None else ""
+        lines.append(f"{key:<58}{base if base is not None else '-':>12}{current if current is not None else '-':>12}"
+                     f"{change:>9}  {status}")
+    return "\n".join(lines)
+
+def machine_info():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'opencv': cv2.__version__, 'numpy': np.__version__}
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_results(path, results, settings):
+    data = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'machine': machine_info(),
+            'settings': settings, 'results': results}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+# Runs the suite on synthetic receipts and compares it with the saved baseline:
+#   python benchmark_suite.py                      (exits non-zero on regressions)
+#   python benchmark_suite.py --save-baseline      (record the current results as the baseline)
+#   python benchmark_suite.py --scenarios clean photo --pipelines receipt_parser --repeat 5
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    ap.add_argument("--pipelines", nargs="+", choices=sorted(PIPELINES), default=sorted(PIPELINES))
+    ap.add_argument("--repeat", type=int, default=3, help="runs per measurement (the median is kept)")
+    ap.add_argument("--no-ocr", action="store_true", help="skip OCR even when Tesseract is available")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    ap.add_argument("--output", default=None, help="also write this run's results to a JSON file")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed relative slowdown")
+    ap.add_argument("--min-ms", type=float, default=MIN_MS, help="allowed absolute slowdown")
+    ap.add_argument("--accuracy-drop", type=float, default=ACCURACY_DROP, help="allowed OCR accuracy drop")
+    args = ap.parse_args()
+
+    ocr = not args.no_ocr and ocr_available()
+    if not args.no_ocr and not ocr:
+        print("Tesseract not available, OCR accuracy is not measured.")
+
+    results = {}
+    start = time.perf_counter()
+    for name in args.scenarios:
+        scenario_start = time.perf_counter()
+        results.update(run_scenario(name, SCENARIOS[name], args.pipelines, args.repeat, ocr))
+        print(f"{name}: {time.perf_counter() - scenario_start:.1f}s")
+    results.update(run_expense_benchmarks(args.repeat))
+    print(f"Suite finished in {time.perf_counter() - start:.1f}s")
+
+    settings = {'repeat': args.repeat, 'ocr': ocr, 'scenarios': args.scenarios, 'pipelines': args.pipelines}
+    if args.output:
+        save_results(args.output, results, settings)
+
+    baseline = load_baseline(args.baseline)
+    if args.save_baseline or baseline is None:
+        save_results(args.baseline, results, settings)
+        print(format_rows([(key, None, value, "recorded") for key, value in sorted(results.items())]))
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if baseline.get('machine') != machine_info():
+        print("Warning: the baseline was recorded on a different machine or library versions, "
+              "timings may not be comparable.")
+    rows, regressions = compare(results, baseline['results'], args.threshold, args.min_ms, args.accuracy_drop)
+    print(format_rows(rows))
+    if regressions:
+        raise SystemExit(f"{len(regressions)} metric(s) regressed beyond the threshold: {', '.join(regressions)}")
+    print("No regressions.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import argparse
+import json
+import os
+from extract_entities import process_receipts_data
+
+# Reads receipts from a JSON file (a list of objects) or a JSON lines file (one object per line)
+def load_receipts(path):
+    with open(path, "r", encoding='utf-8') as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+# Imports extracted receipt data (TotalSpent, VendorName, VendorAddress, TransactionDate) into
+# DynamoDB with batched writes and reports the per-batch latency and throughput
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("files", nargs="+", help="JSON or JSON lines files with receipt data")
+    args = ap.parse_args()
+
+    receipts = []
+    for path in args.files:
+        if not os.path.exists(path):
+            print(f"File does not exist: {path}")
+            return
+        receipts.extend(load_receipts(path))
+
+    print(f"Importing {len(receipts)} receipts...")
+    summary = process_receipts_data(receipts)
+    print(f"Batch latencies (s): {summary['batch_seconds']}")
+
+    if summary['unprocessed']:
+        print(f"{len(summary['unprocessed'])} receipts could not be written:")
+        for item in summary['unprocessed']:
+            print(json.dumps(item, default=str))
+
+if __name__ == '__main__':
+    main()
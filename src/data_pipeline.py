@@ -1,117 +1,119 @@
-import boto3
-import os
-import json
-from extract_entities import process_receipt_data
-from dateutil import parser
-
-"""
-Attempt to parse any potential date string using dateutil, returning MM/DD/YYYY format
-returns None if the string can't be parsed
-"""
-def parse_date_to_mmddyyyy(date_str : str) -> str:
-    try:
-        dt = parser.parse(date_str)
-        return dt.strftime("%m/%d/%Y")
-    except (parser.ParserError, ValueError):
-        return None
-
-
-# AWS Textract client setup
-textract = boto3.client('textract')
-
-# Function to process receipt using AnalyzeExpense API
-def process_receipt_with_textract(file_path):
-    try:
-        # Load the image as bytes
-        with open(file_path, 'rb') as document:
-            image_bytes = document.read()
-
-        # Call Textract's AnalyzeExpense API
-        response = textract.analyze_expense(Document={'Bytes': image_bytes})
-
-        # Extract key details from the response
-        receipt_data = extract_expense_details(response)
-
-        return receipt_data
-
-    except Exception as e:
-        print(f"Error processing receipt: {e}")
-        return None
-
-# Function to extract specific fields from AnalyzeExpense API response
-def extract_expense_details(response):
-    details = {
-        'TotalSpent': None,
-        'VendorName': None,
-        'VendorAddress': None,
-        'TransactionDate': None
-    }
-
-    
-    # Iterate through expense documents
-    for document in response.get('ExpenseDocuments', []):
-        for summary_field in document.get('SummaryFields', []):
-            field_type = summary_field.get('Type', {}).get('Text', '')
-            field_value = summary_field.get('ValueDetection', {}).get('Text', '')
-
-            if field_type == 'TOTAL':
-                details['TotalAmount'] = field_value
-            elif field_type == 'VENDOR_NAME':
-                details['VendorName'] = field_value
-            elif field_type == 'VENDOR_ADDRESS':
-                details['VendorAddress'] = field_value
-            elif field_type in ['TRANSACTION_DATE', 'DATE', 'INVOICE_RECEIPT_DATE']:
-                if field_value:
-                    parsed_date = parse_date_to_mmddyyyy(field_value)
-                    if parsed_date:
-                        details['TransactionDate'] = parsed_date
-
-    # If no TransactionDate is found, search the entire text for a potential date
-    if not details['TransactionDate']:
-        all_text = " ".join([
-            field.get('ValueDetection', {}).get('Text', '')
-            for document in response.get('ExpenseDocuments', [])
-            for field in document.get('SummaryFields', [])
-        ])
-        # Split on whitespace and try to parse each token with dateutil
-        for token in all_text.split():
-            parsed_date = parse_date_to_mmddyyyy(token)
-            if parsed_date:
-                details['TransactionDate'] = parsed_date
-                break  # Use the first valid date we find
-
-    """
-    Ran into an issue where vendor addresses were sometimes getting appended to the vendor name
-    This solves that issue
-    """
-    if details['VendorName'] and details['VendorAddress']:
-        details['VendorAddress'] = details['VendorAddress'].replace(details['VendorName'], '').strip()
-
-    return details
-
-# Main function to handle user input and process receipts
-def main():
-    image_path = input("Enter the image file name or path: ")
-    if not os.path.isabs(image_path):
-        image_path = os.path.join(os.getcwd(), image_path)
-
-    if not os.path.exists(image_path):
-        print("File does not exist.")
-        return
-
-    print("Processing receipt...")
-    receipt_data = process_receipt_with_textract(image_path)
-
-    if receipt_data:
-        print("Receipt Details:")
-        print(json.dumps(receipt_data, indent=4))
-
-        # Pass the extracted details to the DynamoDB processing function
-        print("Saving receipt data to DynamoDB...")
-        process_receipt_data(receipt_data)
-
-    else:
-        print("Failed to extract receipt details.")
-
-if __name__ == '__main__':
-    main()
+import boto3
+import os
+import json
+import time
+from extract_entities import process_receipt_data
+from date_extraction import parse_date_string, to_mmddyyyy
+from expense_parser import parse_expense_response
+from image_normalization import DEFAULT_MAX_BYTES, DEFAULT_MAX_SIDE, normalize_for_upload
+from instrumentation import get_logger, instrument_aws, span
+from result_cache import cache_key, get_default_cache
+from vendor_names import canonicalize_receipt
+
+"""
+Attempt to parse a date field value (see date_extraction.py), returning MM/DD/YYYY format
+returns None if the string can't be parsed
+"""
+def parse_date_to_mmddyyyy(date_str : str) -> str:
+    return to_mmddyyyy(parse_date_string(date_str))
+
+
+# AWS Textract client setup
+textract = instrument_aws(boto3.client('textract'))
+
+log = get_logger("pipeline")
+
+# Engine name used in the result cache key
+TEXTRACT_ENGINE = "textract.analyze_expense"
+
+# Settings for the pre-upload normalization (see image_normalization.py)
+NORMALIZE_SETTINGS = {'max_side': DEFAULT_MAX_SIDE, 'max_bytes': DEFAULT_MAX_BYTES, 'grayscale': True}
+
+# Calls AnalyzeExpense through the result cache. The raw response is what gets cached, so a retried
+# upload skips the Textract call but still runs extract_expense_details on the stored response.
+# With normalize=True the image is shrunk to a receipt-sized grayscale JPEG before it is sent.
+# Documents PIL cannot decode (PDFs, which AnalyzeExpense also accepts) are sent as they are.
+def analyze_expense_cached(image_bytes, use_cache=True, normalize=True):
+    def call_textract():
+        payload = image_bytes
+        if normalize:
+            try:
+                payload, report = normalize_for_upload(image_bytes, **NORMALIZE_SETTINGS)
+                log.info("upload normalized", original_bytes=report['original_bytes'],
+                         normalized_bytes=report['normalized_bytes'], quality=report['quality'],
+                         ms=round(report['seconds'] * 1000, 1))
+            # UnidentifiedImageError and truncated-image errors are both OSErrors
+            except OSError as e:
+                log.info("upload not normalized, sending original bytes", bytes=len(image_bytes), error=str(e))
+
+        start = time.perf_counter()
+        response = textract.analyze_expense(Document={'Bytes': payload})
+        log.info("textract analyze_expense", bytes=len(payload), ms=round((time.perf_counter() - start) * 1000, 1))
+        response.pop('ResponseMetadata', None)
+        return response
+
+    if not use_cache:
+        return call_textract()
+
+    key = cache_key(image_bytes, TEXTRACT_ENGINE, NORMALIZE_SETTINGS if normalize else None)
+    return get_default_cache().get_or_compute(key, call_textract)
+
+# Function to process receipt using AnalyzeExpense API
+# Accepts a file path or the image bytes themselves (e.g. an upload that is already in memory)
+def process_receipt_with_textract(source):
+    try:
+        # Load the image as bytes
+        if isinstance(source, (bytes, bytearray)):
+            image_bytes = bytes(source)
+        else:
+            with open(source, 'rb') as document:
+                image_bytes = document.read()
+
+        # Call Textract's AnalyzeExpense API (or reuse the stored response for an identical image)
+        response = analyze_expense_cached(image_bytes)
+
+        # Extract key details from the response
+        with span("parse.expense"):
+            receipt_data = extract_expense_details(response)
+
+        # Map the OCR'd vendor name onto a known vendor ("WAL-MART #1234" -> "Walmart")
+        with span("vendor.canonicalize"):
+            receipt_data = canonicalize_receipt(receipt_data)
+
+        return receipt_data
+
+    except Exception as e:
+        log.exception("receipt processing failed", error=str(e))
+        return None
+
+# Function to extract specific fields from AnalyzeExpense API response
+# (summary fields, line items and confidences; see expense_parser.py)
+def extract_expense_details(response):
+    return parse_expense_response(response).to_details()
+
+# Main function to handle user input and process receipts
+def main():
+    image_path = input("Enter the image file name or path: ")
+    if not os.path.isabs(image_path):
+        image_path = os.path.join(os.getcwd(), image_path)
+
+    if not os.path.exists(image_path):
+        print("File does not exist.")
+        return
+
+    print("Processing receipt...")
+    receipt_data = process_receipt_with_textract(image_path)
+
+    if receipt_data:
+        print("Receipt Details:")
+        print(json.dumps(receipt_data, indent=4))
+
+        # Pass the extracted details to the DynamoDB processing function
+        print("Saving receipt data to DynamoDB...")
+        process_receipt_data(receipt_data)
+
+    else:
+        print("Failed to extract receipt details.")
+
+if __name__ == '__main__':
+    main()
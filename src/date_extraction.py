@@ -0,0 +1,116 @@
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from dateutil import parser as dateutil_parser
+
+# Receipt dates outside this range are treated as misreads (phone numbers, totals, ...).
+MIN_YEAR = 1990
+MAX_YEAR_AHEAD = 1
+
+MEMO_SIZE = 4096
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+# Whole month words only, so "MARKET" or "JUNK" are not months
+_MONTH = (r"\b(?=[adfjmnos])(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|"
+          r"sept?(?:ember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b\.?")
+
+# Candidate date spans, in the order they are tried. Digits must not touch other digits, so parts of
+# longer numbers (card numbers, phone numbers, UPCs) are never read as dates.
+# Each pattern yields (year, month, day) groups through its parser below.
+PATTERNS = [
+    # 2024-10-23, 2024/10/23
+    ('ymd', re.compile(r"(?<!\d)(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?!\d)")),
+    # 10/23/2024, 10-23-24, 23.10.2024
+    ('numeric', re.compile(r"(?<![\d/.-])(\d{1,2})([-/.])(\d{1,2})\2(\d{4}|\d{2})(?![\d/.-]|:\d)")),
+    # Oct 23, 2024 / October 23rd 2024
+    ('mdy_name', re.compile(_MONTH + r"\s*(\d{1,2})(?!\d)(?:st|nd|rd|th)?,?\s*'?(\d{4}|\d{2})(?!\d)", re.IGNORECASE)),
+    # 23 Oct 2024 / 23-Oct-24
+    ('dmy_name', re.compile(r"(?<!\d)(\d{1,2})[\s-]*" + _MONTH + r"[\s,-]*'?(\d{4}|\d{2})(?!\d)", re.IGNORECASE)),
+]
+
+def _year(value):
+    year = int(value)
+    return year + 2000 if year < 100 else year
+
+# Builds a date if the parts form a real, plausible receipt date.
+def _valid(year, month, day):
+    if not MIN_YEAR <= year <= date.today().year + MAX_YEAR_AHEAD:
+        return None
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+def _from_match(kind, match):
+    groups = match.groups()
+    if kind == 'ymd':
+        return _valid(int(groups[0]), int(groups[1]), int(groups[2]))
+    if kind == 'numeric':
+        first, second, year = int(groups[0]), int(groups[2]), _year(groups[3])
+        # US order by default; a first part over 12 can only be a day (23/10/2024)
+        if first > 12 and second <= 12:
+            return _valid(year, second, first)
+        return _valid(year, first, second)
+    if kind == 'mdy_name':
+        return _valid(_year(groups[2]), MONTHS[groups[0][:3].lower()], int(groups[1]))
+    return _valid(_year(groups[2]), MONTHS[groups[1][:3].lower()], int(groups[0]))
+
+# Cheap checks that skip patterns which cannot match: numeric dates need two separated digit groups
+# (prices like 12.34 do not qualify), named dates need a month abbreviation somewhere in the text.
+_NUMERIC_HINT = re.compile(r"\d[-/.]\d{1,2}[-/.]\d")
+
+# All dates found in free text, in order of appearance. Where two candidates overlap
+# ("21 Jul 13, 2022") the longer one wins.
+@lru_cache(maxsize=MEMO_SIZE)
+def find_dates(text):
+    numeric = _NUMERIC_HINT.search(text) is not None
+    lowered = text.lower()
+    named = any(month in lowered for month in MONTHS)
+
+    candidates = []
+    for kind, pattern in PATTERNS:
+        if not (named if kind.endswith('_name') else numeric):
+            continue
+        for match in pattern.finditer(text):
+            value = _from_match(kind, match)
+            if value is not None:
+                candidates.append((match.start(), match.end(), value))
+
+    found = []
+    for start, end, value in sorted(candidates, key=lambda c: c[0] - c[1]):
+        if all(end <= s or start >= e for s, e, _ in found):
+            found.append((start, end, value))
+    found.sort(key=lambda f: f[0])
+    return tuple(value for _, _, value in found)
+
+# First date found in free text (e.g. all of a receipt's text), or None.
+def extract_date(text):
+    if not text:
+        return None
+    dates = find_dates(text)
+    return dates[0] if dates else None
+
+# Parses the value of a field that is known to hold a date (e.g. Textract's INVOICE_RECEIPT_DATE).
+# The receipt patterns are tried first; dateutil handles rarer layouts, but only for values that
+# contain both letters or separators and digits, so bare numbers are still rejected.
+@lru_cache(maxsize=MEMO_SIZE)
+def parse_date_string(value):
+    if not value:
+        return None
+    found = extract_date(value)
+    if found is not None:
+        return found
+    if not re.search(r"\d", value) or re.fullmatch(r"[\d\s$.,]+", value):
+        return None
+    try:
+        parsed = dateutil_parser.parse(value, fuzzy=True, default=datetime(1900, 1, 1))
+    except (dateutil_parser.ParserError, ValueError, OverflowError):
+        return None
+    return _valid(parsed.year, parsed.month, parsed.day)
+
+# Formats a date the way receipts are stored (MM/DD/YYYY).
+def to_mmddyyyy(value):
+    return value.strftime("%m/%d/%Y") if value is not None else None
@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+
+# Longest side (in pixels) of the image used for the coarse and the fine angle search.
+COARSE_SIZE = 800
+FINE_SIZE = 1600
+
+# Upper bound on the number of (angle, pixel) pairs scored at once, keeps memory bounded on large images.
+MAX_BATCH_ELEMENTS = 8_000_000
+
+# Shrinks a thresholded image so its longest side is at most max_size.
+# INTER_AREA keeps the averaged intensity, which works as a pixel weight for the projection profile.
+def downsample(thresh, max_size):
+    (h, w) = thresh.shape[:2]
+    scale = max_size / float(max(h, w))
+    if scale >= 1:
+        return thresh
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(thresh, size, interpolation=cv2.INTER_AREA)
+
+# Scores every candidate angle with the same projection-profile metric as the original deskew_image.
+# Instead of rotating the whole image once per angle, only the foreground pixel coordinates are rotated
+# (nearest neighbour, rotation about the image centre, pixels leaving the frame dropped), and the row
+# histograms for a batch of angles are built with a single bincount.
+def score_angles(thresh, angles):
+    (h, w) = thresh.shape[:2]
+    ys, xs = np.nonzero(thresh)
+    weights = thresh[ys, xs].astype(np.float64)
+
+    cy = (h - 1) / 2.0
+    cx = (w - 1) / 2.0
+    ys = ys.astype(np.float32) - cy
+    xs = xs.astype(np.float32) - cx
+
+    angles = np.asarray(angles, dtype=np.float64)
+    scores = np.zeros(len(angles), dtype=np.float64)
+    if len(weights) == 0:
+        return scores
+
+    batch = max(1, MAX_BATCH_ELEMENTS // len(weights))
+    for start in range(0, len(angles), batch):
+        chunk = np.deg2rad(angles[start:start + batch])
+        cos = np.cos(chunk).astype(np.float32)[:, None]
+        sin = np.sin(chunk).astype(np.float32)[:, None]
+
+        rows = np.rint(cos * ys - sin * xs + cy).astype(np.int64)
+        cols = np.rint(sin * ys + cos * xs + cx).astype(np.int64)
+        valid = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+
+        offsets = (np.arange(len(chunk), dtype=np.int64) * h)[:, None]
+        histogram = np.bincount((rows + offsets)[valid],
+                                weights=np.broadcast_to(weights, rows.shape)[valid],
+                                minlength=len(chunk) * h).reshape(len(chunk), h)
+        scores[start:start + len(chunk)] = np.sum(np.diff(histogram, axis=1) ** 2, axis=1)
+
+    return scores
+
+# Returns the candidate angle with the highest score (first one wins on ties, like list.index(max(...))).
+def best_of(thresh, angles):
+    scores = score_angles(thresh, angles)
+    return float(angles[int(np.argmax(scores))])
+
+# Estimates the skew angle of a thresholded image in degrees.
+# A coarse pass over the full [-limit, limit] range runs on a small copy of the image, then only the
+# neighbourhood of the best coarse angle is searched at the requested delta on a larger copy.
+# The result lies on the same grid as np.arange(-limit, limit + delta, delta).
+def find_skew_angle(thresh, delta=0.5, limit=15, coarse_delta=None,
+                    coarse_size=COARSE_SIZE, fine_size=FINE_SIZE):
+    if coarse_delta is None:
+        coarse_delta = max(delta, 2.0)
+
+    grid = np.arange(-limit, limit + delta, delta)
+
+    coarse_angles = np.arange(-limit, limit + coarse_delta, coarse_delta)
+    coarse_angles = coarse_angles[coarse_angles <= limit + 1e-9]
+    coarse_best = best_of(downsample(thresh, coarse_size), coarse_angles)
+
+    if coarse_delta <= delta:
+        return float(grid[int(np.argmin(np.abs(grid - coarse_best)))])
+
+    fine_angles = grid[np.abs(grid - coarse_best) <= coarse_delta + 1e-9]
+    return best_of(downsample(thresh, fine_size), fine_angles)
@@ -0,0 +1,202 @@
+import argparse
+import json
+from collections import defaultdict
+from date_extraction import extract_date, parse_date_string, to_mmddyyyy
+
+# Summary field types that can hold each detail, most specific first.
+TOTAL_TYPES = ('TOTAL', 'AMOUNT_PAID', 'AMOUNT_DUE')
+DATE_TYPES = ('INVOICE_RECEIPT_DATE', 'TRANSACTION_DATE', 'DATE')
+
+# Summary field types to_details reads. By default only these become ExpenseField records; the rest
+# (SUBTOTAL, TAX, OTHER, ...) are skipped after reading their type.
+DETAIL_TYPES = frozenset(TOTAL_TYPES + DATE_TYPES + ('VENDOR_NAME', 'VENDOR_ADDRESS'))
+
+# Line item field types and the LineItem attribute each one fills.
+LINE_ITEM_FIELDS = {
+    'ITEM': 'item', 'PRICE': 'price', 'QUANTITY': 'quantity', 'UNIT_PRICE': 'unit_price',
+    'PRODUCT_CODE': 'product_code', 'EXPENSE_ROW': 'row',
+}
+
+# One summary field of an AnalyzeExpense response (TOTAL, VENDOR_NAME, ...).
+# Confidence is Textract's confidence in the value, 0-100.
+class ExpenseField:
+    __slots__ = ('type', 'value', 'label', 'confidence', 'page', 'document')
+
+    def __init__(self, field_type, value, label=None, confidence=0.0, page=None, document=1):
+        self.type = field_type
+        self.value = value
+        self.label = label
+        self.confidence = confidence
+        self.page = page
+        self.document = document
+
+    def __repr__(self):
+        return f"ExpenseField({self.type}={self.value!r}, {self.confidence:.1f}%, page {self.page})"
+
+# One row of a LineItemGroup. Confidence is the lowest confidence among the row's fields.
+class LineItem:
+    __slots__ = ('item', 'price', 'quantity', 'unit_price', 'product_code', 'row', 'confidence', 'page',
+                 'group', 'document')
+
+    def __init__(self, group=1, document=1):
+        self.item = self.price = self.quantity = self.unit_price = self.product_code = self.row = None
+        self.confidence = 100.0
+        self.page = None
+        self.group = group
+        self.document = document
+
+    def __repr__(self):
+        return f"LineItem({self.item or self.row!r}, {self.price!r}, {self.confidence:.1f}%)"
+
+    def to_dict(self):
+        data = {
+            'Item': self.item or self.row, 'Price': self.price, 'Quantity': self.quantity,
+            'UnitPrice': self.unit_price, 'ProductCode': self.product_code,
+            'Confidence': round(self.confidence, 1), 'Page': self.page,
+        }
+        return {k: v for k, v in data.items() if v is not None}
+
+# An AnalyzeExpense response reduced to typed records, with summary fields indexed by type.
+class ParsedExpense:
+    __slots__ = ('fields', 'by_type', 'line_items', 'summaries')
+
+    def __init__(self):
+        self.fields = []                     # non-empty summary fields of the parsed types, in response order
+        self.by_type = defaultdict(list)     # field type -> fields of that type
+        self.line_items = []
+        self.summaries = []                  # each document's raw SummaryFields, for text()
+
+    # Highest-confidence field of the first type that is present (ties keep response order), or None.
+    def best(self, *field_types):
+        for field_type in field_types:
+            fields = self.by_type.get(field_type)
+            if fields:
+                return max(fields, key=lambda f: f.confidence)
+        return None
+
+    # All summary values joined, of every type, for searching free text (e.g. a date with no date field).
+    # Built from the raw response only when asked for, since most receipts have a date field.
+    def text(self):
+        return " ".join((field.get('ValueDetection') or {}).get('Text', '')
+                        for summary in self.summaries for field in summary)
+
+    # (date, confidence) from the date fields, best first; falls back to any date in the text,
+    # with confidence None.
+    def transaction_date(self):
+        for field_type in DATE_TYPES:
+            for field in sorted(self.by_type.get(field_type, ()), key=lambda f: -f.confidence):
+                parsed = parse_date_string(field.value)
+                if parsed is not None:
+                    return parsed, field.confidence
+        return extract_date(self.text()), None
+
+    # The receipt details dict the upload endpoints return and extract_entities stores.
+    # The total goes in both TotalAmount (read by the UI and the confirm endpoint) and TotalSpent
+    # (read by extract_entities.clean_total).
+    def to_details(self):
+        total = self.best(*TOTAL_TYPES)
+        vendor = self.best('VENDOR_NAME')
+        address = self.best('VENDOR_ADDRESS')
+        date, date_confidence = self.transaction_date()
+
+        total_value = total.value if total else None
+        details = {
+            'TotalSpent': total_value,
+            'TotalAmount': total_value,
+            'VendorName': vendor.value if vendor else None,
+            'VendorAddress': address.value if address else None,
+            'TransactionDate': to_mmddyyyy(date),
+            'LineItems': [item.to_dict() for item in self.line_items],
+        }
+
+        """
+        Ran into an issue where vendor addresses were sometimes getting appended to the vendor name
+        This solves that issue
+        """
+        if details['VendorName'] and details['VendorAddress']:
+            details['VendorAddress'] = details['VendorAddress'].replace(details['VendorName'], '').strip()
+
+        confidence = {'TotalAmount': total, 'VendorName': vendor, 'VendorAddress': address}
+        details['Confidence'] = {k: round(f.confidence, 1) for k, f in confidence.items() if f is not None}
+        if date_confidence is not None:
+            details['Confidence']['TransactionDate'] = round(date_confidence, 1)
+        return details
+
+# Parses an AnalyzeExpense response in one pass over its documents, summary fields and line items.
+# Only summary fields of field_types (DETAIL_TYPES by default, None for all) become ExpenseField
+# records. Fields in a group (Textract's newer NAME / ADDRESS fields with GroupProperties VENDOR) are
+# also indexed under GROUP_TYPE, so they are found as VENDOR_NAME / VENDOR_ADDRESS.
+def parse_expense_response(response, field_types=DETAIL_TYPES):
+    parsed = ParsedExpense()
+    fields, by_type, line_items = parsed.fields, parsed.by_type, parsed.line_items
+
+    for number, document in enumerate(response.get('ExpenseDocuments', ()), 1):
+        document_index = document.get('ExpenseIndex', number)
+        summary = document.get('SummaryFields', ())
+        parsed.summaries.append(summary)
+
+        for summary_field in summary:
+            type_info = summary_field.get('Type') or {}
+            field_type = type_info.get('Text', '')
+            groups = summary_field.get('GroupProperties')
+            aliases = [f"{group_type}_{field_type}" for group in groups for group_type in group.get('Types', ())
+                       if not field_type.startswith(group_type + '_')] if groups else ()
+            if field_types is not None and field_type not in field_types and \
+                    not (aliases and any(alias in field_types for alias in aliases)):
+                continue
+
+            detection = summary_field.get('ValueDetection') or {}
+            value = detection.get('Text', '')
+            if not value.strip():
+                continue
+            label = (summary_field.get('LabelDetection') or {}).get('Text')
+            confidence = detection.get('Confidence', type_info.get('Confidence', 0.0))
+            field = ExpenseField(field_type, value, label, confidence, summary_field.get('PageNumber'), document_index)
+            fields.append(field)
+            by_type[field_type].append(field)
+            for alias in aliases:
+                by_type[alias].append(field)
+
+        for group_number, group in enumerate(document.get('LineItemGroups', ()), 1):
+            group_index = group.get('LineItemGroupIndex', group_number)
+            for line in group.get('LineItems', ()):
+                item = LineItem(group_index, document_index)
+                for expense_field in line.get('LineItemExpenseFields', ()):
+                    type_info = expense_field.get('Type') or {}
+                    attribute = LINE_ITEM_FIELDS.get(type_info.get('Text'))
+                    if attribute is None:
+                        continue
+                    detection = expense_field.get('ValueDetection') or {}
+                    value = detection.get('Text', '').strip()
+                    if not value:
+                        continue
+                    setattr(item, attribute, value)
+                    confidence = detection.get('Confidence', type_info.get('Confidence', 0.0))
+                    if confidence < item.confidence:
+                        item.confidence = confidence
+                    if item.page is None:
+                        item.page = expense_field.get('PageNumber')
+                if item.item or item.row or item.price:
+                    line_items.append(item)
+
+    return parsed
+
+# Parse saved AnalyzeExpense responses (JSON files) and print the extracted details:
+#   python expense_parser.py response.json [--fields]
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("paths", nargs="+")
+    ap.add_argument("--fields", action="store_true", help="also list every summary field")
+    args = ap.parse_args()
+
+    for path in args.paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            parsed = parse_expense_response(json.load(f), field_types=None if args.fields else DETAIL_TYPES)
+        print(f"{path}: {len(parsed.fields)} fields, {len(parsed.line_items)} line items")
+        if args.fields:
+            for field in parsed.fields:
+                print(f"  {field!r}")
+        print(json.dumps(parsed.to_details(), indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,74 @@
-import re
-import boto3
-from botocore.exceptions import ClientError
-from decimal import Decimal
-
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
-
-# Define the tables in DynamoDB
-receipts_table = dynamodb.Table('ReceiptsTable')
-
-# Function to clean total value (only numbers and decimals)
-def clean_total(value):
-    if value is None:
-        return None
-    cleaned = re.sub(r'[^\d.]', '', str(value))
-    print(f"Original TOTAL: '{value}' | Cleaned TOTAL: '{cleaned}'")
-    return Decimal(cleaned) if cleaned else None
-
-# Helper function to put item into DynamoDB table with error handling
-def put_item_to_dynamodb(table, item):
-    try:
-        print(f"Attempting to add item: {item}")
-        table.put_item(Item=item)
-        print(f"Successfully added item: {item}")
-    except ClientError as e:
-        print(f"Failed to add item to table {table.name}: {e.response['Error']['Message']}")
-
-# Process structured receipt data
-def process_receipt_data(data):
-    # Extract and clean data
-    total_spent = clean_total(data.get("TotalSpent"))
-    vendor_name = data.get("VendorName")
-    vendor_address = data.get("VendorAddress")
-    transaction_date = data.get("TransactionDate")
-
-    # Prepare item for ReceiptsTable
-    receipt_item = {
-        'PK': f"vendor#{vendor_name}" if vendor_name else "unknown",
-        'SK': f"receipt#{transaction_date}" if transaction_date else "unknown",
-        'VendorName': vendor_name,
-        'VendorAddress': vendor_address,
-        'Date': transaction_date,
-        'TotalSpent': total_spent
-    }
-
-    # Remove None values from the item
-    receipt_item = {k: v for k, v in receipt_item.items() if v is not None}
-
-    # Debugging: Print the prepared item before saving
-    print(f"Prepared item for DynamoDB: {receipt_item}")
-
-    # Save to DynamoDB
-    put_item_to_dynamodb(receipts_table, receipt_item)
-
-    print("Data successfully saved to DynamoDB.")
-
-
+import re
+import boto3
+from botocore.exceptions import ClientError
+from decimal import Decimal
+from instrumentation import get_logger, instrument_aws
+from receipts_db import batch_put_items, format_write_summary, index_attributes, receipt_partition_key, receipt_sort_key, updated_attributes
+
+# Initialize DynamoDB client
+dynamodb = instrument_aws(boto3.resource('dynamodb'))
+
+# Define the tables in DynamoDB
+receipts_table = dynamodb.Table('ReceiptsTable')
+
+log = get_logger("entities")
+
+# Function to clean total value (only numbers and decimals)
+def clean_total(value):
+    if value is None:
+        return None
+    cleaned = re.sub(r'[^\d.]', '', str(value))
+    log.debug("total cleaned", original=value, cleaned=cleaned)
+    return Decimal(cleaned) if cleaned else None
+
+# Helper function to put item into DynamoDB table with error handling
+def put_item_to_dynamodb(table, item):
+    try:
+        table.put_item(Item=item)
+        log.info("item added", table=table.name, pk=item.get('PK'), sk=item.get('SK'))
+    except ClientError as e:
+        log.error("put_item failed", table=table.name, pk=item.get('PK'), sk=item.get('SK'),
+                  error=e.response['Error']['Message'])
+
+# Builds the ReceiptsTable item for structured receipt data
+def build_receipt_item(data):
+    # Extract and clean data
+    total_spent = clean_total(data.get("TotalSpent"))
+    vendor_name = data.get("VendorName")
+    vendor_address = data.get("VendorAddress")
+    transaction_date = data.get("TransactionDate")
+
+    # Prepare item for ReceiptsTable
+    receipt_item = {
+        'PK': receipt_partition_key(vendor_name),
+        'SK': receipt_sort_key(transaction_date),
+        'VendorName': vendor_name,
+        'VendorAddress': vendor_address,
+        'Date': transaction_date,
+        'TotalSpent': total_spent,
+        **updated_attributes(),
+        **index_attributes(vendor_name, transaction_date, data.get("ExpenseType"))
+    }
+
+    # Remove None values from the item
+    return {k: v for k, v in receipt_item.items() if v is not None}
+
+# Process structured receipt data
+def process_receipt_data(data):
+    receipt_item = build_receipt_item(data)
+
+    # Debugging: log the prepared item before saving (only with RECEIPT_LOG_LEVEL=DEBUG)
+    log.debug("receipt prepared", item=receipt_item)
+
+    # Save to DynamoDB
+    put_item_to_dynamodb(receipts_table, receipt_item)
+
+# Process many structured receipts at once with batched writes (25 items per request, several in parallel)
+# Returns the batch_put_items summary, including any items that could not be written
+def process_receipts_data(data_list):
+    items = [build_receipt_item(data) for data in data_list]
+    summary = batch_put_items(items, receipts_table.name)
+    log.info("bulk import", table=receipts_table.name, summary=format_write_summary(summary))
+    for error in summary['errors']:
+        log.error("batch write failed", table=receipts_table.name, error=error)
+    return summary
@@ -1,220 +1,826 @@
-from flask import Flask, request, jsonify
-import os
-from data_pipeline import process_receipt_with_textract
-from flask_cors import CORS
-import boto3
-from decimal import Decimal
-from s3_storage import upload_receipt_to_s3
-from datetime import datetime, timezone
-
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
-
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-receipts_table = dynamodb.Table('ReceiptsTable')
-
-# Endpoint for uploading an image and processing it
-@app.route('/upload-receipt', methods=['POST'])
-def upload_receipt():
-    try:
-        if 'file' not in request.files:
-            return jsonify({"error": "No file part"}), 400
-
-        file = request.files['file']
-
-        if file.filename == '':
-            return jsonify({"error": "No selected file"}), 400
-
-        print(f"Received file: {file.filename}")
-        
-
-        # Save the uploaded file to a temporary directory
-        upload_dir = os.path.join(os.getcwd(), 'uploads')
-        os.makedirs(upload_dir, exist_ok=True)
-        file_path = os.path.join(upload_dir, file.filename)
-        file.save(file_path)
-        
-        print(f"File saved to: {file_path}")
-        
-        # Upload receipt image to S3 (Current version - No User ID)
-        image_url = upload_receipt_to_s3(file_path)
-
-        # Future Implementation (With User ID)
-        # user_id = request.form.get('user_id', 'unknown_user')  # Get user ID from request
-        # image_url = upload_receipt_to_s3(file_path, user_id)  # Pass user ID
-
-        # Process the receipt image using Textract
-        receipt_data = process_receipt_with_textract(file_path)
-
-        if not receipt_data:
-            return jsonify({"error": "Failed to process receipt"}), 500
-        
-        
-        # If the data contains the typo key, fix it:
-        if 'mageURL' in receipt_data:
-            # Remap it to the correct key and remove the old one.
-            receipt_data['ImageURL'] = receipt_data.pop('mageURL')
-        else:
-            # Otherwise, use the S3 URL returned from the upload function.
-            receipt_data['ImageURL'] = image_url
-
-        print(f"Extracted receipt data: {receipt_data}")
-        return jsonify(receipt_data), 200
-
-    except Exception as e:
-        print(f"Error occurred: {e}")
-        return jsonify({"error": str(e)}), 500
-
-# Endpoint for confirming and saving receipt data
-@app.route('/confirm-receipt', methods=['POST'])
-def confirm_receipt():
-    try:
-        data = request.json
-        print("Received data:", data)
-
-        # Clean up and validate data
-        total_amount = data.get('TotalAmount', '0').replace('$', '').strip()
-        expense_type = data.get('ExpenseType', 'Other')  # Default to 'Other' if not provided
-
-        upload_date = datetime.now(timezone.utc).strftime("%m/%d/%Y")  # MM/DD/YYYY format
-        
-        receipt_item = {
-            'PK': f"vendor#{data.get('VendorName', 'unknown')}",
-            'SK': f"receipt#{data.get('TransactionDate', 'unknown')}",
-            'VendorName': data.get('VendorName'),
-            'VendorAddress': data.get('VendorAddress'),
-            'Date': data.get('TransactionDate'),
-            'TotalAmount': Decimal(total_amount) if total_amount else None,
-            'ExpenseType': expense_type,  # Add ExpenseType to the item
-            'ImageURL': data.get('ImageURL'), # Store image URL in the db
-            'UploadDate': upload_date
-        }
-
-        # Remove None values from the item
-        receipt_item = {k: v for k, v in receipt_item.items() if v is not None}
-        print("Prepared item for DynamoDB:", receipt_item)
-
-        # Save to DynamoDB
-        receipts_table.put_item(Item=receipt_item)
-        print("Successfully added item to DynamoDB:", receipt_item)
-
-        return jsonify({**receipt_item, "message": "Receipt saved successfully", "Upload date": upload_date}), 200
-
-
-    except Exception as e:
-        print(f"Error occurred while saving to DynamoDB: {e}")
-        return jsonify({"error": str(e)}), 500
-
-@app.route('/update-receipt', methods=['PUT'])
-def update_receipt():
-    try:
-        data = request.json
-        print("Received update request:", data)
-
-        pk = data.get('PK')  # Ensure this is in the format "vendor#Xfinity"
-        sk = data.get('SK')  # Ensure this is in the format "receipt#10/23/2024"
-
-        if not pk or not sk:
-            return jsonify({'error': 'Missing PK or SK'}), 400
-
-        update_expression = "SET TotalAmount = :ta, ExpenseType = :et, TransactionDate = :td, VendorName = :vn, VendorAddress = :va"
-        
-        expression_attribute_values = {
-            ":ta": Decimal(str(data["TotalAmount"])),
-            ":et": data["ExpenseType"],
-            ":td": data["TransactionDate"],
-            ":vn": data["VendorName"],
-            ":va": data["VendorAddress"]
-        }
-
-        response = receipts_table.update_item(
-            Key={'PK': pk, 'SK': sk},
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_attribute_values,
-            ReturnValues="UPDATED_NEW"
-        )
-        print("Updating in DynamoDB with:", expression_attribute_values) # debug statement
-
-        print("Successfully updated receipt in DynamoDB:", response)
-        return jsonify({"message": "Receipt updated successfully", "updated_fields": response.get("Attributes", {})}), 200
-
-    except Exception as e:
-        print(f"Error updating receipt: {e}")
-        return jsonify({'error': str(e)}), 500
-    
-@app.route('/get-receipt', methods=['GET'])
-def get_receipt():
-    try:
-        pk = request.args.get('PK')
-        sk = request.args.get('SK')
-
-        print(f"Received get-receipt request: PK={pk}, SK={sk}")  # Debugging log
-
-        if not pk or not sk:
-            return jsonify({'error': 'Missing PK or SK'}), 400
-
-        # Force a fresh read from DynamoDB
-        response = receipts_table.get_item(Key={'PK': pk, 'SK': sk}, ConsistentRead=True)
-
-        if 'Item' not in response:
-            return jsonify({'error': 'Receipt not found'}), 404
-
-        receipt = response['Item']
-
-        # Ensure consistency with frontend expectations
-        if "TransactionDate" not in receipt and "Date" in receipt:
-            receipt["TransactionDate"] = receipt.pop("Date")
-
-        print("Fetched updated receipt:", receipt)
-        return jsonify(receipt), 200
-
-    except Exception as e:
-        print(f"Error fetching receipt: {e}")
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/delete-receipt', methods=['DELETE'])
-def delete_receipt():
-    try:
-        data = request.get_json()
-        pk = data.get('PK')
-        sk = data.get('SK')
-
-        if not pk or not sk:
-            return jsonify({'error': 'Missing PK or SK'}), 400
-        
-        response = receipts_table.delete_item(
-            Key={
-                'PK': pk,
-                'SK': sk
-            }
-        )
-        
-        return jsonify({'message': 'Receipt deleted successfully'}), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/get-all-receipts', methods=['GET'])
-def get_full_table():
-    """
-    Function retrieves all items in the table and returns it as a json object. 
-    This is mainly used for pulling the database so that it may be displayed in a table in JSX.
-    """
-    try:
-        print("Received request for all receipts.")
-        
-        response = receipts_table.scan(Limit=10)
-        print(response)
-        items = response.get('Items', [])
-        
-        print(f"Fetched {len(items)} receipts.")
-        
-        return jsonify(items), 200
-
-    except Exception as e:
-        print(f"Error fetching all receipts: {e}")
-        return jsonify({'error': str(e)}), 500
-
-if __name__ == '__main__':
-    app.run(host='0.0.0.0',port=5000,debug=True)
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from data_pipeline import process_receipt_with_textract
+from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+import boto3
+import hashlib
+from decimal import Decimal
+from receipts_db import (RECEIPT_ITEMS, RECEIPTS_TABLE_NAME, batch_get_items, batch_put_items, format_write_summary,
+                         index_attributes, parallel_scan, query_by_category, query_by_date_range, query_by_vendor,
+                         receipt_partition_key, receipt_sort_key, scan_page, tombstone_item, updated_attributes)
+from s3_storage import make_receipt_key, receipt_exists, receipt_key_from_url, receipt_url, upload_receipt_to_s3
+from datetime import datetime, timezone
+from instrumentation import current_request, end_request, get_logger, instrument_aws, metrics, start_request
+from job_queue import JobQueue
+from result_cache import TTLCache, get_default_cache
+from search_index import load_or_build
+from vendor_names import confirmed_vendor_name, get_vendor_index
+from rollups import ROLLUPS_TABLE_NAME, get_summary, record_change, record_changes
+from task_executor import server_timing_header, submit_timed, when_all_done
+from visualization import CHART_FORMATS, CHART_KINDS, load_receipts_frame, render_chart
+from upload_buffer import MAX_UPLOAD_BYTES, UploadBuffer, UploadTooLarge
+
+# Initialize Flask app
+app = Flask(__name__)
+CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}})
+
+# Reject oversized uploads from the Content-Length header before the body is read
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+# Batch uploads: files per request, and how many of them are processed at once
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", 50))
+DEFAULT_BATCH_CONCURRENCY = 4
+MAX_BATCH_CONCURRENCY = int(os.environ.get("MAX_BATCH_CONCURRENCY", 8))
+# Request body limit for batch uploads, in place of MAX_CONTENT_LENGTH; each file is still held to MAX_UPLOAD_BYTES
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_UPLOAD_BYTES", MAX_BATCH_FILES * MAX_UPLOAD_BYTES))
+
+# Initialize DynamoDB client
+dynamodb = instrument_aws(boto3.resource('dynamodb', region_name='us-east-1'))
+receipts_table = dynamodb.Table(RECEIPTS_TABLE_NAME)
+rollups_table = dynamodb.Table(ROLLUPS_TABLE_NAME)
+
+# Read-through cache for /get-receipt, keyed by (PK, SK). The write endpoints below invalidate or
+# refresh entries, the TTL bounds staleness from writes made by other processes.
+RECEIPT_CACHE_TTL = float(os.environ.get("RECEIPT_READ_CACHE_TTL", 60))
+RECEIPT_CACHE_ENTRIES = int(os.environ.get("RECEIPT_READ_CACHE_ENTRIES", 1024))
+receipt_cache = TTLCache(max_entries=RECEIPT_CACHE_ENTRIES, ttl=RECEIPT_CACHE_TTL)
+
+# Rendered spending charts, plus the receipts frame they are drawn from (a full table scan)
+CHART_CACHE_TTL = float(os.environ.get("CHART_CACHE_TTL", 300))
+chart_cache = TTLCache(max_entries=len(CHART_KINDS) * len(CHART_FORMATS) + 1, ttl=CHART_CACHE_TTL)
+
+log = get_logger("api")
+
+# Fraction of the per-request logs kept for the high-volume read endpoints
+READ_LOG_SAMPLE = float(os.environ.get("RECEIPT_READ_LOG_SAMPLE", 0.05))
+
+metrics.describe("http_request_seconds", "Request latency by endpoint and method.")
+metrics.describe("http_requests_total", "Requests by endpoint, method and status code.")
+
+# Every request gets a scope: an id for its logs (X-Request-Id) and the spans recorded while it runs
+@app.before_request
+def start_request_scope():
+    request_id = request.headers.get('X-Request-Id', '')[:64] or None
+    g.request_scope_token = start_request(request.endpoint or "unmatched", request_id)
+
+# Records the latency and status of a finished request
+def observe_request(scope, endpoint, method, status):
+    seconds = scope.elapsed()
+    metrics.observe("http_request_seconds", seconds, endpoint=endpoint, method=method)
+    metrics.inc("http_requests_total", endpoint=endpoint, method=method, status=status)
+    log.info("request", request_id=scope.request_id, endpoint=endpoint, method=method, status=status,
+             ms=round(seconds * 1000, 1))
+
+# Adds the request id and the request's spans (Server-Timing) to the response and records the request.
+# A streamed response is only recorded once its body has been sent; its Server-Timing covers the setup.
+@app.after_request
+def finish_request_scope(response):
+    scope = current_request()
+    if scope is None:
+        return response
+    endpoint = request.endpoint or "unmatched"
+
+    response.headers['X-Request-Id'] = scope.request_id
+    timings = scope.timings()
+    if timings:
+        response.headers.add('Server-Timing', server_timing_header(timings))
+
+    if response.is_streamed:
+        method, status = request.method, response.status_code
+        response.call_on_close(lambda: observe_request(scope, endpoint, method, status))
+    else:
+        observe_request(scope, endpoint, request.method, response.status_code)
+    return response
+
+@app.teardown_request
+def end_request_scope(error=None):
+    token = g.pop('request_scope_token', None)
+    if token is not None:
+        end_request(token)
+
+# Cache statistics, reported as gauges on /metrics
+def cache_gauges():
+    caches = {'receipts': receipt_cache.stats(), 'charts': chart_cache.stats(),
+              'results': get_default_cache().stats(), 'vendors': get_vendor_index().stats()}
+    for cache, stats in caches.items():
+        for name, value in stats.items():
+            yield f"receipt_cache_{name}", {'cache': cache}, value
+
+metrics.add_collector(cache_gauges)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"error": f"Upload exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"}), 413
+
+# S3 archival of recent uploads by image URL (the archive future), so a confirm can check the image
+# made it to S3. Bounded and expiring; entries are dropped once the receipt is confirmed.
+ARCHIVE_TRACK_ENTRIES = int(os.environ.get("ARCHIVE_TRACK_ENTRIES", 4096))
+ARCHIVE_TRACK_TTL = float(os.environ.get("ARCHIVE_TRACK_TTL", 3600))
+archives = TTLCache(max_entries=ARCHIVE_TRACK_ENTRIES, ttl=ARCHIVE_TRACK_TTL)
+
+# How long a confirm waits, in total, for archivals still in progress and image checks
+ARCHIVE_CONFIRM_WAIT = float(os.environ.get("ARCHIVE_CONFIRM_WAIT", 10))
+
+# Uploads the buffered receipt image to S3 under a pre-generated key
+def archive_receipt(upload, file_name):
+    with upload.open() as fileobj:
+        return upload_receipt_to_s3(fileobj, upload.filename, file_name)
+
+# Logs archival failures; confirms find out about them through the tracked future
+def record_archive_result(image_url):
+    def callback(future):
+        error = future.exception()
+        if error is not None:
+            log.error("receipt archival failed", image_url=image_url, error=str(error))
+    return callback
+
+# Checks which receipt image URLs have their image in S3, returning {image_url: archived}.
+# Archivals still in progress (tracked in `archives`) and HEAD requests for untracked URLs (expired, or
+# uploaded by another process) run in parallel on the shared executor, and all of them together are
+# given ARCHIVE_CONFIRM_WAIT; a URL that cannot be settled in that time, or whose check fails, is kept.
+# URLs outside the receipts bucket are left alone.
+def images_archived(image_urls):
+    archived = {}
+    tracked = {}
+    checks = {}
+    timings = {}
+    for image_url in set(image_urls):
+        archive = archives.get(image_url)
+        if archive is not None:
+            tracked[image_url] = archive
+            continue
+        file_name = receipt_key_from_url(image_url)
+        if file_name is None:
+            archived[image_url] = True
+        else:
+            checks[image_url] = submit_timed(timings, "s3.exists", receipt_exists, file_name)
+
+    done, _ = wait(list(tracked.values()) + list(checks.values()), timeout=ARCHIVE_CONFIRM_WAIT)
+    for image_url, archive in tracked.items():
+        if archive not in done:
+            log.warning("archival still in progress at confirm", image_url=image_url)
+        archived[image_url] = archive not in done or archive.exception() is None
+    for image_url, check in checks.items():
+        if check not in done:
+            log.warning("archived image check timed out", image_url=image_url)
+            archived[image_url] = True
+        elif check.exception() is not None:
+            log.warning("could not check archived image", image_url=image_url, error=str(check.exception()))
+            archived[image_url] = True
+        else:
+            archived[image_url] = check.result()
+    return archived
+
+# Drops the image URL of receipts whose image never made it to S3, checking all of them at once
+def drop_unarchived_images(items):
+    archived = images_archived([item['ImageURL'] for item in items if item.get('ImageURL')])
+    for item in items:
+        if item.get('ImageURL') and not archived[item['ImageURL']]:
+            log.warning("dropping image url, archival failed", image_url=item['ImageURL'])
+            archives.invalidate(item['ImageURL'])
+            del item['ImageURL']
+
+# Archives the buffered upload to S3 and runs Textract on it concurrently on the shared executor.
+# Returns the extracted receipt data (None if extraction failed) and the per-task timings.
+# The buffer (with any temporary file) is released once both tasks have finished. By default this
+# returns as soon as extraction is done; wait_for_archive=True also waits for (and raises on) archival.
+def process_upload(upload, wait_for_archive=False):
+    # The object key (and so the URL) is fixed up front, which lets the response go out
+    # before the S3 upload itself has finished
+    file_name = make_receipt_key(upload.filename)
+    image_url = receipt_url(file_name)
+
+    timings = {}
+    try:
+        archive = submit_timed(timings, "s3", archive_receipt, upload, file_name)
+        archive.add_done_callback(record_archive_result(image_url))
+        archives.put(image_url, archive)
+        extract = submit_timed(timings, "textract", process_receipt_with_textract, upload.getvalue())
+    except Exception:
+        upload.close()
+        raise
+
+    # Release the buffer and log the full per-task timings once both tasks are done
+    def finish():
+        upload.close()
+        log.info("upload tasks finished", key=file_name, **{f"{name}_ms": round(seconds * 1000, 1)
+                                                           for name, seconds in timings.items()})
+    when_all_done([archive, extract], finish)
+
+    receipt_data = extract.result()
+
+    # If archival has failed there is no image behind the URL, fail the request
+    if wait_for_archive:
+        archive.result()
+    elif archive.done() and archive.exception() is not None:
+        raise archive.exception()
+
+    if not receipt_data:
+        return None, timings
+
+    # If the data contains the typo key, fix it:
+    if 'mageURL' in receipt_data:
+        # Remap it to the correct key and remove the old one.
+        receipt_data['ImageURL'] = receipt_data.pop('mageURL')
+    else:
+        # Otherwise, use the S3 URL for the archived image.
+        receipt_data['ImageURL'] = image_url
+
+    return receipt_data, timings
+
+# Processes a queued upload in a job worker and returns what /upload-receipt would have returned.
+# The payload file belongs to the job queue, which removes it once the job's outcome is recorded.
+def run_upload_job(payload_path, filename):
+    upload = UploadBuffer(filename, path=payload_path, size=os.path.getsize(payload_path), owned=False)
+    receipt_data, timings = process_upload(upload, wait_for_archive=True)
+    if not receipt_data:
+        raise RuntimeError("Failed to process receipt")
+    return {**receipt_data, 'Timings': dict(timings)}
+
+job_queue = None
+job_queue_lock = threading.Lock()
+
+# Returns the durable job queue, starting its workers (and resuming interrupted jobs) on first use
+def get_job_queue():
+    global job_queue
+    with job_queue_lock:
+        if job_queue is None:
+            job_queue = JobQueue(run_upload_job)
+            job_queue.start()
+        return job_queue
+
+# Endpoint for uploading an image and processing it
+@app.route('/upload-receipt', methods=['POST'])
+def upload_receipt():
+    try:
+        if 'file' not in request.files:
+            return jsonify({"error": "No file part"}), 400
+
+        file = request.files['file']
+
+        if file.filename == '':
+            return jsonify({"error": "No selected file"}), 400
+
+        # Read the upload once; S3 and Textract both work from this buffer
+        upload = UploadBuffer.from_file_storage(file)
+        log.info("upload received", filename=file.filename, bytes=upload.size, in_memory=upload.in_memory)
+
+        receipt_data, _ = process_upload(upload)
+
+        if not receipt_data:
+            return jsonify({"error": "Failed to process receipt"}), 500
+
+        log.debug("receipt extracted", vendor=receipt_data.get('VendorName'), total=receipt_data.get('TotalAmount'),
+                  date=receipt_data.get('TransactionDate'), line_items=len(receipt_data.get('LineItems', ())))
+        # The task timings reach the Server-Timing header through the request's spans
+        return jsonify(receipt_data), 200
+
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        return upload_too_large(e)
+
+    except Exception as e:
+        log.exception("upload failed", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+# Endpoint for uploading an image and processing it in the background
+# Returns a job id right away; poll /receipt-job/<job_id> for the result
+@app.route('/upload-receipt-async', methods=['POST'])
+def upload_receipt_async():
+    try:
+        if 'file' not in request.files:
+            return jsonify({"error": "No file part"}), 400
+
+        file = request.files['file']
+
+        if file.filename == '':
+            return jsonify({"error": "No selected file"}), 400
+
+        with UploadBuffer.from_file_storage(file) as upload:
+            with upload.open() as fileobj:
+                job_id = get_job_queue().submit(fileobj, upload.filename)
+
+        log.info("upload queued", filename=file.filename, job=job_id)
+        return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/receipt-job/{job_id}"}), 202
+
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        return upload_too_large(e)
+
+    except Exception as e:
+        log.exception("upload queueing failed", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+# Endpoint for checking on a background upload job
+# The extracted receipt data is under "result" once the status is "done"
+@app.route('/receipt-job/<job_id>', methods=['GET'])
+def get_receipt_job(job_id):
+    try:
+        job = get_job_queue().get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job), 200
+
+    except Exception as e:
+        log.exception("job lookup failed", job=job_id, error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+# Processes one file of a batch upload and returns its result line
+def process_batch_file(index, upload):
+    try:
+        receipt_data, timings = process_upload(upload)
+        if not receipt_data:
+            return {"index": index, "filename": upload.filename, "status": "error",
+                    "error": "Failed to process receipt"}
+        return {"index": index, "filename": upload.filename, "status": "ok", "data": receipt_data,
+                "timings": dict(timings)}
+    except Exception as e:
+        log.exception("batch file failed", filename=upload.filename, error=str(e))
+        return {"index": index, "filename": upload.filename, "status": "error", "error": str(e)}
+
+# Endpoint for uploading many receipt images in one request (multipart field "files")
+# Files are processed at most `concurrency` at a time and a JSON line is streamed back for each one
+# as soon as it completes, followed by a summary line. A failed file does not fail the batch.
+@app.route('/upload-receipts', methods=['POST'])
+def upload_receipts():
+    request.max_content_length = MAX_BATCH_BYTES
+    try:
+        files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+        if not files:
+            return jsonify({"error": "No files uploaded"}), 400
+        if len(files) > MAX_BATCH_FILES:
+            return jsonify({"error": f"At most {MAX_BATCH_FILES} files per batch"}), 400
+
+        concurrency = min(max(request.args.get('concurrency', DEFAULT_BATCH_CONCURRENCY, type=int), 1),
+                          MAX_BATCH_CONCURRENCY)
+
+        # Buffer everything up front so the request body is fully read before streaming starts
+        uploads = []
+        try:
+            for file in files:
+                uploads.append(UploadBuffer.from_file_storage(file))
+        except Exception:
+            for upload in uploads:
+                upload.close()
+            raise
+
+        log.info("batch received", files=len(uploads), concurrency=concurrency)
+
+    except UploadTooLarge as e:
+        return upload_too_large(e)
+
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Batch exceeds the {MAX_BATCH_BYTES // (1024 * 1024)} MB limit"}), 413
+
+    except Exception as e:
+        log.exception("batch upload failed", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        ok = 0
+        # A small dispatcher pool caps how many receipts are in flight; the S3 and Textract
+        # calls themselves still go through the shared executor
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="receipt-batch") as batch:
+            futures = [batch.submit(process_batch_file, i, upload) for i, upload in enumerate(uploads)]
+            for future in as_completed(futures):
+                result = future.result()
+                ok += result["status"] == "ok"
+                yield json.dumps(result, default=str) + "\n"
+
+        yield json.dumps({"done": True, "total": len(uploads), "ok": ok, "failed": len(uploads) - ok}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson'), 200
+
+search_index = None
+search_index_lock = threading.Lock()
+
+# Returns the receipt search index, loading it from disk (or building it from the table) on first use
+def get_search_index():
+    global search_index
+    with search_index_lock:
+        if search_index is None:
+            search_index = load_or_build()
+            search_index.start_autosave()
+        return search_index
+
+# Builds the DynamoDB item for a receipt the user confirmed
+def build_confirmed_item(data, upload_date):
+    # Clean up and validate data
+    total_amount = str(data.get('TotalAmount', '0') or '').replace('$', '').strip()
+    expense_type = data.get('ExpenseType', 'Other')  # Default to 'Other' if not provided
+
+    # Sort keys use ISO dates so a vendor's receipts come back in chronological order
+    receipt_item = {
+        'PK': receipt_partition_key(data.get('VendorName')),
+        'SK': receipt_sort_key(data.get('TransactionDate')),
+        'VendorName': data.get('VendorName'),
+        'VendorAddress': data.get('VendorAddress'),
+        'Date': data.get('TransactionDate'),
+        'TotalAmount': Decimal(total_amount) if total_amount else None,
+        'ExpenseType': expense_type,  # Add ExpenseType to the item
+        'ImageURL': data.get('ImageURL'), # Store image URL in the db
+        'OcrText': data.get('OcrText'),  # Raw receipt text, when the client sends it (used by search)
+        'UploadDate': upload_date,
+        **updated_attributes(),
+        # Keys for the month and category indexes
+        **index_attributes(data.get('VendorName'), data.get('TransactionDate'), expense_type)
+    }
+
+    # Remove None values from the item
+    return {k: v for k, v in receipt_item.items() if v is not None}
+
+# Endpoint for confirming and saving receipt data
+@app.route('/confirm-receipt', methods=['POST'])
+def confirm_receipt():
+    try:
+        data = request.json
+
+        upload_date = datetime.now(timezone.utc).strftime("%m/%d/%Y")  # MM/DD/YYYY format
+        receipt_item = build_confirmed_item(data, upload_date)
+        # Don't store a URL whose image never made it to S3
+        drop_unarchived_images([receipt_item])
+        log.debug("receipt prepared", item=receipt_item)
+
+        # Save to DynamoDB
+        # ALL_OLD returns the receipt this one replaces, if any, so the rollups can subtract it
+        response = receipts_table.put_item(Item=receipt_item, ReturnValues='ALL_OLD')
+        record_change(rollups_table, response.get('Attributes'), receipt_item)
+        get_search_index().add(receipt_item)
+        if confirmed_vendor_name(data):
+            get_vendor_index().add(confirmed_vendor_name(data))
+        receipt_cache.put((receipt_item['PK'], receipt_item['SK']), receipt_item)
+        if receipt_item.get('ImageURL'):
+            archives.invalidate(receipt_item['ImageURL'])
+        log.info("receipt saved", pk=receipt_item['PK'], sk=receipt_item['SK'])
+
+        return jsonify({**receipt_item, "message": "Receipt saved successfully", "Upload date": upload_date}), 200
+
+
+    except Exception as e:
+        log.exception("receipt save failed", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+# Endpoint for confirming and saving many receipts at once (JSON list, or {"receipts": [...]})
+# Items are written with batched DynamoDB writes; the response reports what could not be written
+@app.route('/confirm-receipts', methods=['POST'])
+def confirm_receipts():
+    try:
+        data = request.json
+        receipts = data.get('receipts') if isinstance(data, dict) else data
+        if not isinstance(receipts, list) or not receipts:
+            return jsonify({"error": "Expected a non-empty list of receipts"}), 400
+
+        upload_date = datetime.now(timezone.utc).strftime("%m/%d/%Y")  # MM/DD/YYYY format
+        # Receipts with the same key replace each other, the last one wins (as the batch write does).
+        # Deduplicating here keeps the rollups from counting one stored receipt several times.
+        items_by_key = {}
+        vendor_names = {}
+        invalid = []
+        for index, receipt in enumerate(receipts):
+            try:
+                item = build_confirmed_item(receipt, upload_date)
+                items_by_key.pop((item['PK'], item['SK']), None)
+                items_by_key[(item['PK'], item['SK'])] = item
+                vendor_names[(item['PK'], item['SK'])] = confirmed_vendor_name(receipt)
+            except Exception as e:
+                invalid.append({"index": index, "error": str(e)})
+        items = list(items_by_key.values())
+        drop_unarchived_images(items)
+
+        # Receipts being replaced, so the rollups can subtract them (BatchWriteItem cannot return old items)
+        previous = batch_get_items([{'PK': item['PK'], 'SK': item['SK']} for item in items])
+
+        summary = batch_put_items(items)
+        for item in items:
+            receipt_cache.invalidate((item['PK'], item['SK']))
+
+        unprocessed = {(item['PK'], item['SK']) for item in summary['unprocessed']}
+        written = [item for item in items if (item['PK'], item['SK']) not in unprocessed]
+        record_changes(rollups_table, [(previous.get((item['PK'], item['SK'])), item) for item in written])
+        index = get_search_index()
+        vendors = get_vendor_index()
+        for item in written:
+            index.add(item)
+            if vendor_names[(item['PK'], item['SK'])]:
+                vendors.add(vendor_names[(item['PK'], item['SK'])])
+            if item.get('ImageURL'):
+                archives.invalidate(item['ImageURL'])
+        log.info("bulk confirm", summary=format_write_summary(summary), invalid=len(invalid))
+
+        status = 200 if not summary['unprocessed'] and not invalid else 207
+        return jsonify({
+            "message": f"{summary['written']} receipts saved",
+            "written": summary['written'],
+            "invalid": invalid,
+            "unprocessed": summary['unprocessed'],
+            "batches": summary['batches'],
+            "seconds": summary['seconds'],
+            "items_per_sec": summary['items_per_sec'],
+        }), status
+
+    except Exception as e:
+        log.exception("bulk confirm failed", error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/update-receipt', methods=['PUT'])
+def update_receipt():
+    try:
+        data = request.json
+
+        pk = data.get('PK')  # Ensure this is in the format "vendor#Xfinity"
+        sk = data.get('SK')  # Ensure this is in the format "receipt#2024-10-23"
+
+        if not pk or not sk:
+            return jsonify({'error': 'Missing PK or SK'}), 400
+
+        update_expression = "SET TotalAmount = :ta, ExpenseType = :et, TransactionDate = :td, VendorName = :vn, VendorAddress = :va"
+        
+        expression_attribute_values = {
+            ":ta": Decimal(str(data["TotalAmount"])),
+            ":et": data["ExpenseType"],
+            ":td": data["TransactionDate"],
+            ":vn": data["VendorName"],
+            ":va": data["VendorAddress"],
+        }
+
+        # Keep the month, category and update index keys in step with the edited fields
+        indexed = {**index_attributes(data["VendorName"], data["TransactionDate"], data["ExpenseType"]),
+                   **updated_attributes()}
+        for name, value in indexed.items():
+            update_expression += f", {name} = :{name}"
+            expression_attribute_values[f":{name}"] = value
+        missing = [name for name in ("TxnDate", "TxnMonth", "GSI1PK", "GSI1SK") if name not in indexed]
+        if missing:
+            update_expression += " REMOVE " + ", ".join(missing)
+
+        # ALL_OLD returns the receipt before the edit so the rollups can be adjusted by the difference
+        response = receipts_table.update_item(
+            Key={'PK': pk, 'SK': sk},
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=expression_attribute_values,
+            ReturnValues="ALL_OLD"
+        )
+        receipt_cache.invalidate((pk, sk))
+
+        updated_fields = {
+            "TotalAmount": expression_attribute_values[":ta"],
+            "ExpenseType": data["ExpenseType"],
+            "TransactionDate": data["TransactionDate"],
+            "VendorName": data["VendorName"],
+            "VendorAddress": data["VendorAddress"],
+            **indexed
+        }
+        old_item = response.get("Attributes")
+        new_item = {k: v for k, v in (old_item or {'PK': pk, 'SK': sk}).items() if k not in missing}
+        new_item.update(updated_fields)
+        record_change(rollups_table, old_item, new_item)
+        get_search_index().add(new_item)
+
+        log.info("receipt updated", pk=pk, sk=sk)
+        return jsonify({"message": "Receipt updated successfully", "updated_fields": updated_fields}), 200
+
+    except Exception as e:
+        log.exception("receipt update failed", error=str(e))
+        return jsonify({'error': str(e)}), 500
+    
+@app.route('/get-receipt', methods=['GET'])
+def get_receipt():
+    try:
+        pk = request.args.get('PK')
+        sk = request.args.get('SK')
+
+        if not pk or not sk:
+            return jsonify({'error': 'Missing PK or SK'}), 400
+
+        # Served from the cache unless ?consistent=true asks for a strong read, which also refreshes the cache.
+        # Misses still use a strongly consistent read so an entry is never filled with pre-write data.
+        def load():
+            return receipts_table.get_item(Key={'PK': pk, 'SK': sk}, ConsistentRead=True).get('Item')
+
+        if request.args.get('consistent', '').lower() in ('1', 'true', 'yes'):
+            cache_status = 'BYPASS'
+            receipt = load()
+            if receipt is not None:
+                receipt_cache.put((pk, sk), receipt)
+            else:
+                receipt_cache.invalidate((pk, sk))
+        else:
+            receipt = receipt_cache.get((pk, sk))
+            cache_status = 'HIT'
+            if receipt is None:
+                cache_status = 'MISS'
+                generation = receipt_cache.generation()
+                receipt = load()
+                if receipt is not None:
+                    receipt_cache.fill((pk, sk), receipt, generation)
+
+        if receipt is None:
+            return jsonify({'error': 'Receipt not found'}), 404
+
+        # Copy so the cached item is not modified below
+        receipt = dict(receipt)
+
+        # Ensure consistency with frontend expectations
+        if "TransactionDate" not in receipt and "Date" in receipt:
+            receipt["TransactionDate"] = receipt.pop("Date")
+
+        log.info("receipt fetched", sample=READ_LOG_SAMPLE, pk=pk, sk=sk, cache=cache_status)
+        return jsonify(receipt), 200, {'X-Cache': cache_status}
+
+    except Exception as e:
+        log.exception("receipt fetch failed", error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/delete-receipt', methods=['DELETE'])
+def delete_receipt():
+    try:
+        data = request.get_json()
+        pk = data.get('PK')
+        sk = data.get('SK')
+
+        if not pk or not sk:
+            return jsonify({'error': 'Missing PK or SK'}), 400
+        
+        response = receipts_table.delete_item(
+            Key={
+                'PK': pk,
+                'SK': sk
+            },
+            ReturnValues='ALL_OLD'
+        )
+        receipt_cache.invalidate((pk, sk))
+        if response.get('Attributes'):
+            # Lets snapshot syncs see the delete without scanning the table
+            try:
+                receipts_table.put_item(Item=tombstone_item(pk, sk))
+            except Exception as e:
+                log.error("tombstone write failed, run a full snapshot sync", pk=pk, sk=sk, error=str(e))
+        record_change(rollups_table, response.get('Attributes'), None)
+        get_search_index().remove(pk, sk)
+        log.info("receipt deleted", pk=pk, sk=sk)
+        
+        return jsonify({'message': 'Receipt deleted successfully'}), 200
+    except Exception as e:
+        log.exception("receipt delete failed", error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search', methods=['GET'])
+def search_receipts():
+    """
+    Searches receipts by vendor name, address, category, amount and receipt text.
+    Query terms may be prefixes or contain one typo; results are ranked and paged.
+    Query parameters: q, limit (default 20, max 100) and offset.
+    """
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    try:
+        results, total = get_search_index().search(query, limit, offset)
+        next_offset = offset + len(results) if offset + len(results) < total else None
+        return jsonify({'items': results, 'count': len(results), 'total': total, 'next_offset': next_offset}), 200
+    except Exception as e:
+        log.exception("search failed", error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/spending-summary', methods=['GET'])
+def spending_summary():
+    """
+    Returns total spending and receipt counts overall and by month, category and vendor.
+    Served from the incrementally maintained rollups (one query), not by scanning the receipts.
+    """
+    try:
+        return jsonify(get_summary(rollups_table)), 200
+    except Exception as e:
+        log.exception("spending summary failed", error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/charts/<kind>.<fmt>', methods=['GET'])
+def spending_chart(kind, fmt):
+    """
+    Returns a spending chart (kind: category, month or vendor) as PNG or SVG.
+    Charts are rendered from a streamed scan of the receipts and cached for CHART_CACHE_TTL seconds;
+    ?refresh=true rescans and re-renders.
+    """
+    if kind not in CHART_KINDS or fmt not in CHART_FORMATS:
+        return jsonify({'error': f"Unknown chart {kind}.{fmt}"}), 404
+    try:
+        if request.args.get('refresh', '').lower() in ('1', 'true', 'yes'):
+            chart_cache.clear()
+
+        frame = chart_cache.get_or_load('frame', lambda: load_receipts_frame(RECEIPTS_TABLE_NAME, segments=4))
+        image = chart_cache.get_or_load((kind, fmt), lambda: render_chart(frame, kind, fmt))
+        etag = hashlib.md5(image).hexdigest()
+        if request.if_none_match.contains(etag):
+            return Response(status=304)
+
+        response = Response(image, mimetype=CHART_FORMATS[fmt])
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f"max-age={int(CHART_CACHE_TTL)}"
+        return response
+    except Exception as e:
+        log.exception("chart rendering failed", kind=kind, fmt=fmt, error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+# Hit ratios of the receipt read cache, the chart and OCR/Textract result caches and the vendor matcher
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'receipts': receipt_cache.stats(), 'charts': chart_cache.stats(),
+                    'results': get_default_cache().stats(), 'vendors': get_vendor_index().stats()}), 200
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Returns request and span latency histograms, error counters and cache statistics in the
+    Prometheus text format. Spans cover image decode, each preprocessing stage, OCR/Textract,
+    the S3 upload and every DynamoDB call.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/get-all-receipts', methods=['GET'])
+def get_full_table():
+    """
+    Function retrieves one page of items in the table and returns it as a json object.
+    This is mainly used for pulling the database so that it may be displayed in a table in JSX.
+    Query parameters: limit (page size, default 50, max 500) and cursor (next_cursor of the previous page).
+    """
+    try:
+        items, next_cursor = scan_page(receipts_table, request.args.get('limit', type=int),
+                                       request.args.get('cursor'), FilterExpression=RECEIPT_ITEMS)
+
+        log.info("receipts page fetched", sample=READ_LOG_SAMPLE, count=len(items))
+
+        return jsonify({'items': items, 'count': len(items), 'next_cursor': next_cursor}), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    except Exception as e:
+        log.exception("receipts page failed", error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/query-receipts', methods=['GET'])
+def query_receipts():
+    """
+    Returns one page of receipts matching a vendor, a category and/or a date range, oldest first.
+    Uses the base table for vendor queries, the category index for category queries and the month
+    index for plain date ranges, so no query scans the whole table.
+    Query parameters: vendor, category, start and end (YYYY-MM-DD or MM/DD/YYYY), limit and cursor.
+    """
+    try:
+        vendor = request.args.get('vendor')
+        category = request.args.get('category')
+        start = request.args.get('start')
+        end = request.args.get('end')
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+
+        if vendor:
+            items, next_cursor = query_by_vendor(receipts_table, vendor, start, end, category, limit, cursor)
+        elif category:
+            items, next_cursor = query_by_category(receipts_table, category, start, end, limit, cursor)
+        elif start and end:
+            items, next_cursor = query_by_date_range(receipts_table, start, end, limit, cursor)
+        else:
+            return jsonify({'error': 'Provide a vendor, a category, or both start and end dates'}), 400
+
+        log.info("receipts queried", sample=READ_LOG_SAMPLE, count=len(items), vendor=vendor, category=category,
+                 start=start, end=end)
+        return jsonify({'items': items, 'count': len(items), 'next_cursor': next_cursor}), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    except Exception as e:
+        log.exception("receipt query failed", error=str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export-receipts', methods=['GET'])
+def export_receipts():
+    """
+    Streams every receipt in the table as JSON lines, using a parallel scan over `segments` segments
+    (default 4, max 16). Meant for exports and analytics on large tables, not for the UI.
+    """
+    segments = request.args.get('segments', 4, type=int)
+    log.info("export started", segments=segments)
+
+    def generate():
+        count = 0
+        for item in parallel_scan(RECEIPTS_TABLE_NAME, segments, FilterExpression=RECEIPT_ITEMS):
+            count += 1
+            yield json.dumps(item, default=str) + "\n"
+        log.info("export finished", receipts=count)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson'), 200
+
+if __name__ == '__main__':
+    # With the reloader on, this file also runs in a parent process that only watches for code changes
+    # and restarts the server; background work must start only in the child that serves requests
+    use_reloader = True
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Resume any upload jobs that were queued, or running under an expired lease
+        get_job_queue()
+        # Load the search index before the first request needs it
+        get_search_index()
+    app.run(host='0.0.0.0',port=5000,debug=True,use_reloader=use_reloader)
@@ -0,0 +1,113 @@
+import argparse
+import io
+import os
+import time
+from PIL import Image, ImageOps
+from instrumentation import span
+
+# Textract's synchronous APIs reject documents larger than this.
+TEXTRACT_MAX_BYTES = 5 * 1024 * 1024
+
+# Defaults for receipt photos: 2000 px on the long side keeps small receipt text well above the height
+# Textract needs, and a 1 MB budget is a fraction of a typical 3-8 MB phone photo.
+DEFAULT_MAX_SIDE = 2000
+DEFAULT_MAX_BYTES = 1024 * 1024
+QUALITY_RANGE = (40, 90)
+
+# Encodes a PIL image as JPEG at the given quality.
+def encode_jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+# Binary searches the highest JPEG quality that fits within max_bytes.
+# Falls back to the lowest quality in the range when nothing fits.
+def encode_within_budget(img, max_bytes, quality_range=QUALITY_RANGE):
+    low, high = quality_range
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode_jpeg(img, quality)
+        if len(data) <= max_bytes:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    if best is None:
+        best = (encode_jpeg(img, quality_range[0]), quality_range[0])
+    return best
+
+# Decodes the image once, applies the EXIF orientation, downsizes it, converts it to grayscale and
+# re-encodes it as JPEG within the byte budget. Returns the new bytes and a report of what changed.
+# The original bytes are returned untouched if they are already smaller and within Textract's limit.
+def normalize_for_upload(image_bytes, max_side=DEFAULT_MAX_SIDE, max_bytes=DEFAULT_MAX_BYTES, grayscale=True):
+    start = time.perf_counter()
+
+    with span("image.decode"):
+        img = Image.open(io.BytesIO(image_bytes))
+        original_size = img.size
+        # For JPEGs this lets the decoder scale down (and drop colour) while decoding, at a fraction of the cost
+        img.draft("L" if grayscale else "RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("L" if grayscale else "RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    with span("image.encode"):
+        data, quality = encode_within_budget(img, max_bytes)
+    if len(image_bytes) <= len(data) and len(image_bytes) <= TEXTRACT_MAX_BYTES:
+        data, quality = image_bytes, None
+
+    report = {
+        'original_bytes': len(image_bytes),
+        'normalized_bytes': len(data),
+        'bytes_saved': len(image_bytes) - len(data),
+        'original_size': original_size,
+        'normalized_size': img.size if quality is not None else original_size,
+        'quality': quality,
+        'seconds': time.perf_counter() - start,
+    }
+    return data, report
+
+# Formats a normalization report as a single log line.
+def format_report(report):
+    saved = 100.0 * report['bytes_saved'] / report['original_bytes'] if report['original_bytes'] else 0.0
+    return (f"{report['original_bytes'] / 1024:.0f} KB -> {report['normalized_bytes'] / 1024:.0f} KB "
+            f"({saved:.0f}% saved, {report['original_size'][0]}x{report['original_size'][1]} -> "
+            f"{report['normalized_size'][0]}x{report['normalized_size'][1]}, quality {report['quality']}) "
+            f"in {report['seconds'] * 1000:.0f} ms")
+
+# Normalizes the given images and prints the savings. With --textract it also times AnalyzeExpense on
+# the original and the normalized bytes so the latency effect can be compared.
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("images", nargs="+", help="receipt images to normalize")
+    ap.add_argument("--max-side", type=int, default=DEFAULT_MAX_SIDE)
+    ap.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    ap.add_argument("--color", action="store_true", help="keep colour instead of converting to grayscale")
+    ap.add_argument("--textract", action="store_true", help="also time AnalyzeExpense with both payloads")
+    args = ap.parse_args()
+
+    textract = None
+    if args.textract:
+        import boto3
+        textract = boto3.client('textract')
+
+    for path in args.images:
+        with open(path, 'rb') as f:
+            original = f.read()
+
+        data, report = normalize_for_upload(original, args.max_side, args.max_bytes, not args.color)
+        print(f"{os.path.basename(path)}: {format_report(report)}")
+
+        if textract is not None:
+            for label, payload in (("original", original), ("normalized", data)):
+                if len(payload) > TEXTRACT_MAX_BYTES:
+                    print(f"  textract {label}: skipped, payload over the synchronous limit")
+                    continue
+                start = time.perf_counter()
+                textract.analyze_expense(Document={'Bytes': payload})
+                print(f"  textract {label}: {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()
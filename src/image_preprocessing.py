@@ -1,50 +1,18 @@
-import cv2
-import numpy as np
-
-def preprocess_image(input_image_path, output_image_path):
-    # Load the image
-    image = cv2.imread(input_image_path)
-
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # Increase contrast and brightness
-    alpha = 1.5  # Contrast control
-    beta = 20    # Brightness control
-    adjusted = cv2.convertScaleAbs(gray, alpha=alpha, beta=beta)
-
-    # Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(adjusted, (5, 5), 0)
-
-    # Apply adaptive thresholding
-    adaptive_thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-
-    # Use morphological operations to enhance text (dilation + erosion)
-    kernel = np.ones((2, 2), np.uint8)
-    dilated = cv2.dilate(adaptive_thresh, kernel, iterations=1)
-    eroded = cv2.erode(dilated, kernel, iterations=1)
-
-    # Optionally deskew the image if the receipt is tilted
-    deskewed = deskew_image(eroded)
-
-    # Save the processed image to the output path
-    cv2.imwrite(output_image_path, deskewed)
-
-    # Return the output image path
-    return output_image_path
-
-# Function to deskew the image
-def deskew_image(image):
-    coords = np.column_stack(np.where(image > 0))
-    angle = cv2.minAreaRect(coords)[-1]
-    if angle < -45:
-        angle = -(90 + angle)
-    else:
-        angle = -angle
-    (h, w) = image.shape[:2]
-    center = (w // 2, h // 2)
-    M = cv2.getRotationMatrix2D(center, angle, 1.0)
-    deskewed = cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
-    return deskewed
-
-
+import cv2
+from pipeline import PIPELINES, deskew_min_area_rect, run_pipeline
+
+def preprocess_image(input_image_path, output_image_path):
+    # Load the image
+    image = cv2.imread(input_image_path)
+
+    # Grayscale, contrast, blur, adaptive threshold, dilation + erosion and deskew (see pipeline.py)
+    deskewed, _ = run_pipeline(image, PIPELINES["image_preprocessing"])
+
+    # Save the processed image to the output path
+    cv2.imwrite(output_image_path, deskewed)
+
+    # Return the output image path
+    return output_image_path
+
+# Old name of this module's deskew step, which now lives in pipeline.py; kept for existing callers
+deskew_image = deskew_min_area_rect
@@ -0,0 +1,287 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implied.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Log level, and the fraction of DEBUG/INFO events that are kept. Warnings and errors are never sampled.
+LOG_LEVEL = os.environ.get("RECEIPT_LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("RECEIPT_LOG_SAMPLE_RATE", 1.0))
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+# Cumulative-bucket latency histogram. Not locked itself, the registry lock guards it.
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# Counters and histograms keyed by name and labels, rendered in the Prometheus text format.
+# Collectors are called at scrape time for values that live elsewhere (e.g. cache statistics) and
+# return (name, labels, value) gauges.
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (h.buckets, list(h.counts), h.sum, h.count))
+                                for key, h in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for collector in self._collectors:
+            try:
+                gauges = sorted((name, _label_key(labels), value) for name, labels, value in collector())
+            except Exception as e:
+                get_logger("instrumentation").warning("metrics collector failed", error=str(e))
+                continue
+            for name, labels, value in gauges:
+                header(name, "gauge")
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe("receipt_span_seconds", "Time spent in an instrumented step (decode, preprocessing stage, OCR, AWS call).")
+metrics.describe("receipt_span_errors_total", "Instrumented steps that raised or returned an error.")
+
+# Per-request state: an id for the logs, and the spans recorded while handling the request.
+# Carried in a context variable, so it follows the request into executor threads (see task_executor).
+class RequestScope:
+    __slots__ = ('request_id', 'name', 'start', 'spans')
+
+    def __init__(self, name, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+
+    # Total seconds per span name, in order of first appearance.
+    def timings(self):
+        totals = {}
+        for name, seconds in list(self.spans):
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+_current_request = contextvars.ContextVar("receipt_request", default=None)
+
+# Starts a request scope in the current context. Returns the token end_request() needs.
+def start_request(name, request_id=None):
+    return _current_request.set(RequestScope(name, request_id))
+
+# Ends the scope started with start_request(). A token from another context (e.g. a streamed response
+# finishing elsewhere) just clears the scope.
+def end_request(token):
+    try:
+        _current_request.reset(token)
+    except ValueError:
+        _current_request.set(None)
+
+# The scope of the request being handled, or None outside a request (CLI, background threads).
+def current_request():
+    return _current_request.get()
+
+# Records a finished span: its latency histogram, and the request's span list if there is one.
+def record_span(name, seconds, error=False):
+    metrics.observe("receipt_span_seconds", seconds, span=name)
+    if error:
+        metrics.inc("receipt_span_errors_total", span=name)
+    scope = _current_request.get()
+    if scope is not None:
+        scope.spans.append((name, seconds))
+
+# Times the block as a span. Span names are fixed strings ("s3.upload", "stage.rescale_image"),
+# never request data, so the number of histogram series stays bounded.
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, error)
+
+# Decorator form of span().
+def timed(name):
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def _before_aws_call(model, context, **kwargs):
+    context['receipt_span'] = (f"{model.service_model.service_name}.{model.name}", time.perf_counter())
+
+def _after_aws_call(context, http_response=None, exception=None, **kwargs):
+    started = context.pop('receipt_span', None)
+    if started is None:
+        return
+    name, start = started
+    failed = exception is not None or (http_response is not None and http_response.status_code >= 300)
+    record_span(name, time.perf_counter() - start, failed)
+
+# Times every API call a boto3 client or resource makes as a "<service>.<Operation>" span (retries
+# included). Events are per client, so each client or resource has to be instrumented once, typically
+# where it is created. Returns what it was given.
+def instrument_aws(client_or_resource):
+    client = getattr(client_or_resource.meta, 'client', client_or_resource)
+    events = client.meta.events
+    events.register('before-call', _before_aws_call, unique_id='receipt-span-before')
+    events.register('after-call', _after_aws_call, unique_id='receipt-span-after')
+    events.register('after-call-error', _after_aws_call, unique_id='receipt-span-error')
+    return client_or_resource
+
+# One JSON object per line: time, level, logger, event, request id and the event's fields.
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'ts': round(record.created, 3), 'level': record.levelname.lower(), 'logger': record.name,
+                 'event': record.getMessage()}
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+_logging_configured = False
+_logging_lock = threading.Lock()
+
+def _configure_logging():
+    global _logging_configured
+    with _logging_lock:
+        if _logging_configured:
+            return
+        logger = logging.getLogger("receipts")
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+        _logging_configured = True
+
+# Leveled, sampled structured logger. Events are short fixed strings and details go in keyword fields:
+#   log.info("receipt saved", pk=pk, sk=sk)
+# Disabled levels return before anything is formatted. DEBUG and INFO events are kept with probability
+# `sample` (default RECEIPT_LOG_SAMPLE_RATE); kept sampled events carry the rate so counts can be scaled.
+class StructuredLogger:
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"receipts.{name}")
+
+    def debug(self, event, sample=None, **fields):
+        self._log(logging.DEBUG, event, sample, fields)
+
+    def info(self, event, sample=None, **fields):
+        self._log(logging.INFO, event, sample, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, 1.0, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, 1.0, fields)
+
+    # Error with the current exception's traceback.
+    def exception(self, event, **fields):
+        self._log(logging.ERROR, event, 1.0, fields, exc_info=True)
+
+    def _log(self, level, event, sample, fields, exc_info=False):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample is None:
+            sample = LOG_SAMPLE_RATE
+        if sample < 1.0:
+            if random.random() >= sample:
+                return
+            fields['sample_rate'] = sample
+        scope = _current_request.get()
+        self._logger.log(level, event, exc_info=exc_info,
+                         extra={'fields': fields, 'request_id': scope.request_id if scope else None})
+
+def get_logger(name):
+    _configure_logging()
+    return StructuredLogger(name)
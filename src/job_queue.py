@@ -0,0 +1,232 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from instrumentation import end_request, get_logger, start_request
+
+# Where queued uploads and their job records are kept. Both survive a restart of the Flask app.
+JOBS_DIR = os.environ.get("RECEIPT_JOBS_DIR", os.path.join(os.getcwd(), 'jobs'))
+JOB_WORKERS = int(os.environ.get("RECEIPT_JOB_WORKERS", 2))
+
+# Finished jobs older than this are removed when the queue starts.
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+# A running job is leased to the worker process that claimed it, which renews the lease while the job
+# runs. A job whose lease has expired (its process died or hung) is picked up again by any worker.
+JOB_LEASE_SECONDS = float(os.environ.get("RECEIPT_JOB_LEASE_SECONDS", 60))
+
+# A job is given up (marked failed) once it has been claimed this many times without finishing,
+# so a job that kills or hangs its process is not leased out forever.
+JOB_MAX_ATTEMPTS = int(os.environ.get("RECEIPT_JOB_MAX_ATTEMPTS", 3))
+
+log = get_logger("jobs")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Durable job queue backed by SQLite, processed by a small pool of local worker threads.
+# handler(payload_path, filename) does the actual work and returns a JSON serializable result.
+# The payload file is removed once the job has finished, successfully or not.
+# Several processes may share a jobs directory: each job is leased to one worker id at a time.
+class JobQueue:
+    def __init__(self, handler, jobs_dir=JOBS_DIR, workers=JOB_WORKERS, poll_interval=5.0,
+                 lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.handler = handler
+        self.jobs_dir = jobs_dir
+        self.payload_dir = os.path.join(jobs_dir, 'payloads')
+        self.db_path = os.path.join(jobs_dir, 'jobs.db')
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Condition()
+        # The heartbeat sleeps on its own event, so a submit() notify always reaches a worker
+        self._stopped = threading.Event()
+        self._threads = []
+        self._stopping = False
+
+        os.makedirs(self.payload_dir, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    payload_path TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            # Job databases created before leases and attempt counts were added
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'worker_id' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN worker_id TEXT")
+            if 'lease_until' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+            if 'attempts' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # Writes the payload to disk, records the job and wakes a worker. Returns the job id.
+    def submit(self, payload, filename):
+        job_id = uuid.uuid4().hex
+        payload_path = os.path.join(self.payload_dir, job_id + os.path.splitext(filename)[1])
+        with open(payload_path, 'wb') as f:
+            if isinstance(payload, (bytes, bytearray)):
+                f.write(payload)
+            else:
+                for chunk in iter(lambda: payload.read(256 * 1024), b""):
+                    f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT INTO jobs (id, status, filename, payload_path, created_at, updated_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", (job_id, QUEUED, filename, payload_path, now, now))
+
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    # Returns the job as a dict (status, result or error), or None if the id is unknown.
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = {'job_id': row['id'], 'status': row['status'], 'filename': row['filename'],
+               'attempts': row['attempts'], 'created_at': row['created_at'], 'updated_at': row['updated_at']}
+        if row['result'] is not None:
+            job['result'] = json.loads(row['result'])
+        if row['error'] is not None:
+            job['error'] = row['error']
+        return job
+
+    # Prunes old finished jobs and starts the workers and the lease heartbeat. Jobs left running by a
+    # stopped process are not touched here; they are claimed again once their lease expires.
+    def start(self):
+        if self._threads:
+            return
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                         (DONE, FAILED, time.time() - JOB_RETENTION_SECONDS))
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work_loop, name=f"receipt-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat_loop, name="receipt-job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    # Stops the workers after their current job.
+    def stop(self):
+        self._stopping = True
+        self._stopped.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stopping = False
+        self._stopped.clear()
+
+    # Atomically leases the oldest queued job, or a running job whose lease has expired, to this
+    # queue's worker id and returns it. Expired jobs that have used up their attempts are marked failed
+    # (and their payloads removed) instead.
+    def _claim(self, conn):
+        abandoned = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            while True:
+                row = conn.execute("SELECT id, filename, payload_path, status, worker_id, attempts FROM jobs "
+                                   "WHERE status = ? OR (status = ? AND (lease_until IS NULL OR lease_until < ?)) "
+                                   "ORDER BY created_at LIMIT 1", (QUEUED, RUNNING, now)).fetchone()
+                if row is None or row['attempts'] < self.max_attempts:
+                    break
+                conn.execute("UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                             (FAILED, f"Gave up after {row['attempts']} attempts", now, row['id']))
+                abandoned.append(row)
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = ?, worker_id = ?, lease_until = ?, attempts = attempts + 1, "
+                             "updated_at = ? WHERE id = ?",
+                             (RUNNING, self.worker_id, now + self.lease_seconds, now, row['id']))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        for job in abandoned:
+            log.error("job abandoned after repeated attempts", job=job['id'], attempts=job['attempts'],
+                      previous_worker=job['worker_id'])
+            try:
+                os.remove(job['payload_path'])
+            except OSError:
+                pass
+        if row is not None and row['status'] == RUNNING:
+            log.warning("reclaimed job with expired lease", job=row['id'], previous_worker=row['worker_id'],
+                        attempt=row['attempts'] + 1)
+        return row
+
+    # Records the outcome of a job, unless its lease has passed to another worker in the meantime.
+    def _finish(self, conn, job_id, status, result=None, error=None):
+        updated = conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, updated_at = ? "
+                               "WHERE id = ? AND status = ? AND worker_id = ?",
+                               (status, result, error, time.time(), job_id, RUNNING, self.worker_id)).rowcount
+        if not updated:
+            log.warning("job lease lost, result discarded", job=job_id, status=status)
+        return bool(updated)
+
+    # Renews the leases of the jobs this queue is running until the queue stops.
+    def _heartbeat_loop(self):
+        with closing(self._connect()) as conn:
+            while not self._stopping:
+                try:
+                    conn.execute("UPDATE jobs SET lease_until = ? WHERE status = ? AND worker_id = ?",
+                                 (time.time() + self.lease_seconds, RUNNING, self.worker_id))
+                except sqlite3.Error as e:
+                    log.warning("job lease renewal failed", error=str(e))
+                self._stopped.wait(self.lease_seconds / 3)
+
+    def _work_loop(self):
+        with closing(self._connect()) as conn:
+            while not self._stopping:
+                job = self._claim(conn)
+                if job is None:
+                    with self._wakeup:
+                        self._wakeup.wait(self.poll_interval)
+                    continue
+
+                # The job id doubles as the request id, so the job's spans and logs can be traced
+                token = start_request("job", job['id'])
+                finished = False
+                try:
+                    result = self.handler(job['payload_path'], job['filename'])
+                    finished = self._finish(conn, job['id'], DONE, result=json.dumps(result, default=str))
+                except Exception as e:
+                    log.exception("job failed", job=job['id'], error=str(e))
+                    finished = self._finish(conn, job['id'], FAILED, error=str(e))
+                finally:
+                    end_request(token)
+                    # A worker that lost its lease leaves the payload to the worker that now holds the job
+                    if finished:
+                        try:
+                            os.remove(job['payload_path'])
+                        except OSError:
+                            pass
@@ -0,0 +1,154 @@
+import argparse
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+from receipts_db import (AWS_REGION, CATEGORY_INDEX, MONTH_INDEX, RECEIPTS_TABLE_NAME, UPDATES_INDEX,
+                         index_attributes, parallel_scan, receipt_sort_key, tombstone_item, updated_attributes)
+
+# Definitions of the secondary indexes the date and category queries and the snapshot sync rely on
+# (partition key, sort key, projection)
+INDEX_DEFINITIONS = {
+    MONTH_INDEX: ('GSI1PK', 'GSI1SK', 'ALL'),
+    CATEGORY_INDEX: ('GSI2PK', 'GSI2SK', 'ALL'),
+    UPDATES_INDEX: ('GSI3PK', 'GSI3SK', 'KEYS_ONLY'),
+}
+
+# Attribute holding the expiry time of delete tombstones
+TTL_ATTRIBUTE = 'ExpiresAt'
+
+# Turns on TTL expiry of delete tombstones, if it is not on already.
+def enable_ttl(client, table_name):
+    status = client.describe_time_to_live(TableName=table_name).get('TimeToLiveDescription', {})
+    if status.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+        print(f"TTL on {status.get('AttributeName')}: {status['TimeToLiveStatus']}")
+        return
+    client.update_time_to_live(TableName=table_name,
+                               TimeToLiveSpecification={'Enabled': True, 'AttributeName': TTL_ATTRIBUTE})
+    print(f"Enabled TTL on {TTL_ATTRIBUTE}.")
+
+# Adds any missing secondary index to the table. DynamoDB builds one index at a time, so this
+# creates the first missing index and asks to be run again once it is ACTIVE.
+def create_indexes(client, table_name):
+    description = client.describe_table(TableName=table_name)['Table']
+    existing = {index['IndexName']: index['IndexStatus'] for index in description.get('GlobalSecondaryIndexes', [])}
+    billing = description.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+
+    for name, status in existing.items():
+        if name in INDEX_DEFINITIONS:
+            print(f"{name}: {status}")
+
+    missing = [name for name in INDEX_DEFINITIONS if name not in existing]
+    if not missing:
+        print("All indexes exist.")
+        return
+    if any(status != 'ACTIVE' for status in existing.values()):
+        print(f"An index is still being built, run again later to create: {', '.join(missing)}")
+        return
+
+    name = missing[0]
+    partition_key, sort_key, projection = INDEX_DEFINITIONS[name]
+    create = {
+        'IndexName': name,
+        'KeySchema': [{'AttributeName': partition_key, 'KeyType': 'HASH'},
+                      {'AttributeName': sort_key, 'KeyType': 'RANGE'}],
+        'Projection': {'ProjectionType': projection},
+    }
+    if billing == 'PROVISIONED':
+        create['ProvisionedThroughput'] = {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+
+    client.update_table(
+        TableName=table_name,
+        AttributeDefinitions=[{'AttributeName': partition_key, 'AttributeType': 'S'},
+                              {'AttributeName': sort_key, 'AttributeType': 'S'}],
+        GlobalSecondaryIndexUpdates=[{'Create': create}],
+    )
+    print(f"Creating {name}.")
+    if len(missing) > 1:
+        print(f"Run again once it is ACTIVE to create: {', '.join(missing[1:])}")
+
+# Returns the item as it should look under the new key layout
+def migrated_item(item):
+    transaction_date = item.get('TransactionDate') or item.get('Date')  # TransactionDate is set by edits
+    new_item = {k: v for k, v in item.items() if k not in ('TxnDate', 'TxnMonth', 'GSI1PK', 'GSI1SK')}
+    new_item['SK'] = receipt_sort_key(transaction_date)
+    new_item.update(index_attributes(item.get('VendorName'), transaction_date, item.get('ExpenseType')))
+    if new_item['SK'] != item['SK']:
+        new_item.update(updated_attributes())
+    elif 'GSI3PK' not in item:
+        new_item.update(updated_attributes(item.get('UpdatedAt')))
+    return new_item
+
+# Rewrites every receipt to the ISO date sort key and adds the index attributes.
+# Items whose sort key changes are moved with a transactional put + delete (plus a tombstone for the
+# old key, for snapshot syncs), so a receipt is never lost or duplicated, and the put is skipped if a
+# receipt already exists under the new key.
+def migrate(table_name, segments=4, dry_run=False):
+    client = boto3.client('dynamodb', region_name=AWS_REGION)
+    table = boto3.resource('dynamodb', region_name=AWS_REGION).Table(table_name)
+    serializer = TypeSerializer()
+    counts = {'scanned': 0, 'moved': 0, 'updated': 0, 'unchanged': 0, 'conflicts': 0}
+
+    for item in parallel_scan(table_name, segments):
+        if not str(item.get('SK', '')).startswith('receipt#'):
+            continue
+        counts['scanned'] += 1
+        new_item = migrated_item(item)
+
+        if new_item == item:
+            counts['unchanged'] += 1
+            continue
+
+        if new_item['SK'] == item['SK']:
+            counts['updated'] += 1
+            if not dry_run:
+                table.put_item(Item=new_item)
+            continue
+
+        print(f"{item['PK']}: {item['SK']} -> {new_item['SK']}")
+        counts['moved'] += 1
+        if dry_run:
+            continue
+        try:
+            client.transact_write_items(TransactItems=[
+                {'Put': {
+                    'TableName': table_name,
+                    'Item': {k: serializer.serialize(v) for k, v in new_item.items()},
+                    'ConditionExpression': 'attribute_not_exists(PK)',
+                }},
+                {'Delete': {
+                    'TableName': table_name,
+                    'Key': {'PK': serializer.serialize(item['PK']), 'SK': serializer.serialize(item['SK'])},
+                }},
+                {'Put': {
+                    'TableName': table_name,
+                    'Item': {k: serializer.serialize(v) for k, v in tombstone_item(item['PK'], item['SK']).items()},
+                }},
+            ])
+        except client.exceptions.TransactionCanceledException:
+            counts['moved'] -= 1
+            counts['conflicts'] += 1
+            print(f"  skipped, {new_item['PK']} / {new_item['SK']} already exists")
+
+    return counts
+
+# Migrates ReceiptsTable to chronologically sortable keys and the month/category/update indexes:
+#   python migrate_keys.py create-indexes
+#   python migrate_keys.py migrate --dry-run
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["create-indexes", "migrate"])
+    ap.add_argument("--table", default=RECEIPTS_TABLE_NAME)
+    ap.add_argument("--segments", type=int, default=4, help="parallel scan segments")
+    ap.add_argument("--dry-run", action="store_true", help="report the changes without writing them")
+    args = ap.parse_args()
+
+    if args.command == "create-indexes":
+        client = boto3.client('dynamodb', region_name=AWS_REGION)
+        create_indexes(client, args.table)
+        enable_ttl(client, args.table)
+        return
+
+    counts = migrate(args.table, args.segments, args.dry_run)
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'}: {counts}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import atexit
+import os
+import queue
+import threading
+from contextlib import contextmanager
+import cv2
+import numpy as np
+import pytesseract
+from instrumentation import get_logger, timed
+
+log = get_logger("ocr")
+
+# tesserocr binds libtesseract directly, so an engine can be created once and reused for every image.
+# Without it we fall back to pytesseract, which starts a new tesseract process per image.
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Engines kept per (language, page segmentation mode). Each OCR call checks an engine out of the pool and
+# returns it, so the number of native engines stays bounded however many threads (request handlers,
+# job workers, executor threads) run OCR; callers beyond the limit wait for a free engine.
+ENGINE_POOL_SIZE = int(os.environ.get("OCR_ENGINE_POOL_SIZE", min(4, os.cpu_count() or 1)))
+
+_pools = {}
+_pools_lock = threading.Lock()
+_init_failed = False
+
+# Returns True when the persistent in-process backend is available.
+def has_persistent_engine():
+    return tesserocr is not None and not _init_failed
+
+# Up to `size` pre-initialized Tesseract engines for one language and page segmentation mode, created
+# on demand (loading the traineddata once per engine) and reused, most recently used first.
+class EnginePool:
+    def __init__(self, language, psm, size=ENGINE_POOL_SIZE):
+        self.language = language
+        self.psm = psm
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._engines = []
+        self._lock = threading.Lock()
+
+    # Takes an idle engine, creates one while under the limit, or waits for one to be released.
+    # Waiting rechecks the limit now and then, in case an engine that was being created failed to load.
+    def acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                create = len(self._engines) < self.size
+                if create:
+                    self._engines.append(None)  # reserves the slot while the engine loads
+            if create:
+                break
+            try:
+                return self._idle.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+        try:
+            api = tesserocr.PyTessBaseAPI(lang=self.language, psm=self.psm)
+        except BaseException:
+            with self._lock:
+                self._engines.remove(None)
+            raise
+        with self._lock:
+            self._engines[self._engines.index(None)] = api
+        return api
+
+    def release(self, api):
+        api.Clear()
+        self._idle.put(api)
+
+    # Ends every engine of the pool. Only safe once no engine is checked out.
+    def close(self):
+        with self._lock:
+            for api in self._engines:
+                if api is not None:
+                    api.End()
+            self._engines.clear()
+        self._idle = queue.LifoQueue()
+
+    def __len__(self):
+        return len(self._engines)
+
+def get_pool(language="eng", psm=6):
+    key = (language, psm)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = EnginePool(language, psm)
+        return pool
+
+# Checks an engine out of the pool for the duration of the block. Yields None (and switches this process
+# to the pytesseract fallback) if the engine cannot start, e.g. because tesserocr cannot find the traineddata.
+@contextmanager
+def checkout_engine(language="eng", psm=6):
+    global _init_failed
+    api = None
+    if has_persistent_engine():
+        pool = get_pool(language, psm)
+        try:
+            api = pool.acquire()
+        except RuntimeError as e:
+            _init_failed = True
+            log.warning("in-process tesseract unavailable, falling back to pytesseract", error=str(e))
+    if api is None:
+        yield None
+        return
+    try:
+        yield api
+    finally:
+        pool.release(api)
+
+# Loads an engine ahead of the first image, e.g. from a process pool initializer.
+def warm_up(language="eng", psm=6):
+    with checkout_engine(language, psm):
+        pass
+
+# Releases every engine created by this process.
+@atexit.register
+def shutdown():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+# Runs OCR on an OpenCV image (grayscale or BGR array) and returns the text.
+# The array is handed to the engine as raw pixels, nothing is written to disk.
+# timeout only applies to the pytesseract fallback.
+@timed("ocr.tesseract")
+def image_to_string(img, language="eng", psm=6, timeout=60):
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    with checkout_engine(language, psm) as api:
+        if api is None:
+            return pytesseract.image_to_string(img, lang=language, timeout=timeout, config=f"--psm {psm}")
+
+        img = np.ascontiguousarray(img)
+        (h, w) = img.shape[:2]
+        bytes_per_pixel = 1 if img.ndim == 2 else img.shape[2]
+        api.SetImageBytes(img.tobytes(), w, h, bytes_per_pixel, w * bytes_per_pixel)
+        return api.GetUTF8Text()
@@ -0,0 +1,249 @@
+import argparse
+import difflib
+import json
+import time
+import cv2
+import numpy as np
+from deskew import find_skew_angle
+from instrumentation import record_span
+from stage_trace import NULL_TRACER
+
+# Registry of preprocessing stages by name. Every stage takes an image array plus keyword parameters
+# and returns the new image array.
+STAGES = {}
+
+# Registers a function as a pipeline stage under the given name.
+def stage(name):
+    def register(func):
+        STAGES[name] = func
+        return func
+    return register
+
+# Rescales the image by the given factor.
+@stage("rescale")
+def rescale_image(img, factor=1.2):
+    return cv2.resize(img, None, fx=factor, fy=factor, interpolation=cv2.INTER_CUBIC)
+
+# Rotates a landscape image clockwise by a multiple of 90 degrees; portrait images are left alone.
+@stage("rotate_upright")
+def rotate_upright(img, angle=90):
+    (h, w) = img.shape[:2]
+    if w < h:
+        return img
+    return np.ascontiguousarray(np.rot90(img, k=-(int(angle) // 90) % 4))
+
+# Converts the image to grayscale (no-op for images that are already single channel).
+@stage("grayscale")
+def grayscale_image(img):
+    if img.ndim == 2:
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+# Applies noise removal with a combination of blurs and thresholds.
+@stage("remove_noise")
+def remove_noise(img, block_size=31, c=2):
+    kernel = np.ones((1, 1), np.uint8)
+    img_dilated = cv2.dilate(img, kernel, iterations=1)
+    img_eroded = cv2.erode(img_dilated, kernel, iterations=1)
+    img_gaussian_blur = cv2.GaussianBlur(img_eroded, (5, 5), 0)
+    img_threshold = cv2.threshold(img_gaussian_blur, 150, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    img_bilateral = cv2.bilateralFilter(img_threshold, 5, 75, 75)
+    return cv2.adaptiveThreshold(img_bilateral, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                 cv2.THRESH_BINARY, block_size, c)
+
+# Removes shadows from the image by normalizing the background of every plane.
+@stage("remove_shadows")
+def remove_shadows(img):
+    rgb_planes = cv2.split(img)
+    result_planes = []
+    for plane in rgb_planes:
+        dilated_img = cv2.dilate(plane, np.ones((7, 7), np.uint8))
+        bg_img = cv2.medianBlur(dilated_img, 21)
+        diff_img = 255 - cv2.absdiff(plane, bg_img)
+        result_planes.append(cv2.normalize(diff_img, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX, dtype=cv2.CV_8UC1))
+    return cv2.merge(result_planes)
+
+# Finds the skew angle with the projection-profile search.
+# invert=True thresholds text as foreground (THRESH_BINARY_INV), otherwise the background is foreground.
+def detect_skew_angle(image, delta=0.5, limit=15, invert=False):
+    gray = grayscale_image(image)
+    mode = cv2.THRESH_BINARY_INV if invert else cv2.THRESH_BINARY
+    thresh = cv2.threshold(gray, 0, 255, mode + cv2.THRESH_OTSU)[1]
+    return find_skew_angle(thresh, delta, limit)
+
+# Rotates the image about its centre by the given angle, keeping the original size.
+def rotate_by_angle(image, angle):
+    (h, w) = image.shape[:2]
+    M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    return cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+# Deskews the image using the projection-profile search. Angles at or below min_angle are not corrected.
+@stage("deskew_projection")
+def deskew_projection(image, delta=0.5, limit=15, invert=False, min_angle=0.1):
+    angle = detect_skew_angle(image, delta, limit, invert)
+    if abs(angle) <= min_angle:
+        return image
+    return rotate_by_angle(image, angle)
+
+# Deskews a binary image from the minimum area rectangle around its non-zero pixels.
+@stage("deskew_min_area_rect")
+def deskew_min_area_rect(image):
+    coords = np.column_stack(np.where(image > 0))
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle < -45:
+        angle = -(90 + angle)
+    else:
+        angle = -angle
+    return rotate_by_angle(image, angle)
+
+# Adjusts contrast (alpha) and brightness (beta).
+@stage("contrast")
+def adjust_contrast(img, alpha=1.5, beta=20):
+    return cv2.convertScaleAbs(img, alpha=alpha, beta=beta)
+
+# Applies a Gaussian blur with a square kernel.
+@stage("gaussian_blur")
+def gaussian_blur(img, ksize=5):
+    return cv2.GaussianBlur(img, (ksize, ksize), 0)
+
+# Applies Gaussian adaptive thresholding.
+@stage("adaptive_threshold")
+def adaptive_threshold(img, block_size=11, c=2):
+    return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, c)
+
+# Dilates and then erodes the image to join broken strokes.
+@stage("dilate_erode")
+def dilate_erode(img, size=2):
+    kernel = np.ones((size, size), np.uint8)
+    dilated = cv2.dilate(img, kernel, iterations=1)
+    return cv2.erode(dilated, kernel, iterations=1)
+
+# Declarative pipeline configs. Each one is a list of (stage name, parameters) and reproduces
+# one of the existing enhancement chains.
+PIPELINES = {
+    # receipt_parser.enhance_image
+    "receipt_parser": [
+        ("rescale", {"factor": 1.2}),
+        ("rotate_upright", {}),
+        ("deskew_projection", {"delta": 1, "limit": 5, "invert": True, "min_angle": 0}),
+        ("remove_shadows", {}),
+        ("grayscale", {}),
+        ("remove_noise", {}),
+    ],
+    # The numbered stages of preprocessing.py, in the order of their debug output files
+    "preprocessing": [
+        ("rescale", {"factor": 1.2}),
+        ("grayscale", {}),
+        ("remove_noise", {}),
+        ("remove_shadows", {}),
+        ("deskew_projection", {"delta": 0.5, "limit": 15, "invert": False, "min_angle": 0.1}),
+    ],
+    # image_preprocessing.preprocess_image
+    "image_preprocessing": [
+        ("grayscale", {}),
+        ("contrast", {"alpha": 1.5, "beta": 20}),
+        ("gaussian_blur", {"ksize": 5}),
+        ("adaptive_threshold", {"block_size": 11, "c": 2}),
+        ("dilate_erode", {"size": 2}),
+        ("deskew_min_area_rect", {}),
+    ],
+}
+
+# Returns the stage list for a pipeline name, or the config itself if one is passed in.
+def resolve_pipeline(config):
+    if isinstance(config, str):
+        if config not in PIPELINES:
+            raise ValueError(f"Unknown pipeline '{config}'. Available: {', '.join(sorted(PIPELINES))}")
+        config = PIPELINES[config]
+
+    steps = []
+    for step in config:
+        if isinstance(step, str):
+            name, params = step, {}
+        else:
+            name, params = step[0], dict(step[1]) if len(step) > 1 else {}
+        if name not in STAGES:
+            raise ValueError(f"Unknown pipeline stage '{name}'. Available: {', '.join(sorted(STAGES))}")
+        steps.append((name, params))
+    return steps
+
+# Loads pipeline configs from a JSON file shaped like {"name": [["stage", {params}], ...]}.
+def load_pipeline_config(path):
+    with open(path, "r", encoding='utf-8') as f:
+        configs = json.load(f)
+    return {name: resolve_pipeline(steps) for name, steps in configs.items()}
+
+# Runs the image through every stage of the pipeline.
+# Returns the final image and one timing record per stage (wall time, output shape and size in bytes).
+# Each stage is also recorded as a "stage.<name>" span.
+def run_pipeline(img, config, tracer=NULL_TRACER):
+    timings = []
+    for index, (name, params) in enumerate(resolve_pipeline(config), start=1):
+        start = time.perf_counter()
+        img = STAGES[name](img, **params)
+        elapsed = time.perf_counter() - start
+        record_span(f"stage.{name}", elapsed)
+
+        timings.append({
+            'stage': name,
+            'seconds': elapsed,
+            'shape': tuple(img.shape),
+            'bytes': int(img.nbytes),
+        })
+        tracer.capture(f"{index}_{name}", img)
+
+    return img, timings
+
+# Formats the timing records of one pipeline run as a small table.
+def format_timings(timings):
+    lines = [f"{'stage':<22}{'ms':>10}  {'shape':<18}{'bytes':>12}"]
+    for t in timings:
+        lines.append(f"{t['stage']:<22}{t['seconds'] * 1000:>10.1f}  {str(t['shape']):<18}{t['bytes']:>12}")
+    lines.append(f"{'total':<22}{sum(t['seconds'] for t in timings) * 1000:>10.1f}")
+    return "\n".join(lines)
+
+# Character-level similarity between OCR output and the expected text (1.0 is a perfect match).
+def text_accuracy(text, expected):
+    return difflib.SequenceMatcher(None, " ".join(text.split()), " ".join(expected.split())).ratio()
+
+# Runs every selected pipeline on an image and prints the stage timings so the variants can be compared.
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-i", "--image", required=True, nargs="+", help="path(s) to input receipt images")
+    ap.add_argument("-p", "--pipeline", nargs="+", default=sorted(PIPELINES),
+                    help="pipeline(s) to run (default: all)")
+    ap.add_argument("-c", "--config", default=None, help="JSON file with additional pipeline configs")
+    ap.add_argument("--ocr", action="store_true", help="also run Tesseract on the result")
+    ap.add_argument("--expected", default=None, help="text file with the expected OCR output")
+    args = ap.parse_args()
+
+    if args.config:
+        PIPELINES.update(load_pipeline_config(args.config))
+
+    expected = None
+    if args.expected:
+        with open(args.expected, "r", encoding='utf-8') as f:
+            expected = f.read()
+
+    for image_path in args.image:
+        img = cv2.imread(image_path)
+        if img is None:
+            print(f"Could not read image: {image_path}")
+            continue
+
+        for name in args.pipeline:
+            result, timings = run_pipeline(img, name)
+            print(f"\n{image_path} [{name}]")
+            print(format_timings(timings))
+
+            if args.ocr or expected is not None:
+                from ocr_backend import image_to_string
+                start = time.perf_counter()
+                text = image_to_string(result, psm=6)
+                line = f"ocr {time.perf_counter() - start:.3f}s, {len(text)} chars"
+                if expected is not None:
+                    line += f", accuracy {text_accuracy(text, expected):.3f}"
+                print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from receipts_db import RECEIPTS_TABLE_NAME, TOMBSTONE_TTL_DAYS, batch_get_items, changed_since, utc_timestamp
+from visualization import load_receipts_frame
+
+# Local Parquet copy of ReceiptsTable for analytics, one partition per transaction month:
+#   <dir>/month=2024-03/part.parquet, ..., <dir>/month=unknown/part.parquet
+# plus <dir>/_sync.json recording the last sync.
+SNAPSHOT_DIR = os.environ.get("RECEIPT_SNAPSHOT_DIR", os.path.join(os.getcwd(), 'snapshot'))
+STATE_FILE = "_sync.json"
+UNKNOWN_MONTH = "unknown"
+
+# How far before the last sync a refresh looks for changes, to cover the eventually consistent
+# update index and writers whose clocks are slightly behind.
+SYNC_OVERLAP = timedelta(minutes=5)
+
+# Columns the query API loads; pk, sk and updated_at are only needed to sync.
+ANALYTICS_COLUMNS = ['vendor', 'category', 'date', 'amount_cents']
+
+# Partition month (YYYY-MM or "unknown") for each row of a frame.
+def month_column(frame):
+    months = frame['date'].dt.strftime("%Y-%m")
+    return months.where(frame['date'].notna(), UNKNOWN_MONTH)
+
+def partition_path(directory, month):
+    return os.path.join(directory, f"month={month}", "part.parquet")
+
+# Rewrites one month partition with the given rows, or removes it when there are none.
+def write_partition(directory, month, rows):
+    path = partition_path(directory, month)
+    if rows.empty:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = rows.drop(columns=['month'], errors='ignore').reset_index(drop=True)
+    for column in ('vendor', 'category'):
+        rows[column] = rows[column].astype('category')
+    tmp_path = path + ".tmp"
+    pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+# Reads the snapshot (optionally only some columns or months) into one frame.
+def read_snapshot(directory=SNAPSHOT_DIR, columns=None, months=None):
+    if not os.path.isdir(directory) or not any(name.startswith("month=") for name in os.listdir(directory)):
+        return load_receipts_frame(items=[], include_keys=True).assign(month=pd.Series([], dtype=object))
+    dataset = ds.dataset(directory, format='parquet', partitioning='hive', exclude_invalid_files=True)
+    filter_ = ds.field('month').isin(list(months)) if months is not None else None
+    frame = dataset.to_table(columns=columns, filter=filter_).to_pandas()
+    for column in ('vendor', 'category', 'month'):
+        if column in frame and frame[column].dtype != 'category':
+            frame[column] = frame[column].astype('category')
+    return frame
+
+def load_state(directory):
+    try:
+        with open(os.path.join(directory, STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_state(directory, state):
+    path = os.path.join(directory, STATE_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+# Rebuilds the whole snapshot from a parallel scan of the table.
+def full_sync(table_name=RECEIPTS_TABLE_NAME, directory=SNAPSHOT_DIR, segments=4):
+    start = time.perf_counter()
+    # Taken before the scan, so writes made while it runs fall inside the next refresh's window
+    sync_time = utc_timestamp()
+    frame = load_receipts_frame(table_name, segments, include_keys=True)
+    frame['month'] = month_column(frame)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    for month, rows in frame.groupby('month', observed=True):
+        write_partition(directory, month, rows)
+
+    stats = {'mode': 'full', 'receipts': len(frame), 'changed': len(frame), 'deleted': 0,
+             'partitions_written': frame['month'].nunique(), 'seconds': time.perf_counter() - start}
+    save_state(directory, {'last_sync': sync_time, 'receipts': len(frame)})
+    return stats
+
+# Brings the snapshot up to date with the table, rewriting only the months that changed.
+# Receipts written or deleted since the last sync come from the keys-only ReceiptsByUpdate index
+# (deletes as tombstones), so a refresh reads in proportion to the changes, not the table; only new and
+# edited receipts are then fetched in full with BatchGetItem. Falls back to a full sync when there is no
+# snapshot yet, or when the last sync is so old that tombstones of deletes since may have expired.
+# Receipts written before the index existed are only picked up once migrate_keys.py has added its keys.
+def refresh(table_name=RECEIPTS_TABLE_NAME, directory=SNAPSHOT_DIR, segments=4):
+    state = load_state(directory)
+    if state is None:
+        return full_sync(table_name, directory, segments)
+    last_sync = datetime.strptime(state['last_sync'], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+    if datetime.now(timezone.utc) - last_sync > timedelta(days=TOMBSTONE_TTL_DAYS - 1):
+        return full_sync(table_name, directory, segments)
+
+    start = time.perf_counter()
+    sync_time = utc_timestamp()
+    since = (last_sync - SYNC_OVERLAP).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    # Latest change per receipt: (UpdatedAt, deleted)
+    latest = {}
+    for pk, sk, updated_at, is_delete in changed_since(since, table_name):
+        key = (pk, sk)
+        if key not in latest or updated_at >= latest[key][0]:
+            latest[key] = (updated_at, is_delete)
+
+    known = read_snapshot(directory, columns=['pk', 'sk', 'updated_at', 'month'])
+    known_keys = dict(zip(zip(known['pk'], known['sk']), zip(known['updated_at'], known['month'].astype(str))))
+
+    changed = [key for key, (updated_at, is_delete) in latest.items()
+               if not is_delete and (key not in known_keys or known_keys[key][0] != updated_at)]
+    items = batch_get_items([{'PK': pk, 'SK': sk} for pk, sk in changed], table_name)
+    # A receipt deleted after the index was read is missing from the batch get
+    deleted = [key for key, (_, is_delete) in latest.items()
+               if key in known_keys and (is_delete or (key in changed and key not in items))]
+    changed = [key for key in changed if key in items]
+
+    fresh = load_receipts_frame(items=items.values(), include_keys=True)
+    fresh['month'] = month_column(fresh)
+
+    stale_keys = set(deleted) | set(changed)
+    months = {known_keys[key][1] for key in stale_keys if key in known_keys} | set(fresh['month'])
+    for month in sorted(months):
+        rows = read_snapshot(directory, months=[month])
+        keep = [(pk, sk) not in stale_keys for pk, sk in zip(rows['pk'], rows['sk'])]
+        rows = pd.concat([rows[keep].drop(columns=['month'], errors='ignore'),
+                          fresh[fresh['month'] == month].drop(columns=['month'])], ignore_index=True)
+        write_partition(directory, month, rows)
+
+    receipts = len(known_keys) - len(deleted) + sum(key not in known_keys for key in changed)
+    save_state(directory, {'last_sync': sync_time, 'receipts': receipts})
+    return {'mode': 'incremental', 'receipts': receipts, 'changed': len(changed), 'deleted': len(deleted),
+            'partitions_written': len(months), 'seconds': time.perf_counter() - start}
+
+# Vectorized analytics over the snapshot. The frame is loaded once and sorted by date, so a date range
+# is a binary search and every aggregate is a numpy bincount over categorical codes.
+class ReceiptSnapshot:
+    def __init__(self, directory=SNAPSHOT_DIR, frame=None):
+        if frame is None:
+            frame = read_snapshot(directory, columns=ANALYTICS_COLUMNS)
+        frame = frame[ANALYTICS_COLUMNS].sort_values('date', kind='stable', na_position='last')
+        self.frame = frame.reset_index(drop=True)
+        for column in ('vendor', 'category'):
+            self.frame[column] = self.frame[column].astype('category')
+        self._dates = self.frame['date'].to_numpy(dtype='datetime64[ns]')
+        self._dated = int(self.frame['date'].notna().sum())
+        # Month numbers since the epoch of the dated rows, for monthly totals
+        self._months = self._dates[:self._dated].astype('datetime64[M]').astype(np.int64)
+        self._cents = self.frame['amount_cents'].to_numpy(dtype=np.int64)
+        self._codes = {column: self.frame[column].cat.codes.to_numpy() for column in ('vendor', 'category')}
+
+    def __len__(self):
+        return len(self.frame)
+
+    # Row slice for an inclusive date range (None = open ended). Undated receipts are only
+    # included when no range is given.
+    def _range(self, start=None, end=None):
+        if start is None and end is None:
+            return slice(0, len(self.frame))
+        dates = self._dates[:self._dated]
+        lo = 0 if start is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(start)), 'left'))
+        hi = self._dated if end is None else int(np.searchsorted(
+            dates, np.datetime64(pd.Timestamp(end) + pd.Timedelta(days=1)), 'left'))
+        return slice(lo, max(lo, hi))
+
+    # Total (in dollars) and receipt count per value of column within the range, largest first.
+    def breakdown(self, column, start=None, end=None):
+        rows = self._range(start, end)
+        codes = self._codes[column][rows]
+        size = len(self.frame[column].cat.categories)
+        totals = np.bincount(codes, weights=self._cents[rows], minlength=size)
+        counts = np.bincount(codes, minlength=size)
+        result = pd.DataFrame({column: self.frame[column].cat.categories, 'total': totals / 100.0, 'count': counts})
+        result = result[result['count'] > 0].sort_values('total', ascending=False, ignore_index=True)
+        grand_total = result['total'].sum()
+        result['share'] = result['total'] / grand_total if grand_total else 0.0
+        return result
+
+    def category_breakdown(self, start=None, end=None):
+        return self.breakdown('category', start, end)
+
+    def top_vendors(self, n=10, start=None, end=None):
+        return self.breakdown('vendor', start, end).head(n)
+
+    # Spending per period (pandas frequency, e.g. "M" or "W"), in chronological order.
+    def totals_by_period(self, freq="M", start=None, end=None):
+        rows = self._range(start, end)
+        # Undated receipts sort last, so cutting them off keeps dates aligned with the leading amounts
+        stop = min(rows.stop, self._dated)
+        dates = self._dates[rows.start:max(rows.start, stop)]
+        cents = self._cents[rows.start:max(rows.start, stop)]
+        if freq == "M":
+            months = self._months[rows.start:max(rows.start, stop)]
+            if not len(months):
+                return pd.Series([], dtype=np.float64)
+            first = months[0]
+            totals = np.bincount(months - first, weights=cents)
+            index = pd.period_range(pd.Period(np.datetime64(int(first), 'M'), "M"), periods=len(totals), freq="M")
+            return pd.Series(totals / 100.0, index=index)[totals != 0]
+        periods = pd.Series(dates).dt.to_period(freq)
+        return (pd.Series(cents, index=periods).groupby(level=0).sum() / 100.0).sort_index()
+
+    # Compares two periods per category (or vendor): totals in each, absolute and relative change.
+    def compare_periods(self, previous, current, by='category'):
+        before = self.breakdown(by, *previous).set_index(by)['total']
+        after = self.breakdown(by, *current).set_index(by)['total']
+        result = pd.DataFrame({'previous': before, 'current': after}).fillna(0.0)
+        result['change'] = result['current'] - result['previous']
+        result['pct_change'] = np.where(result['previous'] > 0,
+                                        result['change'] / result['previous'].where(result['previous'] > 0, 1.0),
+                                        np.nan)
+        return result.sort_values('change', ascending=False).rename_axis(by).reset_index()
+
+# Random receipts for benchmarking the query API.
+def synthetic_frame(rows, vendors=2000, categories=12, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = np.datetime64('2020-01-01') + rng.integers(0, 5 * 365, rows).astype('timedelta64[D]')
+    return pd.DataFrame({
+        'vendor': pd.Categorical.from_codes(rng.integers(0, vendors, rows), [f"Vendor {i}" for i in range(vendors)]),
+        'category': pd.Categorical.from_codes(rng.integers(0, categories, rows), [f"Category {i}" for i in range(categories)]),
+        'date': dates.astype('datetime64[ns]'),
+        'amount_cents': rng.integers(100, 50000, rows).astype(np.int64),
+    })
+
+# Times each query type on a synthetic snapshot of the given size.
+def benchmark(rows, repeat=20):
+    snapshot = ReceiptSnapshot(frame=synthetic_frame(rows))
+    queries = {
+        'category_breakdown (all)': lambda: snapshot.category_breakdown(),
+        'category_breakdown (1 month)': lambda: snapshot.category_breakdown('2023-03-01', '2023-03-31'),
+        'top_vendors (1 year)': lambda: snapshot.top_vendors(10, '2023-01-01', '2023-12-31'),
+        'totals_by_period (monthly)': lambda: snapshot.totals_by_period("M"),
+        'compare_periods (year over year)': lambda: snapshot.compare_periods(('2022-01-01', '2022-12-31'),
+                                                                             ('2023-01-01', '2023-12-31')),
+    }
+    print(f"{rows} receipts")
+    for name, query in queries.items():
+        query()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            query()
+        print(f"  {name}: {(time.perf_counter() - start) / repeat * 1000:.2f} ms")
+
+# Sync and query the local receipts snapshot:
+#   python receipt_snapshot.py sync [--full]
+#   python receipt_snapshot.py report --start 2024-01-01 --end 2024-03-31
+#   python receipt_snapshot.py bench --rows 500000
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["sync", "report", "bench"])
+    ap.add_argument("--dir", default=SNAPSHOT_DIR, help="snapshot directory")
+    ap.add_argument("--table", default=RECEIPTS_TABLE_NAME)
+    ap.add_argument("--segments", type=int, default=4, help="parallel scan segments")
+    ap.add_argument("--full", action="store_true", help="rebuild the snapshot instead of refreshing it")
+    ap.add_argument("--start", help="report start date (YYYY-MM-DD)")
+    ap.add_argument("--end", help="report end date (YYYY-MM-DD)")
+    ap.add_argument("--rows", type=int, default=300000, help="synthetic receipts for bench")
+    args = ap.parse_args()
+
+    if args.command == "sync":
+        sync = full_sync if args.full else refresh
+        print(sync(args.table, args.dir, args.segments))
+    elif args.command == "bench":
+        benchmark(args.rows)
+    else:
+        snapshot = ReceiptSnapshot(args.dir)
+        print(f"{len(snapshot)} receipts, last sync {(load_state(args.dir) or {}).get('last_sync')}")
+        print(snapshot.category_breakdown(args.start, args.end).to_string(index=False))
+        print(snapshot.top_vendors(10, args.start, args.end).to_string(index=False))
+        print(snapshot.totals_by_period("M", args.start, args.end).to_string())
+
+if __name__ == '__main__':
+    main()
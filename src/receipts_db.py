@@ -0,0 +1,404 @@
+import base64
+import json
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from instrumentation import get_logger, instrument_aws
+
+AWS_REGION = "us-east-1"
+RECEIPTS_TABLE_NAME = "ReceiptsTable"
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_SCAN_SEGMENTS = 16
+
+log = get_logger("db")
+
+# Encodes a DynamoDB LastEvaluatedKey as an opaque, URL-safe continuation token.
+def encode_cursor(last_evaluated_key):
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, sort_keys=True, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip("=")
+
+# Decodes a continuation token back into an ExclusiveStartKey. Raises ValueError for a malformed token.
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')), parse_float=Decimal)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, dict):
+        raise ValueError("Invalid cursor")
+    return key
+
+# Clamps a caller-chosen page size to [1, MAX_PAGE_SIZE].
+def clamp_page_size(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+# Reads one page of the table. Returns the items and the cursor for the next page (None at the end).
+# A DynamoDB page can come back with fewer items than asked for (e.g. the 1 MB page limit), callers
+# should keep going while a cursor is returned.
+def scan_page(table, limit=DEFAULT_PAGE_SIZE, cursor=None, **scan_kwargs):
+    kwargs = dict(scan_kwargs, Limit=clamp_page_size(limit))
+    start_key = decode_cursor(cursor)
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    response = table.scan(**kwargs)
+    return response.get('Items', []), encode_cursor(response.get('LastEvaluatedKey'))
+
+# Scans the whole table with DynamoDB parallel scan segments, one thread per segment, and yields the
+# items as they arrive. Meant for exports and analytics. Pages are handed over through a bounded queue,
+# so a slow consumer pauses the scanners instead of the whole table piling up in memory.
+# Every thread uses its own boto3 resource since resources are not thread safe.
+def parallel_scan(table_name=RECEIPTS_TABLE_NAME, segments=4, page_size=MAX_PAGE_SIZE, **scan_kwargs):
+    segments = max(1, min(int(segments), MAX_SCAN_SEGMENTS))
+    pages = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+    done = object()
+
+    def scan_segment(segment):
+        try:
+            table = instrument_aws(boto3.session.Session().resource('dynamodb', region_name=AWS_REGION)).Table(table_name)
+            kwargs = dict(scan_kwargs, Segment=segment, TotalSegments=segments, Limit=page_size)
+            while not stop.is_set():
+                response = table.scan(**kwargs)
+                pages.put(response.get('Items', []))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(done)
+
+    threads = [threading.Thread(target=scan_segment, args=(i,), daemon=True) for i in range(segments)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        remaining = segments
+        while remaining:
+            page = pages.get()
+            if page is done:
+                remaining -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        # Let the scanners exit if the consumer stops early
+        stop.set()
+        while any(t.is_alive() for t in threads):
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+# DynamoDB accepts at most 25 put/delete requests per BatchWriteItem call.
+BATCH_WRITE_SIZE = 25
+DEFAULT_WRITE_PARALLELISM = 4
+MAX_WRITE_RETRIES = 8
+
+_thread_resources = threading.local()
+
+# Returns a DynamoDB resource owned by the calling thread.
+def thread_resource():
+    resource = getattr(_thread_resources, "dynamodb", None)
+    if resource is None:
+        resource = boto3.session.Session().resource('dynamodb', region_name=AWS_REGION)
+        resource = _thread_resources.dynamodb = instrument_aws(resource)
+    return resource
+
+# Splits items into BatchWriteItem sized chunks. Items with the same key are collapsed (last one wins),
+# since DynamoDB rejects a batch that writes the same key twice.
+def chunk_items(items, key_names=("PK", "SK")):
+    unique = {}
+    for item in items:
+        unique[tuple(item.get(k) for k in key_names)] = item
+    items = list(unique.values())
+    return [items[i:i + BATCH_WRITE_SIZE] for i in range(0, len(items), BATCH_WRITE_SIZE)]
+
+# Writes one chunk, retrying UnprocessedItems with exponential backoff and jitter.
+# Returns a report with the latency, the number of attempts and any items that could not be written.
+def write_batch(table_name, items, max_retries=MAX_WRITE_RETRIES):
+    start = time.perf_counter()
+    requests = [{'PutRequest': {'Item': item}} for item in items]
+    attempts = 0
+
+    while requests and attempts <= max_retries:
+        if attempts:
+            time.sleep(min(0.05 * (2 ** attempts), 5.0) * random.uniform(0.5, 1.0))
+        attempts += 1
+        response = thread_resource().batch_write_item(RequestItems={table_name: requests})
+        requests = response.get('UnprocessedItems', {}).get(table_name, [])
+
+    return {
+        'items': len(items),
+        'written': len(items) - len(requests),
+        'unprocessed': [r['PutRequest']['Item'] for r in requests],
+        'attempts': attempts,
+        'seconds': time.perf_counter() - start,
+    }
+
+# Writes many items with 25-item BatchWriteItem calls, several batches at a time.
+# Returns a summary with per-batch reports, overall throughput and the items that were not written.
+def batch_put_items(items, table_name=RECEIPTS_TABLE_NAME, parallelism=DEFAULT_WRITE_PARALLELISM,
+                    max_retries=MAX_WRITE_RETRIES):
+    start = time.perf_counter()
+    chunks = chunk_items(items)
+    batches = []
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix="receipt-write") as pool:
+        futures = {pool.submit(write_batch, table_name, chunk, max_retries): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                batches.append(future.result())
+            except Exception as e:
+                # A failed call (e.g. validation error) fails that batch only
+                log.error("batch write failed", table=table_name, items=len(futures[future]), error=str(e))
+                errors.append(str(e))
+                batches.append({'items': len(futures[future]), 'written': 0, 'unprocessed': futures[future],
+                                'attempts': 1, 'seconds': 0.0, 'error': str(e)})
+
+    elapsed = time.perf_counter() - start
+    written = sum(b['written'] for b in batches)
+    return {
+        'items': sum(b['items'] for b in batches),
+        'written': written,
+        'unprocessed': [item for b in batches for item in b['unprocessed']],
+        'batches': len(batches),
+        'batch_seconds': [round(b['seconds'], 4) for b in batches],
+        'seconds': elapsed,
+        'items_per_sec': written / elapsed if elapsed > 0 else 0.0,
+        'errors': errors,
+    }
+
+# Formats a batch_put_items summary as a single log line.
+def format_write_summary(summary):
+    slowest = max(summary['batch_seconds'], default=0.0)
+    return (f"{summary['written']}/{summary['items']} items written in {summary['batches']} batches, "
+            f"{summary['seconds']:.2f}s ({summary['items_per_sec']:.1f} items/sec, slowest batch {slowest:.3f}s), "
+            f"{len(summary['unprocessed'])} unprocessed")
+
+# DynamoDB accepts at most 100 keys per BatchGetItem call.
+BATCH_GET_SIZE = 100
+
+# Reads many items by key with BatchGetItem, retrying UnprocessedKeys with backoff.
+# Returns a dict from (PK, SK) to item; keys that do not exist are left out.
+def batch_get_items(keys, table_name=RECEIPTS_TABLE_NAME, max_retries=MAX_WRITE_RETRIES):
+    keys = list({(k['PK'], k['SK']): k for k in keys}.values())
+    found = {}
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request = {'Keys': keys[i:i + BATCH_GET_SIZE], 'ConsistentRead': True}
+        attempts = 0
+        while request and attempts <= max_retries:
+            if attempts:
+                time.sleep(min(0.05 * (2 ** attempts), 5.0) * random.uniform(0.5, 1.0))
+            attempts += 1
+            response = thread_resource().batch_get_item(RequestItems={table_name: request})
+            for item in response.get('Responses', {}).get(table_name, []):
+                found[(item['PK'], item['SK'])] = item
+            request = response.get('UnprocessedKeys', {}).get(table_name)
+    return found
+
+# Global secondary indexes. Both use generic key attribute names so the key layout can evolve
+# without redefining the indexes.
+#   ReceiptsByMonth:    GSI1PK = "month#YYYY-MM",      GSI1SK = "YYYY-MM-DD#<vendor>"
+#   ReceiptsByCategory: GSI2PK = "category#<type>",    GSI2SK = "YYYY-MM-DD#<vendor>" ("unknown#..." without a date)
+#   ReceiptsByUpdate:   GSI3PK = "updated#YYYY-MM-DD", GSI3SK = UpdatedAt (keys only, for snapshot syncs)
+# Receipts without a parseable date are left out of ReceiptsByMonth (a sparse index).
+MONTH_INDEX = "ReceiptsByMonth"
+CATEGORY_INDEX = "ReceiptsByCategory"
+UPDATES_INDEX = "ReceiptsByUpdate"
+INDEX_ATTRIBUTES = ("TxnDate", "TxnMonth", "GSI1PK", "GSI1SK", "GSI2PK", "GSI2SK")
+
+# A deleted receipt leaves a tombstone item (SK "deleted#<receipt SK>") in ReceiptsByUpdate, so syncs
+# see the delete. Tombstones expire through the table's TTL attribute; a sync older than that rebuilds.
+TOMBSTONE_PREFIX = "deleted#"
+TOMBSTONE_TTL_DAYS = 30
+
+# Scan filter for receipt items only (no tombstones)
+RECEIPT_ITEMS = Attr('SK').begins_with("receipt#")
+
+# Longest date range a single query may span, in months.
+MAX_QUERY_MONTHS = 120
+
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%Y/%m/%d")
+
+# Time of the last change to a receipt, stored as UpdatedAt so snapshots can sync incrementally.
+def utc_timestamp():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+# Converts a receipt date (MM/DD/YYYY as stored so far, or already ISO-8601) to YYYY-MM-DD.
+# Returns None for missing or unparseable dates.
+def to_iso_date(value):
+    if not value:
+        return None
+    value = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+# Partition key for a vendor's receipts.
+def receipt_partition_key(vendor_name):
+    return f"vendor#{vendor_name if vendor_name else 'unknown'}"
+
+# Sort key for a receipt. ISO dates sort chronologically, so vendor history can be range-queried.
+def receipt_sort_key(transaction_date):
+    return f"receipt#{to_iso_date(transaction_date) or 'unknown'}"
+
+# Returns the date and index attributes for a receipt.
+def index_attributes(vendor_name, transaction_date, expense_type):
+    iso_date = to_iso_date(transaction_date)
+    vendor = vendor_name or 'unknown'
+    attributes = {
+        'GSI2PK': f"category#{expense_type or 'Other'}",
+        'GSI2SK': f"{iso_date or 'unknown'}#{vendor}",
+    }
+    if iso_date:
+        attributes.update({
+            'TxnDate': iso_date,
+            'TxnMonth': iso_date[:7],
+            'GSI1PK': f"month#{iso_date[:7]}",
+            'GSI1SK': f"{iso_date}#{vendor}",
+        })
+    return attributes
+
+# UpdatedAt and the ReceiptsByUpdate keys, for every write of a receipt.
+def updated_attributes(updated_at=None):
+    updated_at = updated_at or utc_timestamp()
+    return {'UpdatedAt': updated_at, 'GSI3PK': f"updated#{updated_at[:10]}", 'GSI3SK': updated_at}
+
+# The tombstone recording that a receipt was deleted.
+def tombstone_item(pk, sk):
+    expires_at = int(time.time()) + TOMBSTONE_TTL_DAYS * 24 * 3600
+    return {'PK': pk, 'SK': TOMBSTONE_PREFIX + sk, 'ExpiresAt': expires_at, **updated_attributes()}
+
+# Yields (PK, SK, UpdatedAt, deleted) for every receipt written or deleted since the given UpdatedAt
+# timestamp, by querying ReceiptsByUpdate one day bucket at a time. Reads only index keys, so the cost
+# grows with the number of changes rather than the size of the table. The index is eventually
+# consistent, callers should ask for a little overlap with their previous sync.
+def changed_since(since, table_name=RECEIPTS_TABLE_NAME):
+    table = thread_resource().Table(table_name)
+    day = datetime.strptime(since[:10], "%Y-%m-%d").date()
+    today = datetime.now(timezone.utc).date()
+    while day <= today:
+        kwargs = {'IndexName': UPDATES_INDEX,
+                  'KeyConditionExpression': Key('GSI3PK').eq(f"updated#{day.isoformat()}") & Key('GSI3SK').gte(since)}
+        while True:
+            response = table.query(**kwargs)
+            for item in response.get('Items', []):
+                sk = item['SK']
+                if sk.startswith(TOMBSTONE_PREFIX):
+                    yield item['PK'], sk[len(TOMBSTONE_PREFIX):], item['GSI3SK'], True
+                else:
+                    yield item['PK'], sk, item['GSI3SK'], False
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        day += timedelta(days=1)
+
+# Lists the YYYY-MM months from start to end (ISO dates), inclusive.
+def months_between(start, end):
+    year, month = int(start[:4]), int(start[5:7])
+    end_year, end_month = int(end[:4]), int(end[5:7])
+    months = []
+    while (year, month) <= (end_year, end_month):
+        months.append(f"{year:04d}-{month:02d}")
+        if len(months) > MAX_QUERY_MONTHS:
+            raise ValueError(f"Date range spans more than {MAX_QUERY_MONTHS} months")
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return months
+
+# Validates and normalizes an optional start/end pair to ISO dates.
+def normalize_range(start, end):
+    iso_start = to_iso_date(start) if start else None
+    iso_end = to_iso_date(end) if end else None
+    if (start and not iso_start) or (end and not iso_end):
+        raise ValueError("Dates must be YYYY-MM-DD or MM/DD/YYYY")
+    if iso_start and iso_end and iso_start > iso_end:
+        raise ValueError("start must not be after end")
+    return iso_start, iso_end
+
+# Sort key condition for an optional date range on a "YYYY-MM-DD#..." style sort key.
+# "~" sorts after every character used in the keys, so it closes the range at the end of the last day.
+# An open end is closed at the last possible date, which keeps out undated "unknown..." keys.
+def date_range_condition(name, start, end, prefix=""):
+    if start and end:
+        return Key(name).between(f"{prefix}{start}", f"{prefix}{end}~")
+    if start:
+        return Key(name).between(f"{prefix}{start}", f"{prefix}9999-12-31~")
+    if end:
+        return Key(name).lte(f"{prefix}{end}~")
+    return None
+
+# Runs a list of Query requests one after another as a single paginated result set.
+# The cursor remembers which query we are on and where it stopped.
+def query_pages(table, queries, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    limit = clamp_page_size(limit)
+    position = decode_cursor(cursor) or {}
+    index = int(position.get('q', 0))
+    start_key = position.get('k')
+
+    items = []
+    while index < len(queries) and len(items) < limit:
+        kwargs = dict(queries[index], Limit=limit - len(items))
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key:
+            index += 1
+
+    if index >= len(queries):
+        return items, None
+    return items, encode_cursor({'q': index, 'k': start_key} if start_key else {'q': index})
+
+# Receipts between two dates (inclusive), oldest first, from the month index.
+def query_by_date_range(table, start, end, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    start, end = normalize_range(start, end)
+    if not start or not end:
+        raise ValueError("Both start and end dates are required")
+    queries = [{
+        'IndexName': MONTH_INDEX,
+        'KeyConditionExpression': Key('GSI1PK').eq(f"month#{month}") & date_range_condition('GSI1SK', start, end),
+    } for month in months_between(start, end)]
+    return query_pages(table, queries, limit, cursor)
+
+# Receipts of one expense category, optionally limited to a date range, oldest first.
+def query_by_category(table, category, start=None, end=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    start, end = normalize_range(start, end)
+    condition = Key('GSI2PK').eq(f"category#{category}")
+    range_condition = date_range_condition('GSI2SK', start, end)
+    if range_condition is not None:
+        condition = condition & range_condition
+    return query_pages(table, [{'IndexName': CATEGORY_INDEX, 'KeyConditionExpression': condition}], limit, cursor)
+
+# Receipts of one vendor from the base table, optionally limited to a date range and/or category.
+def query_by_vendor(table, vendor, start=None, end=None, category=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    start, end = normalize_range(start, end)
+    condition = Key('PK').eq(receipt_partition_key(vendor))
+    range_condition = date_range_condition('SK', start, end, prefix="receipt#")
+    condition = condition & (range_condition if range_condition is not None else Key('SK').begins_with("receipt#"))
+    query = {'KeyConditionExpression': condition}
+    if category:
+        query['FilterExpression'] = Attr('ExpenseType').eq(category)
+    return query_pages(table, [query], limit, cursor)
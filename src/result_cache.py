@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from instrumentation import get_logger
+
+# Environment overrides for the shared cache.
+CACHE_DIR_ENV = "RECEIPT_CACHE_DIR"
+CACHE_MAX_ENTRIES_ENV = "RECEIPT_CACHE_MAX_ENTRIES"
+CACHE_MAX_DISK_BYTES_ENV = "RECEIPT_CACHE_MAX_DISK_BYTES"
+
+log = get_logger("cache")
+
+# Builds the content address for a result: the image bytes plus the engine and its configuration,
+# so changing the pipeline or OCR settings never returns a stale result.
+def cache_key(image_bytes, engine, config=None):
+    digest = hashlib.sha256()
+    digest.update(engine.encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(json.dumps(config, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+# Two-tier cache for OCR and Textract results.
+# The memory tier is a bounded LRU; the optional disk tier stores one JSON file per key and evicts the
+# least recently used files once the directory grows past max_disk_bytes. Values must be JSON serializable.
+class ResultCache:
+    def __init__(self, max_entries=256, disk_dir=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'puts': 0, 'evictions': 0}
+
+    # Returns the cached value for key, or None on a miss.
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return self._memory[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+            self._remember(key, value)
+        return value
+
+    # Stores value under key in both tiers.
+    def put(self, key, value):
+        with self._lock:
+            self.counters['puts'] += 1
+            self._remember(key, value)
+        self._write_disk(key, value)
+
+    # Returns the cached value, or computes, stores and returns it on a miss.
+    # None results (failed calls) are not cached.
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    # Hit/miss counters plus the current size of each tier.
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = hits / lookups if lookups else 0.0
+        stats['disk_bytes'] = self._disk_bytes or 0
+        return stats
+
+    # Empties the memory tier (the disk tier is left alone).
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding='utf-8') as f:
+                value = json.load(f)
+            # Touch the file so eviction treats it as recently used
+            os.utime(path)
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding='utf-8') as f:
+                json.dump(value, f, default=str)
+            # Size of the file being replaced, so overwriting a key only adds the difference
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            log.warning("cache write failed", key=key, error=str(e))
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+            else:
+                self._disk_bytes += size - old_size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _disk_files(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    # Deletes the least recently used files until the disk tier is back under 90% of its budget.
+    def _evict_disk(self):
+        files = sorted(self._disk_files(), key=lambda f: f[2])
+        total = sum(size for _, size, _ in files)
+        target = self.max_disk_bytes * 0.9
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.counters['evictions'] += 1
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+# Bounded in-memory cache whose entries also expire after ttl seconds. Used as a read-through cache
+# in front of single-item DynamoDB reads; writers invalidate (or refresh) entries as they change them.
+class TTLCache:
+    def __init__(self, max_entries=1024, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, so a read that started before it cannot store a stale value
+        self._generation = 0
+        self.counters = {'hits': 0, 'misses': 0, 'expired': 0, 'fills': 0, 'stale_fills': 0,
+                         'invalidations': 0, 'evictions': 0}
+
+    # Returns the cached value for key, or None on a miss or when the entry has expired.
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return value
+                del self._entries[key]
+                self.counters['expired'] += 1
+            self.counters['misses'] += 1
+            return None
+
+    # Token to pass to fill() after loading a value from the backing store.
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    # Stores a loaded value unless something was invalidated since generation() was taken,
+    # in which case the loaded value may predate the write and is dropped.
+    def fill(self, key, value, generation):
+        with self._lock:
+            if generation != self._generation:
+                self.counters['stale_fills'] += 1
+                return False
+            self.counters['fills'] += 1
+            self._store(key, value)
+            return True
+
+    # Stores a value the caller just wrote, replacing any cached one.
+    def put(self, key, value):
+        with self._lock:
+            self._generation += 1
+            self._store(key, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self.counters['invalidations'] += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    # Returns the value for key, loading it with load() (and caching it, None excluded) on a miss.
+    def get_or_load(self, key, load):
+        value = self.get(key)
+        if value is None:
+            generation = self.generation()
+            value = load()
+            if value is not None:
+                self.fill(key, value, generation)
+        return value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _store(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+# Returns the process-wide cache, configured from the environment on first use.
+def get_default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache(
+                max_entries=int(os.environ.get(CACHE_MAX_ENTRIES_ENV, 256)),
+                disk_dir=os.environ.get(CACHE_DIR_ENV, os.path.join(os.getcwd(), 'cache')),
+                max_disk_bytes=int(os.environ.get(CACHE_MAX_DISK_BYTES_ENV, 256 * 1024 * 1024)),
+            )
+        return _default_cache
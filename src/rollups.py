@@ -0,0 +1,183 @@
+import argparse
+import os
+import time
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+import boto3
+from boto3.dynamodb.conditions import Key
+from instrumentation import get_logger
+from receipts_db import AWS_REGION, RECEIPTS_TABLE_NAME, batch_put_items, format_write_summary, parallel_scan, to_iso_date
+
+# Spending rollups live in their own table so scans of ReceiptsTable never see them.
+# All rollup items share one partition, so the whole dashboard summary is a single Query:
+#   PK = "rollup", SK = "all" | "month#YYYY-MM" | "category#<type>" | "vendor#<name>"
+#   TotalSpent (sum of receipt totals) and ReceiptCount, both maintained with ADD.
+ROLLUPS_TABLE_NAME = os.environ.get("ROLLUPS_TABLE_NAME", "ReceiptRollups")
+ROLLUP_PK = "rollup"
+DIMENSIONS = ("month", "category", "vendor")
+
+log = get_logger("rollups")
+
+# Receipt total as a Decimal; receipts confirmed in the app use TotalAmount, imported ones TotalSpent.
+def receipt_amount(item):
+    value = item.get('TotalAmount', item.get('TotalSpent'))
+    if value is None:
+        return Decimal(0)
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return Decimal(0)
+
+# Sort keys of the rollups a receipt counts towards.
+def rollup_keys(item):
+    month = item.get('TxnMonth')
+    if not month:
+        iso_date = to_iso_date(item.get('TransactionDate') or item.get('Date'))
+        month = iso_date[:7] if iso_date else 'unknown'
+    return [
+        "all",
+        f"month#{month}",
+        f"category#{item.get('ExpenseType') or 'Other'}",
+        f"vendor#{item.get('VendorName') or 'unknown'}",
+    ]
+
+# Net change to each rollup when old_item is replaced by new_item (either may be None).
+# Returns {sort key: (amount delta, count delta)} without the rollups that do not change.
+def rollup_deltas(old_item=None, new_item=None):
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for item, sign in ((old_item, -1), (new_item, 1)):
+        if not item:
+            continue
+        amount = receipt_amount(item)
+        for key in rollup_keys(item):
+            deltas[key][0] += sign * amount
+            deltas[key][1] += sign
+    return {key: (amount, count) for key, (amount, count) in deltas.items() if amount or count}
+
+# Merges the deltas of many receipt changes.
+def merge_deltas(changes):
+    merged = defaultdict(lambda: [Decimal(0), 0])
+    for old_item, new_item in changes:
+        for key, (amount, count) in rollup_deltas(old_item, new_item).items():
+            merged[key][0] += amount
+            merged[key][1] += count
+    return {key: (amount, count) for key, (amount, count) in merged.items() if amount or count}
+
+# Applies deltas with ADD update expressions. Each rollup is updated atomically on the server,
+# so concurrent requests never overwrite each other's changes.
+def apply_deltas(table, deltas):
+    for key, (amount, count) in deltas.items():
+        table.update_item(
+            Key={'PK': ROLLUP_PK, 'SK': key},
+            UpdateExpression="ADD TotalSpent :amount, ReceiptCount :count",
+            ExpressionAttributeValues={':amount': amount, ':count': count},
+        )
+
+# Updates the rollups for one receipt change. Failures are logged rather than raised: the receipt
+# itself has been written, and `python rollups.py rebuild` corrects any drift.
+def record_change(table, old_item=None, new_item=None):
+    try:
+        apply_deltas(table, rollup_deltas(old_item, new_item))
+    except Exception as e:
+        log.error("rollup update failed", error=str(e))
+
+# Same as record_change for a batch of (old item, new item) pairs.
+def record_changes(table, changes):
+    try:
+        apply_deltas(table, merge_deltas(changes))
+    except Exception as e:
+        log.error("rollup update failed", error=str(e))
+
+# Reads every rollup (one paginated Query) and groups them for the dashboard.
+def get_summary(table):
+    summary = {'total': Decimal(0), 'count': 0, 'by_month': {}, 'by_category': {}, 'by_vendor': {}}
+    kwargs = {'KeyConditionExpression': Key('PK').eq(ROLLUP_PK)}
+    while True:
+        response = table.query(**kwargs)
+        for item in response.get('Items', []):
+            count = int(item.get('ReceiptCount', 0))
+            if count <= 0:
+                continue
+            entry = {'total': item.get('TotalSpent', Decimal(0)), 'count': count}
+            if item['SK'] == "all":
+                summary['total'], summary['count'] = entry['total'], count
+            else:
+                dimension, _, name = item['SK'].partition("#")
+                summary[f"by_{dimension}"][name] = entry
+        if 'LastEvaluatedKey' not in response:
+            return summary
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+# Recomputes every rollup from the receipts and overwrites the rollup table with the result.
+# Changes made while the rebuild runs can be lost, so run it when the app is idle.
+def rebuild(receipts_table_name=RECEIPTS_TABLE_NAME, rollups_table_name=ROLLUPS_TABLE_NAME, segments=4):
+    start = time.perf_counter()
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    receipts = 0
+    for item in parallel_scan(receipts_table_name, segments):
+        if not str(item.get('SK', '')).startswith('receipt#'):
+            continue
+        receipts += 1
+        amount = receipt_amount(item)
+        for key in rollup_keys(item):
+            totals[key][0] += amount
+            totals[key][1] += 1
+
+    items = [{'PK': ROLLUP_PK, 'SK': key, 'TotalSpent': amount, 'ReceiptCount': count}
+             for key, (amount, count) in totals.items()]
+    summary = batch_put_items(items, rollups_table_name)
+    print(f"Rollups: {format_write_summary(summary)}")
+
+    # Remove rollups (e.g. vendors) that no longer have any receipts
+    table = boto3.resource('dynamodb', region_name=AWS_REGION).Table(rollups_table_name)
+    stale = [item['SK'] for item in parallel_scan(rollups_table_name, 1) if item['SK'] not in totals]
+    with table.batch_writer() as writer:
+        for key in stale:
+            writer.delete_item(Key={'PK': ROLLUP_PK, 'SK': key})
+
+    print(f"Rebuilt {len(items)} rollups from {receipts} receipts in {time.perf_counter() - start:.2f}s, "
+          f"removed {len(stale)} stale rollups")
+    return summary
+
+# Creates the rollup table (on-demand capacity) if it does not exist yet.
+def create_table(table_name=ROLLUPS_TABLE_NAME):
+    client = boto3.client('dynamodb', region_name=AWS_REGION)
+    if table_name in client.list_tables()['TableNames']:
+        print(f"{table_name} already exists.")
+        return
+    client.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'PK', 'KeyType': 'HASH'}, {'AttributeName': 'SK', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'PK', 'AttributeType': 'S'},
+                              {'AttributeName': 'SK', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    client.get_waiter('table_exists').wait(TableName=table_name)
+    print(f"Created {table_name}.")
+
+# Maintenance commands for the spending rollups:
+#   python rollups.py create-table
+#   python rollups.py rebuild
+#   python rollups.py show
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["create-table", "rebuild", "show"])
+    ap.add_argument("--table", default=ROLLUPS_TABLE_NAME, help="rollup table")
+    ap.add_argument("--receipts-table", default=RECEIPTS_TABLE_NAME)
+    ap.add_argument("--segments", type=int, default=4, help="parallel scan segments for rebuild")
+    args = ap.parse_args()
+
+    if args.command == "create-table":
+        create_table(args.table)
+    elif args.command == "rebuild":
+        rebuild(args.receipts_table, args.table, args.segments)
+    else:
+        summary = get_summary(boto3.resource('dynamodb', region_name=AWS_REGION).Table(args.table))
+        print(f"Total: {summary['total']} over {summary['count']} receipts")
+        for dimension in DIMENSIONS:
+            print(f"By {dimension}:")
+            for name, entry in sorted(summary[f"by_{dimension}"].items()):
+                print(f"  {name}: {entry['total']} ({entry['count']})")
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,77 @@
-import boto3
-import uuid
-import os
-
-# AWS Configuration
-AWS_REGION = "us-east-1"
-S3_BUCKET_NAME = "receiptimagesfindex"
-
-# Initialize Boto3 Clients
-s3_client = boto3.client("s3", region_name=AWS_REGION)
-
-# uploads a receipt image to S3 and returns its public URL
-# Future task is to make sure the URL is NOT public, and only accessible to the user
-# When multiple user accounts have been implemented, uncomment relevant lines of code below and add 'user_id' to the def inputs
-def upload_receipt_to_s3(file_path):
-    # Current implementation (No User ID)
-    file_name = f"receipts/{uuid.uuid4()}_{os.path.basename(file_path)}"
-    
-    # Determine content type based on file extension
-    content_type = "image/jpeg" if file_path.lower().endswith((".jpg", ".jpeg")) else "image/png"
-    
-    # Future implementation (With User ID)
-    # file_name = f"receipts/{user_id}/{uuid.uuid4()}_{os.path.basename(file_path)}"
-    
-    # Upload file to S3
-    s3_client.upload_file(file_path, S3_BUCKET_NAME, file_name, ExtraArgs={'ContentType': content_type})
-
-    # Generate a public URL
-    image_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{file_name}"
-    
-    return image_url
-
-
+import boto3
+import uuid
+import os
+from botocore.exceptions import ClientError
+from instrumentation import instrument_aws, timed
+
+# AWS Configuration
+AWS_REGION = "us-east-1"
+S3_BUCKET_NAME = "receiptimagesfindex"
+
+# Initialize Boto3 Clients
+s3_client = instrument_aws(boto3.client("s3", region_name=AWS_REGION))
+
+# Picks the content type from the file extension
+def content_type_for(filename):
+    name = filename.lower()
+    if name.endswith((".jpg", ".jpeg")):
+        return "image/jpeg"
+    if name.endswith(".webp"):
+        return "image/webp"
+    return "image/png"
+
+# Builds a unique object key for a receipt image
+# Future implementation (With User ID): f"receipts/{user_id}/{uuid.uuid4()}_{os.path.basename(filename)}"
+def make_receipt_key(filename):
+    return f"receipts/{uuid.uuid4()}_{os.path.basename(filename)}"
+
+# Public URL of a receipt image in the bucket
+def receipt_url(file_name):
+    return f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{file_name}"
+
+# Object key behind a receipt image URL, or None if the URL is not in the bucket
+def receipt_key_from_url(image_url):
+    prefix = receipt_url("")
+    if not image_url or not image_url.startswith(prefix):
+        return None
+    return image_url[len(prefix):] or None
+
+# Checks whether a receipt image object exists in the bucket
+@timed("s3.exists")
+def receipt_exists(file_name):
+    try:
+        s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=file_name)
+        return True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+# uploads a receipt image to S3 and returns its public URL
+# source is either a file path or a readable file object (e.g. UploadBuffer.open()), in which case
+# filename gives the original name used for the object key and content type
+# file_name can be passed in to upload under a key that was generated (and handed out) beforehand
+# Future task is to make sure the URL is NOT public, and only accessible to the user
+# When multiple user accounts have been implemented, uncomment relevant lines of code below and add 'user_id' to the def inputs
+@timed("s3.upload")
+def upload_receipt_to_s3(source, filename=None, file_name=None):
+    if filename is None:
+        filename = source
+
+    # Current implementation (No User ID)
+    if file_name is None:
+        file_name = make_receipt_key(filename)
+    
+    # Determine content type based on file extension
+    content_type = content_type_for(filename)
+    
+    # Upload file to S3
+    if isinstance(source, str):
+        s3_client.upload_file(source, S3_BUCKET_NAME, file_name, ExtraArgs={'ContentType': content_type})
+    else:
+        s3_client.upload_fileobj(source, S3_BUCKET_NAME, file_name, ExtraArgs={'ContentType': content_type})
+
+    # Generate a public URL
+    image_url = receipt_url(file_name)
+    
+    return image_url
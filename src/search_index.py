@@ -0,0 +1,348 @@
+import argparse
+import atexit
+import bisect
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from instrumentation import get_logger
+from receipts_db import RECEIPTS_TABLE_NAME, parallel_scan, to_iso_date
+
+SEARCH_INDEX_PATH = os.environ.get("RECEIPT_SEARCH_INDEX", os.path.join(os.getcwd(), 'search_index.json.gz'))
+
+log = get_logger("search")
+
+# How much a match in each field counts towards a receipt's score.
+FIELD_WEIGHTS = {
+    'VendorName': 3.0,
+    'ExpenseType': 2.0,
+    'VendorAddress': 1.0,
+    'TotalAmount': 1.0,
+    'OcrText': 0.5,
+}
+
+# Score multipliers for inexact matches of a query term.
+PREFIX_FACTOR = 0.8
+FUZZY_FACTOR = 0.6
+
+# Bounds on how many index terms one query term may expand to.
+MAX_PREFIX_TERMS = 50
+MIN_FUZZY_LENGTH = 4
+
+# Stored with each receipt so results can be shown without reading DynamoDB.
+DISPLAY_FIELDS = ('VendorName', 'ExpenseType', 'TotalAmount', 'TxnDate')
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+# Lowercased alphanumeric tokens; amounts keep their decimals ("12.50").
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower()) if text is not None else []
+
+# Single-character deletions of a term, used to find terms within one typo of each other.
+def deletions(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+# True if a and b differ by at most one insertion, deletion, substitution or adjacent transposition.
+def within_one_edit(a, b):
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1 and
+                                  a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+# Terms that take part in typo-tolerant matching: words, not amounts or numbers, where one edit
+# usually means a different value rather than a typo.
+def fuzzy_term(term):
+    return len(term) >= MIN_FUZZY_LENGTH and not any(c.isdigit() for c in term)
+
+# Weighted terms of a receipt item: {term: weight}.
+def document_terms(item):
+    terms = defaultdict(float)
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(item.get(field)):
+            terms[token] += weight
+    return terms
+
+# In-memory inverted index over receipts.
+# postings maps each term to {doc id: weight}; a sorted term list answers prefix queries with a binary
+# search, and a map from one-deletion variants to terms answers typo-tolerant lookups (a bounded
+# SymSpell-style search, never a scan of the vocabulary). All updates are incremental.
+class SearchIndex:
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._keys = {}          # (PK, SK) -> doc id
+        self._docs = {}          # doc id -> {'key': [PK, SK], 'terms': {...}, 'display': {...}}
+        self._postings = {}      # term -> {doc id: weight}
+        self._sorted_terms = []
+        self._variants = defaultdict(set)
+        self._next_id = 0
+        self._dirty = False
+        self._saver = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    # Adds or replaces a receipt.
+    def add(self, item):
+        key = (item['PK'], item['SK'])
+        display = {field: item[field] for field in DISPLAY_FIELDS if item.get(field) is not None}
+        if 'TxnDate' not in display:
+            iso_date = to_iso_date(item.get('TransactionDate') or item.get('Date'))
+            if iso_date:
+                display['TxnDate'] = iso_date
+        self._add(key, dict(document_terms(item)), display)
+
+    def _add(self, key, terms, display):
+        with self._lock:
+            self._remove(key)
+            doc_id = self._next_id
+            self._next_id += 1
+            self._keys[key] = doc_id
+            self._docs[doc_id] = {'key': list(key), 'terms': terms, 'display': display}
+            for term, weight in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._add_term(term)
+                postings[doc_id] = weight
+            self._dirty = True
+
+    # Removes a receipt; unknown keys are ignored.
+    def remove(self, pk, sk):
+        with self._lock:
+            self._remove((pk, sk))
+
+    def _remove(self, key):
+        doc_id = self._keys.pop(key, None)
+        if doc_id is None:
+            return
+        doc = self._docs.pop(doc_id)
+        for term in doc['terms']:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                self._remove_term(term)
+        self._dirty = True
+
+    def _add_term(self, term):
+        bisect.insort(self._sorted_terms, term)
+        if fuzzy_term(term):
+            for variant in deletions(term) | {term}:
+                self._variants[variant].add(term)
+
+    def _remove_term(self, term):
+        index = bisect.bisect_left(self._sorted_terms, term)
+        if index < len(self._sorted_terms) and self._sorted_terms[index] == term:
+            del self._sorted_terms[index]
+        if fuzzy_term(term):
+            for variant in deletions(term) | {term}:
+                terms = self._variants.get(variant)
+                if terms is not None:
+                    terms.discard(term)
+                    if not terms:
+                        del self._variants[variant]
+
+    # Index terms a query term matches, each with its score factor: the exact term, terms it is a
+    # prefix of, and terms within one edit of it.
+    def expand(self, token):
+        matches = {}
+        if token in self._postings:
+            matches[token] = 1.0
+
+        start = bisect.bisect_left(self._sorted_terms, token)
+        for term in self._sorted_terms[start:start + MAX_PREFIX_TERMS + 1]:
+            if not term.startswith(token):
+                break
+            matches.setdefault(term, PREFIX_FACTOR)
+
+        if fuzzy_term(token):
+            candidates = set()
+            for variant in deletions(token) | {token}:
+                candidates |= self._variants.get(variant, set())
+            for term in candidates:
+                if term not in matches and within_one_edit(token, term):
+                    matches[term] = FUZZY_FACTOR
+        return matches
+
+    # Ranked search. Every query term must match (exactly, as a prefix or with one typo); receipts are
+    # ordered by score, then newest first. Returns (results for the page, total number of matches).
+    def search(self, query, limit=20, offset=0):
+        tokens = tokenize(query)
+        if not tokens:
+            return [], 0
+
+        with self._lock:
+            scores = None
+            for token in tokens:
+                token_scores = defaultdict(float)
+                for term, factor in self.expand(token).items():
+                    for doc_id, weight in self._postings[term].items():
+                        token_scores[doc_id] = max(token_scores[doc_id], weight * factor)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: score + token_scores[doc_id] for doc_id, score in scores.items()
+                              if doc_id in token_scores}
+                if not scores:
+                    return [], 0
+
+            # Newest first, then (stable) by score, so equal scores stay newest first
+            ranked = sorted(scores.items(), key=lambda s: self._docs[s[0]]['display'].get('TxnDate', ''), reverse=True)
+            ranked.sort(key=lambda s: s[1], reverse=True)
+            page = ranked[offset:offset + limit]
+            results = [{'PK': self._docs[doc_id]['key'][0], 'SK': self._docs[doc_id]['key'][1],
+                        'score': round(score, 3), **self._docs[doc_id]['display']} for doc_id, score in page]
+            return results, len(ranked)
+
+    # Writes the index as gzipped JSON: the vocabulary once, and each receipt's terms as vocabulary
+    # indexes. Derived structures (postings, prefix and typo maps) are rebuilt on load.
+    def save(self, path=None):
+        path = path or self.path
+        with self._lock:
+            vocabulary = list(self._sorted_terms)
+            positions = {term: i for i, term in enumerate(vocabulary)}
+            docs = [[doc['key'], [[positions[term], weight] for term, weight in doc['terms'].items()], doc['display']]
+                    for doc in self._docs.values()]
+            # Cleared before writing so changes made during the write mark the index dirty again
+            self._dirty = False
+
+        tmp_path = path + ".tmp"
+        try:
+            payload = json.dumps({'version': 1, 'terms': vocabulary, 'docs': docs}, separators=(',', ':'), default=str)
+            with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+                f.write(payload.encode('utf-8'))
+            os.replace(tmp_path, path)
+        except BaseException:
+            # Nothing was saved, keep the changes for the next save
+            self._dirty = True
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    # Loads a saved index. Returns False if there is none (or it cannot be read).
+    def load(self, path=None):
+        path = path or self.path
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            if os.path.exists(path):
+                log.error("search index load failed", path=path, error=str(e))
+            return False
+
+        # Bulk load: the saved vocabulary is already sorted, so the prefix and typo structures are
+        # built once instead of term by term
+        vocabulary = data['terms']
+        keys, docs, postings = {}, {}, {term: {} for term in vocabulary}
+        for doc_id, (key, terms, display) in enumerate(data['docs']):
+            keys[tuple(key)] = doc_id
+            doc_terms = {}
+            for i, weight in terms:
+                term = vocabulary[i]
+                doc_terms[term] = weight
+                postings[term][doc_id] = weight
+            docs[doc_id] = {'key': key, 'terms': doc_terms, 'display': display}
+
+        variants = defaultdict(set)
+        for term in vocabulary:
+            if fuzzy_term(term):
+                variants[term].add(term)
+                for variant in deletions(term):
+                    variants[variant].add(term)
+
+        with self._lock:
+            self._keys, self._docs, self._postings = keys, docs, postings
+            self._sorted_terms, self._variants, self._next_id = vocabulary, variants, len(docs)
+            self._dirty = False
+        return True
+
+    # Indexes every receipt in the table, replacing the current contents.
+    def rebuild(self, table_name=RECEIPTS_TABLE_NAME, segments=4):
+        fresh = SearchIndex(self.path)
+        for item in parallel_scan(table_name, segments):
+            if str(item.get('SK', '')).startswith('receipt#'):
+                fresh.add(item)
+        with self._lock:
+            self._keys, self._docs, self._postings = fresh._keys, fresh._docs, fresh._postings
+            self._sorted_terms, self._variants, self._next_id = fresh._sorted_terms, fresh._variants, fresh._next_id
+            self._dirty = True
+
+    # Saves the index every interval seconds while it has unsaved changes, and once more at exit.
+    def start_autosave(self, interval=30.0):
+        if self._saver is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.save_if_dirty()
+
+        self._saver = threading.Thread(target=loop, name="search-index-save", daemon=True)
+        self._saver.start()
+        atexit.register(self.save_if_dirty)
+
+    def save_if_dirty(self):
+        if self._dirty:
+            try:
+                self.save()
+            except OSError as e:
+                log.error("search index save failed", path=self.path, error=str(e))
+
+# Loads the saved index, or builds it from the table when there is none.
+def load_or_build(path=SEARCH_INDEX_PATH, table_name=RECEIPTS_TABLE_NAME):
+    index = SearchIndex(path)
+    start = time.perf_counter()
+    if index.load():
+        log.info("search index loaded", receipts=len(index), seconds=round(time.perf_counter() - start, 2))
+    else:
+        index.rebuild(table_name)
+        index.save()
+        log.info("search index built", receipts=len(index), seconds=round(time.perf_counter() - start, 2))
+    return index
+
+# Rebuild or query the search index:
+#   python search_index.py rebuild
+#   python search_index.py search "walmrt groceries"
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["rebuild", "search"])
+    ap.add_argument("query", nargs="?", default="")
+    ap.add_argument("--path", default=SEARCH_INDEX_PATH)
+    ap.add_argument("--table", default=RECEIPTS_TABLE_NAME)
+    ap.add_argument("--limit", type=int, default=20)
+    args = ap.parse_args()
+
+    if args.command == "rebuild":
+        index = SearchIndex(args.path)
+        start = time.perf_counter()
+        index.rebuild(args.table)
+        index.save()
+        print(f"Indexed {len(index)} receipts in {time.perf_counter() - start:.2f}s "
+              f"({os.path.getsize(args.path) / 1024:.0f} KB on disk)")
+        return
+
+    index = load_or_build(args.path, args.table)
+    start = time.perf_counter()
+    results, total = index.search(args.query, args.limit)
+    print(f"{total} matches in {(time.perf_counter() - start) * 1000:.2f} ms")
+    for result in results:
+        print(json.dumps(result, default=str))
+
+if __name__ == '__main__':
+    main()
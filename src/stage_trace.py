@@ -0,0 +1,92 @@
+import os
+import queue
+import threading
+import uuid
+import cv2
+from instrumentation import get_logger
+
+# Set RECEIPT_TRACE_DIR to turn tracing on without code changes, RECEIPT_TRACE_ASYNC=1 to write in the background.
+TRACE_DIR_ENV = "RECEIPT_TRACE_DIR"
+TRACE_ASYNC_ENV = "RECEIPT_TRACE_ASYNC"
+
+log = get_logger("trace")
+
+# Captures intermediate stage outputs for debugging. Tracing is off unless a base directory is given,
+# in which case every request gets its own sub directory so concurrent requests never share files.
+# Values passed to capture() may be callables; they are only evaluated when tracing is enabled.
+class StageTracer:
+    def __init__(self, base_dir=None, request_id=None, asynchronous=False):
+        self.enabled = base_dir is not None
+        self.request_id = request_id or uuid.uuid4().hex
+        self.output_dir = os.path.join(base_dir, self.request_id) if self.enabled else None
+        self._queue = None
+        self._writer = None
+
+        if self.enabled:
+            os.makedirs(self.output_dir, exist_ok=True)
+            if asynchronous:
+                self._queue = queue.Queue()
+                self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                self._writer.start()
+
+    # Records an image for the named stage.
+    def capture(self, name, img, ext=".jpg"):
+        if not self.enabled:
+            return
+        if callable(img):
+            img = img()
+        self._submit(os.path.join(self.output_dir, name + ext), img.copy() if self._queue else img)
+
+    # Records text output (e.g. the raw OCR result) for the named stage.
+    def capture_text(self, name, text, ext=".txt"):
+        if not self.enabled:
+            return
+        if callable(text):
+            text = text()
+        self._submit(os.path.join(self.output_dir, name + ext), text)
+
+    # Waits for pending background writes and stops the writer thread.
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _submit(self, path, payload):
+        if self._queue is not None:
+            self._queue.put((path, payload))
+        else:
+            write_payload(path, payload)
+
+    def _write_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                write_payload(*job)
+            except Exception as e:
+                log.error("trace write failed", path=job[0], error=str(e))
+
+# Writes a single traced payload to disk.
+def write_payload(path, payload):
+    if isinstance(payload, str):
+        with open(path, "w", encoding='utf-8') as out:
+            out.write(payload)
+    else:
+        cv2.imwrite(path, payload)
+
+# Builds a tracer from the environment, falling back to default_dir (None keeps tracing off).
+def tracer_from_env(default_dir=None, request_id=None):
+    base_dir = os.environ.get(TRACE_DIR_ENV) or default_dir
+    asynchronous = os.environ.get(TRACE_ASYNC_ENV, "0").lower() in ("1", "true", "yes")
+    return StageTracer(base_dir, request_id=request_id, asynchronous=asynchronous)
+
+# Shared disabled tracer used as the default argument for the preprocessing stages.
+NULL_TRACER = StageTracer()
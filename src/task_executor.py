@@ -0,0 +1,49 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import record_span
+
+# Shared, bounded pool for the blocking network calls made while handling a request (S3, Textract, ...).
+# Bounding it keeps a burst of uploads from opening an unbounded number of AWS connections.
+MAX_IO_WORKERS = int(os.environ.get("MAX_IO_WORKERS", 8))
+
+executor = ThreadPoolExecutor(max_workers=MAX_IO_WORKERS, thread_name_prefix="receipt-io")
+
+# Submits func to the shared pool and records how long it ran in timings[name] (seconds), and as a
+# "task.<name>" span. The timing is recorded even if the call raises, the exception is re-raised
+# through the future. The task runs in a copy of the caller's context, so its spans and logs are
+# attributed to the request that submitted it.
+def submit_timed(timings, name, func, *args, **kwargs):
+    def run():
+        start = time.perf_counter()
+        error = True
+        try:
+            result = func(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            timings[name] = time.perf_counter() - start
+            record_span(f"task.{name}", timings[name], error)
+    return executor.submit(contextvars.copy_context().run, run)
+
+# Calls callback once every future has finished, whatever the outcome. Used to release resources
+# (e.g. an upload buffer) that several tasks share, without blocking the request on the slowest task.
+def when_all_done(futures, callback):
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+# Formats task timings as a Server-Timing header value (durations in milliseconds).
+def server_timing_header(timings):
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
@@ -1,12 +1,15 @@
-from PIL import Image
-from pytesseract import pytesseract
-
-# Runs Tesseract OCR on the image and saves the result as a text file.
-def run_tesseract(input_file, output_file, language="eng"):
-    try:
-        with Image.open(input_file) as img:
-            image_data = pytesseract.image_to_string(img, lang=language, timeout=60, config="--psm 6")
-            with open(output_file, "w", encoding='utf-8') as out:
-                out.write(image_data)
-    except Exception as e:
-        print(f"Error running Tesseract OCR: {e}")
+import cv2
+from instrumentation import get_logger
+from ocr_backend import image_to_string
+
+log = get_logger("ocr")
+
+# Runs Tesseract OCR on the image (a file path or an OpenCV array) and saves the result as a text file.
+def run_tesseract(input_file, output_file, language="eng"):
+    try:
+        img = cv2.imread(input_file) if isinstance(input_file, str) else input_file
+        image_data = image_to_string(img, language=language, psm=6, timeout=60)
+        with open(output_file, "w", encoding='utf-8') as out:
+            out.write(image_data)
+    except Exception as e:
+        log.exception("tesseract failed", input=input_file if isinstance(input_file, str) else None)
@@ -0,0 +1,101 @@
+import io
+import os
+import tempfile
+
+# Uploads larger than this are rejected outright.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+
+# Uploads up to this size stay in memory, anything larger is spilled to a temporary file.
+SPILL_THRESHOLD = int(os.environ.get("UPLOAD_SPILL_THRESHOLD", 8 * 1024 * 1024))
+
+CHUNK_SIZE = 256 * 1024
+
+# Raised when an upload goes over MAX_UPLOAD_BYTES while it is being read.
+class UploadTooLarge(Exception):
+    pass
+
+# Holds an uploaded file after reading it from the request exactly once, so every consumer
+# (S3 archival, Textract, ...) shares the same data instead of re-reading a saved copy from disk.
+# Small uploads live in a single bytes object; large ones in a temporary file that is removed on close().
+# A buffer over a file someone else manages (owned=False) leaves the file in place on close().
+class UploadBuffer:
+    def __init__(self, filename, data=None, path=None, size=0, owned=True):
+        self.filename = filename
+        self.size = size
+        self._data = data
+        self._path = path
+        self._owned = owned
+
+    # Reads the stream in chunks, enforcing max_bytes as it goes.
+    @classmethod
+    def from_stream(cls, stream, filename, max_bytes=MAX_UPLOAD_BYTES, spill_threshold=SPILL_THRESHOLD):
+        chunks = []
+        size = 0
+        spill = None
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+
+                if spill is None and size > spill_threshold:
+                    spill = tempfile.NamedTemporaryFile(prefix="upload_", suffix=os.path.splitext(filename)[1],
+                                                        delete=False)
+                    spill.writelines(chunks)
+                    chunks = []
+
+                if spill is not None:
+                    spill.write(chunk)
+                else:
+                    chunks.append(chunk)
+        except BaseException:
+            if spill is not None:
+                spill.close()
+                os.remove(spill.name)
+            raise
+
+        if spill is not None:
+            spill.close()
+            return cls(filename, path=spill.name, size=size)
+        return cls(filename, data=b"".join(chunks), size=size)
+
+    # Wraps a werkzeug FileStorage from request.files.
+    @classmethod
+    def from_file_storage(cls, file, max_bytes=MAX_UPLOAD_BYTES, spill_threshold=SPILL_THRESHOLD):
+        return cls.from_stream(file.stream, file.filename, max_bytes, spill_threshold)
+
+    @property
+    def in_memory(self):
+        return self._path is None
+
+    # Returns the upload as bytes. In-memory uploads return the shared object without copying.
+    def getvalue(self):
+        if self._data is not None:
+            return self._data
+        with open(self._path, 'rb') as f:
+            return f.read()
+
+    # Returns a fresh readable file object positioned at the start of the upload.
+    def open(self):
+        if self._data is not None:
+            return io.BytesIO(self._data)
+        return open(self._path, 'rb')
+
+    # Frees the memory and removes the temporary file, if any (and owned).
+    def close(self):
+        self._data = None
+        if self._path is not None and self._owned:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+        self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,264 @@
+import argparse
+import difflib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+# Known vendor names, one JSON string per line. New names are appended as receipts are confirmed.
+VENDOR_LIST_PATH = os.environ.get("RECEIPT_VENDOR_LIST", os.path.join(os.getcwd(), 'vendors.jsonl'))
+
+# Words that do not tell vendors apart ("WALMART SUPERCENTER" is Walmart).
+STOP_WORDS = {
+    "the", "inc", "llc", "ltd", "co", "corp", "corporation", "company", "store", "stores", "supercenter",
+    "superstore", "market", "shop", "no", "number", "location",
+}
+
+# A raw name matches a known vendor when their similarity reaches this ratio (difflib, 0-1).
+MATCH_THRESHOLD = 0.85
+
+# Bounds on the fuzzy search: trigrams shared by more vendors than this are skipped when collecting
+# candidates, and only this many of the best-blocked candidates are compared in full.
+MAX_POSTING_SCAN = 2000
+MAX_CANDIDATES = 10
+MEMO_SIZE = 4096
+
+STORE_NUMBER_RE = re.compile(r"#\s*\d+|\bstore\s+\d+\b|\bno\.?\s*\d+\b", re.IGNORECASE)
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Normalized words of a vendor name: lowercase, store numbers, punctuation and stop words removed.
+# "WAL-MART #1234" -> ["wal", "mart"]
+def vendor_words(name):
+    text = STORE_NUMBER_RE.sub(" ", str(name).lower().replace("&", " and "))
+    words = [w for w in WORD_RE.findall(text.replace("'", "")) if w not in STOP_WORDS]
+    return words or WORD_RE.findall(str(name).lower())
+
+# Matching key of a vendor name: its normalized words run together ("wal mart" and "walmart" agree).
+def vendor_key(name):
+    return "".join(vendor_words(name))
+
+# Name shown for a vendor: the confirmed name without store numbers or extra whitespace.
+# "WAL-MART  #1234" -> "WAL-MART"
+def display_name(name):
+    cleaned = " ".join(STORE_NUMBER_RE.sub(" ", str(name)).split()).strip(" -,")
+    return cleaned or " ".join(str(name).split())
+
+def trigrams(key):
+    padded = f" {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# Matches raw OCR vendor strings to known canonical vendor names.
+# Exact matches on the normalized key are a dict lookup. Otherwise candidates are blocked with a
+# trigram inverted index (rarest trigrams first, very common ones skipped), and only the few best
+# candidates are scored with difflib, so lookups stay fast with tens of thousands of vendors.
+# Results are memoized; the memo is cleared whenever a vendor is added.
+class VendorIndex:
+    def __init__(self, names=(), path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._names = []                 # vendor id -> canonical name
+        self._keys = []                  # vendor id -> matching key
+        self._by_key = {}                # matching key -> vendor id
+        self._postings = defaultdict(list)
+        self._memo = OrderedDict()
+        self.counters = {'lookups': 0, 'memo_hits': 0, 'exact': 0, 'fuzzy': 0, 'prefix': 0, 'new': 0}
+        for name in names:
+            self.add(name, persist=False)
+
+    def __len__(self):
+        return len(self._names)
+
+    # Loads known vendors from a JSON lines file (missing file = no vendors yet).
+    @classmethod
+    def load(cls, path=VENDOR_LIST_PATH):
+        names = []
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        names.append(json.loads(line))
+        return cls(names, path)
+
+    # Adds a canonical vendor name (stored without store numbers, see display_name).
+    # Returns False if a vendor with the same key is already known.
+    def add(self, name, persist=True):
+        name = display_name(name)
+        key = vendor_key(name)
+        if not key:
+            return False
+        with self._lock:
+            if key in self._by_key:
+                return False
+            vendor_id = len(self._names)
+            self._names.append(name)
+            self._keys.append(key)
+            self._by_key[key] = vendor_id
+            for gram in trigrams(key):
+                self._postings[gram].append(vendor_id)
+            self._memo.clear()
+            if persist and self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(name) + "\n")
+        return True
+
+    # Returns (canonical name, score, how it matched). Unmatched names come back cleaned up but
+    # otherwise unchanged, with score 0 and match "new".
+    def match(self, raw_name):
+        with self._lock:
+            self.counters['lookups'] += 1
+            memo = self._memo.get(raw_name)
+            if memo is not None:
+                self._memo.move_to_end(raw_name)
+                self.counters['memo_hits'] += 1
+                return memo
+
+            result = self._match(raw_name)
+            self.counters[result[2]] += 1
+            self._memo[raw_name] = result
+            if len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+            return result
+
+    def _match(self, raw_name):
+        words = vendor_words(raw_name)
+        key = "".join(words)
+        cleaned = " ".join(str(raw_name).split())
+        if not key:
+            return cleaned, 0.0, 'new'
+
+        vendor_id = self._by_key.get(key)
+        if vendor_id is not None:
+            return self._names[vendor_id], 1.0, 'exact'
+
+        # A known vendor followed by extra words (a branch or city): "WALMART ROGERS AR"
+        for n in range(len(words) - 1, 0, -1):
+            vendor_id = self._by_key.get("".join(words[:n]))
+            if vendor_id is not None and len(self._keys[vendor_id]) >= 4:
+                return self._names[vendor_id], 0.9, 'prefix'
+
+        # Trigram blocking: count shared trigrams, rarest first, skipping trigrams most vendors share
+        counts = defaultdict(int)
+        grams = sorted(trigrams(key), key=lambda g: len(self._postings.get(g, ())))
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if not postings:
+                continue
+            if len(postings) > MAX_POSTING_SCAN and counts:
+                break
+            for candidate in postings[:MAX_POSTING_SCAN]:
+                counts[candidate] += 1
+
+        best = (cleaned, 0.0, 'new')
+        candidates = sorted(counts.items(), key=lambda c: -c[1])[:MAX_CANDIDATES]
+        for candidate, _ in candidates:
+            score = difflib.SequenceMatcher(None, key, self._keys[candidate]).ratio()
+            if score >= MATCH_THRESHOLD and score > best[1]:
+                best = (self._names[candidate], score, 'fuzzy')
+        return best
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['vendors'] = len(self._names)
+            stats['memo_entries'] = len(self._memo)
+        return stats
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+# Returns the process-wide vendor index, loaded from VENDOR_LIST_PATH on first use.
+def get_vendor_index():
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = VendorIndex.load(VENDOR_LIST_PATH)
+        return _default_index
+
+# Replaces the extracted VendorName with its canonical form and keeps the original as RawVendorName.
+def canonicalize_receipt(receipt_data, index=None):
+    raw_name = receipt_data.get('VendorName')
+    if not raw_name:
+        return receipt_data
+    if index is None:
+        index = get_vendor_index()
+    canonical, score, how = index.match(raw_name)
+    receipt_data['RawVendorName'] = raw_name
+    receipt_data['VendorName'] = canonical
+    receipt_data['VendorMatch'] = how
+    return receipt_data
+
+# Vendor name to learn from a receipt the user confirmed, or None. An extracted name that matched no
+# known vendor and comes back unchanged was never confirmed by the user, so it is not learned.
+def confirmed_vendor_name(receipt):
+    name = receipt.get('VendorName')
+    if not name:
+        return None
+    if receipt.get('VendorMatch') == 'new' and name == " ".join(str(receipt.get('RawVendorName', '')).split()):
+        return None
+    return name
+
+# Times lookups against a synthetic list of vendors
+def benchmark(vendors, lookups=2000):
+    import random
+    rng = random.Random(0)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    names = sorted({"".join(rng.choice(letters) for _ in range(rng.randint(5, 12))).title() +
+                    rng.choice(["", " Market", " Grill", " Pharmacy", " Supply"]) for _ in range(vendors)})
+
+    start = time.perf_counter()
+    index = VendorIndex(names)
+    print(f"Indexed {len(index)} vendors in {time.perf_counter() - start:.2f}s")
+
+    queries = []
+    for name in rng.sample(names, min(lookups, len(names))):
+        i = rng.randrange(len(name))
+        variant = rng.choice([name.upper(), f"{name} #{rng.randint(1, 9999)}", name[:i] + name[i + 1:]])
+        queries.append(variant)
+
+    start = time.perf_counter()
+    results = [index.match(q) for q in queries]
+    elapsed = time.perf_counter() - start
+    matched = sum(1 for r in results if r[2] != 'new')
+    print(f"{len(queries)} lookups: {elapsed / len(queries) * 1000:.3f} ms each, {matched} matched")
+
+    start = time.perf_counter()
+    for q in queries:
+        index.match(q)
+    print(f"memoized: {(time.perf_counter() - start) / len(queries) * 1000:.4f} ms each")
+
+# Canonicalize vendor names from the command line, or benchmark the index:
+#   python vendor_names.py match "WAL-MART #1234" "Walmart Supercenter"
+#   python vendor_names.py add "Walmart"
+#   python vendor_names.py seed             (learn the vendors already in ReceiptsTable)
+#   python vendor_names.py bench --vendors 30000
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["match", "add", "seed", "bench"])
+    ap.add_argument("names", nargs="*")
+    ap.add_argument("--path", default=VENDOR_LIST_PATH, help="known vendor list (JSON lines)")
+    ap.add_argument("--vendors", type=int, default=30000, help="synthetic vendors for bench")
+    args = ap.parse_args()
+
+    if args.command == "bench":
+        benchmark(args.vendors)
+        return
+
+    index = VendorIndex.load(args.path)
+    if args.command == "seed":
+        from receipts_db import parallel_scan
+        added = sum(index.add(item['VendorName']) for item in parallel_scan(ProjectionExpression="VendorName")
+                    if item.get('VendorName'))
+        print(f"Added {added} vendors, {len(index)} known")
+        return
+
+    for name in args.names:
+        if args.command == "add":
+            print(f"{name}: {'added' if index.add(name) else 'already known'}")
+        else:
+            canonical, score, how = index.match(name)
+            print(f"{name} -> {canonical} ({how}, {score:.2f})")
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,141 @@
-import boto3
-import pandas as pd
-import matplotlib.pyplot as plt
-
-#initialize dynamoDB resource
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-
-# query the Receipt table
-receipt_table = dynamodb.Table('Receipt')
-
-# scan table to retrieve all items
-response = receipt_table.scan()
-items = response['Items']
-
-# extract 'total' values from the items
-totals = [item['Total'] for item in items]
-
-print(totals) # verifying that the totals are being properly extracted, delete this eventually
-
-######### down here is where visualization starts ###########
-
-# labels for the pie chart
-labels = [item.get('ReceiptID', 'Unknown') for item in items]
-
-# create the pie chart
-plt.pie(totals, labels=labels, autopct='%1.1f%%', startangle=90)
-
-# equal aspect ratio ensures that the pie chart is drawn as a circle
-plt.axis('equal')
-
-# show the pie chart
-plt.show()
+import argparse
+import io
+import time
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # render to bytes, never open a window
+from matplotlib.figure import Figure
+from receipts_db import RECEIPTS_TABLE_NAME, parallel_scan, to_iso_date
+from rollups import receipt_amount
+
+CHART_KINDS = ("category", "month", "vendor")
+CHART_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+# Vendors beyond this many are grouped as "Other" in the vendor chart.
+MAX_VENDOR_SLICES = 10
+
+# Maps repeated strings to small integer codes while streaming, so each receipt costs a few ints
+# instead of a dict; the codes become a pandas Categorical at the end.
+class Codebook:
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+# Streams every receipt page from DynamoDB into a columnar frame:
+#   vendor, category (categorical), date (datetime64, NaT when unknown),
+#   amount_cents (int64, exact) and amount (float64, for plotting).
+# Items are reduced to column values as they arrive and are never kept as dicts.
+# items can be any iterable of receipt items to use instead of scanning the table.
+# With include_keys the frame also has pk, sk and updated_at columns (used by receipt_snapshot).
+def load_receipts_frame(table_name=RECEIPTS_TABLE_NAME, segments=1, items=None, include_keys=False):
+    vendors, categories, dates = Codebook(), Codebook(), Codebook()
+    vendor_codes, category_codes, date_codes = [], [], []
+    cents = []
+    keys = {'pk': [], 'sk': [], 'updated_at': []}
+
+    for item in items if items is not None else parallel_scan(table_name, segments):
+        if not str(item.get('SK', '')).startswith('receipt#'):
+            continue
+        vendor_codes.append(vendors.code(item.get('VendorName') or 'unknown'))
+        category_codes.append(categories.code(item.get('ExpenseType') or 'Other'))
+        date_codes.append(dates.code(item.get('TxnDate') or to_iso_date(item.get('TransactionDate') or item.get('Date'))))
+        cents.append(int((receipt_amount(item) * 100).to_integral_value()))
+        if include_keys:
+            keys['pk'].append(item['PK'])
+            keys['sk'].append(item['SK'])
+            keys['updated_at'].append(item.get('UpdatedAt', ''))
+
+    unique_dates = pd.to_datetime(pd.Series(dates.values, dtype=object), format="%Y-%m-%d")
+    frame = pd.DataFrame({
+        'vendor': pd.Categorical.from_codes(np.asarray(vendor_codes, dtype=np.int32), vendors.values),
+        'category': pd.Categorical.from_codes(np.asarray(category_codes, dtype=np.int32), categories.values),
+        'date': unique_dates.to_numpy()[np.asarray(date_codes, dtype=np.intp)],
+        'amount_cents': np.asarray(cents, dtype=np.int64),
+    })
+    frame['amount'] = frame['amount_cents'].to_numpy(dtype=np.float64) / 100.0
+    if include_keys:
+        for name, values in keys.items():
+            frame[name] = pd.Series(values, dtype=object)
+    return frame
+
+# Total spending (float dollars) per value of column, largest first.
+def spending_by(frame, column):
+    totals = frame.groupby(column, observed=True)['amount_cents'].sum() / 100.0
+    return totals.sort_values(ascending=False)
+
+# Total spending per calendar month, in chronological order. Receipts without a date are left out.
+def spending_by_month(frame):
+    dated = frame.dropna(subset=['date'])
+    totals = dated.groupby(dated['date'].dt.to_period('M'))['amount_cents'].sum() / 100.0
+    totals.index = totals.index.astype(str)
+    return totals.sort_index()
+
+# Totals for one chart kind, with small vendors folded into "Other".
+def chart_data(frame, kind):
+    if kind == "month":
+        return spending_by_month(frame)
+    totals = spending_by(frame, kind)
+    if kind == "vendor" and len(totals) > MAX_VENDOR_SLICES:
+        other = totals.iloc[MAX_VENDOR_SLICES:].sum()
+        totals = pd.concat([totals.iloc[:MAX_VENDOR_SLICES], pd.Series({'Other': other})])
+    return totals
+
+# Renders a chart of the frame as PNG or SVG bytes: a pie chart per category or vendor,
+# a bar chart per month. Uses a standalone Figure, so it is safe to call from request threads.
+def render_chart(frame, kind="category", fmt="png"):
+    if kind not in CHART_KINDS:
+        raise ValueError(f"Unknown chart kind: {kind}")
+    if fmt not in CHART_FORMATS:
+        raise ValueError(f"Unknown chart format: {fmt}")
+
+    totals = chart_data(frame, kind)
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    if totals.empty:
+        ax.text(0.5, 0.5, "No receipts", ha='center', va='center')
+        ax.axis('off')
+    elif kind == "month":
+        ax.bar(totals.index, totals.to_numpy())
+        ax.set_ylabel("Spent ($)")
+        ax.tick_params(axis='x', labelrotation=45)
+    else:
+        ax.pie(totals.to_numpy(), labels=totals.index, autopct='%1.1f%%', startangle=90)
+        # equal aspect ratio ensures that the pie chart is drawn as a circle
+        ax.axis('equal')
+    ax.set_title(f"Spending by {kind}")
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt)
+    return buffer.getvalue()
+
+# Loads every receipt and writes one chart per kind, e.g. spending_category.png
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--table", default=RECEIPTS_TABLE_NAME)
+    ap.add_argument("--segments", type=int, default=4, help="parallel scan segments")
+    ap.add_argument("--format", choices=sorted(CHART_FORMATS), default="png")
+    ap.add_argument("--output-dir", default=".")
+    args = ap.parse_args()
+
+    start = time.perf_counter()
+    frame = load_receipts_frame(args.table, args.segments)
+    print(f"Loaded {len(frame)} receipts in {time.perf_counter() - start:.2f}s "
+          f"({frame.memory_usage(deep=True).sum() / 1024:.0f} KB)")
+
+    for kind in CHART_KINDS:
+        path = f"{args.output_dir}/spending_{kind}.{args.format}"
+        with open(path, 'wb') as f:
+            f.write(render_chart(frame, kind, args.format))
+        print(f"Wrote {path}")
+
+if __name__ == '__main__':
+    main()